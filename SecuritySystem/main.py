@@ -1,6 +1,7 @@
-from modules.web.app import app, init_db
-
 if __name__ == '__main__':
+    # Imported here: spawned analytics worker processes import this module
+    # as well and must not start a second copy of the app.
+    from modules.web.app import app, init_db
     init_db()
     app.run(debug=False, host='0.0.0.0', port=5000, threaded=True)
-    
+
@@ -0,0 +1,70 @@
+import math
+
+DEFAULT_TARGET_MS = 120.0
+DEFAULT_SCALE = 0.25
+
+
+class AdaptiveScaler:
+    # HOG detection cost grows with the number of pixels, i.e. with scale^2,
+    # so the next scale is the current one times sqrt(target / measured),
+    # smoothed and rate-limited to avoid oscillating between frames.
+    def __init__(self, target_ms=DEFAULT_TARGET_MS, min_scale=0.15, max_scale=0.6,
+                 initial_scale=DEFAULT_SCALE, focus_scale=0.5, focus_margin=0.5,
+                 smoothing=0.3, max_step=0.05, deadband=0.15):
+        self.target_ms = target_ms
+        self.min_scale = min_scale
+        self.max_scale = max_scale
+        self.scale = initial_scale
+        self.focus_scale = focus_scale
+        self.focus_margin = focus_margin
+        self.smoothing = smoothing
+        self.max_step = max_step
+        self.deadband = deadband
+        self.avg_ms = None
+        self.last_ms = None
+
+    @property
+    def adaptive(self):
+        return self.target_ms is not None
+
+    def record(self, elapsed_ms):
+        self.last_ms = elapsed_ms
+        if self.avg_ms is None:
+            self.avg_ms = elapsed_ms
+        else:
+            self.avg_ms += self.smoothing * (elapsed_ms - self.avg_ms)
+
+        if not self.adaptive or self.avg_ms <= 0:
+            return self.scale
+
+        ratio = self.target_ms / self.avg_ms
+        if abs(ratio - 1.0) < self.deadband:
+            return self.scale
+
+        wanted = self.scale * math.sqrt(ratio)
+        step = max(-self.max_step, min(self.max_step, wanted - self.scale))
+        self.scale = max(self.min_scale, min(self.max_scale, self.scale + step))
+        return self.scale
+
+    def focus_regions(self, boxes, frame_shape):
+        # Regions around recently seen faces that are worth a second, sharper
+        # look while the global scale is turned down to hold the frame rate.
+        if self.focus_scale is None or self.focus_scale <= self.scale:
+            return []
+        h, w = frame_shape[:2]
+        regions = []
+        for top, right, bottom, left in boxes:
+            mw = int((right - left) * self.focus_margin)
+            mh = int((bottom - top) * self.focus_margin)
+            region = (max(0, top - mh), min(w, right + mw), min(h, bottom + mh), max(0, left - mw))
+            if region[1] > region[3] and region[2] > region[0]:
+                regions.append(region)
+        return regions
+
+    def stats(self):
+        return {
+            "scale": self.scale,
+            "target_ms": self.target_ms,
+            "avg_ms": self.avg_ms,
+            "last_ms": self.last_ms,
+        }
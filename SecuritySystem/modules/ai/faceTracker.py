@@ -0,0 +1,145 @@
+import cv2
+import numpy as np
+from modules.ai.galleryMatcher import UNKNOWN_NAME
+
+DEFAULT_DETECT_EVERY = 5
+DEFAULT_IOU_THRESHOLD = 0.3
+DEFAULT_MAX_MISSES = 2
+MIN_TRACK_POINTS = 4
+
+
+class FaceTrack:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box                  # (top, right, bottom, left), same as face_recognition
+        self.name = None                # None until the track has been encoded once
+        self.distance = None
+        self.encoding = None
+        self.misses = 0
+        self.points = None
+
+    @property
+    def needs_encoding(self):
+        return self.name is None or self.name == UNKNOWN_NAME
+
+
+def box_iou(a, b):
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class FaceTracker:
+    def __init__(self, detect_every=DEFAULT_DETECT_EVERY, iou_threshold=DEFAULT_IOU_THRESHOLD, max_misses=DEFAULT_MAX_MISSES):
+        self.detect_every = max(1, int(detect_every))
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frame_index = 0
+        self._next_id = 1
+        self._prev_gray = None
+        self._force_detection = True
+
+    def needs_detection(self):
+        return self._force_detection or self.frame_index % self.detect_every == 0
+
+    def update_detections(self, boxes, gray, scale=1.0):
+        # Associates fresh detections with existing tracks and returns the
+        # tracks whose identity still has to be computed (new or unknown).
+        # Boxes are in full-frame coordinates; `gray` is the tracking image,
+        # `scale` times the size of the full frame.
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for d, box in enumerate(boxes):
+                iou = box_iou(track.box, box)
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, t, d))
+        pairs.sort(reverse=True)
+
+        matched_tracks, matched_boxes = set(), set()
+        for _, t, d in pairs:
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            track = self.tracks[t]
+            track.box = tuple(int(v) for v in boxes[d])
+            track.misses = 0
+
+        kept = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            kept.append(track)
+
+        for d, box in enumerate(boxes):
+            if d not in matched_boxes:
+                kept.append(FaceTrack(self._next_id, tuple(int(v) for v in box)))
+                self._next_id += 1
+
+        self.tracks = kept
+        for track in self.tracks:
+            track.points = self._seed_points(gray, track.box, scale)
+        self._prev_gray = gray
+        self._force_detection = False
+        self.frame_index += 1
+        return [track for track in self.tracks if track.misses == 0 and track.needs_encoding]
+
+    def assign(self, tracks, names, distances, encodings=None):
+        if encodings is None:
+            encodings = [None] * len(tracks)
+        for track, name, distance, encoding in zip(tracks, names, distances, encodings):
+            track.name = name
+            track.distance = float(distance)
+            track.encoding = encoding
+
+    def propagate(self, gray, scale=1.0):
+        self.frame_index += 1
+        if self._prev_gray is None or self._prev_gray.shape != gray.shape or not self.tracks:
+            self._prev_gray = gray
+            return
+
+        h, w = gray.shape[0] / scale, gray.shape[1] / scale
+        kept = []
+        for track in self.tracks:
+            if track.points is None or len(track.points) < MIN_TRACK_POINTS:
+                self._force_detection = True
+                kept.append(track)
+                continue
+
+            new_points, status, _ = cv2.calcOpticalFlowPyrLK(
+                self._prev_gray, gray, track.points, None, winSize=(15, 15), maxLevel=2
+            )
+            good = status.ravel() == 1
+            if good.sum() < MIN_TRACK_POINTS:
+                # Lost the face between detections: keep the last box and
+                # ask for a full detection on the next frame.
+                track.points = None
+                self._force_detection = True
+                kept.append(track)
+                continue
+
+            dx, dy = np.median(new_points[good] - track.points[good], axis=0).ravel() / scale
+            top, right, bottom, left = track.box
+            dx = int(round(np.clip(dx, -left, w - right)))
+            dy = int(round(np.clip(dy, -top, h - bottom)))
+            track.box = (top + dy, right + dx, bottom + dy, left + dx)
+            track.points = new_points[good].reshape(-1, 1, 2)
+            kept.append(track)
+
+        self.tracks = kept
+        self._prev_gray = gray
+
+    def _seed_points(self, gray, box, scale):
+        top, right, bottom, left = (int(v * scale) for v in box)
+        mask = np.zeros(gray.shape[:2], dtype=np.uint8)
+        mask[max(0, top):max(0, bottom), max(0, left):max(0, right)] = 255
+        points = cv2.goodFeaturesToTrack(gray, maxCorners=20, qualityLevel=0.01, minDistance=3, mask=mask)
+        return points.astype(np.float32) if points is not None else None
@@ -1,146 +1,332 @@
 import cv2
 import face_recognition
-import pickle
 import os
+import time
 import numpy as np
-from picamera2 import Picamera2
-import io
-from PIL import Image
 from datetime import datetime
+from modules.ai.galleryMatcher import UNKNOWN_NAME
+from modules.ai.trainingManifest import scan_dataset, load_manifest, save_manifest, plan_update, make_entry, gallery_from_entries, file_sha1
+from modules.ai.trainingEngine import encode_images, DEFAULT_WORKERS
+from modules.ai.galleryStore import save_gallery, gallery_exists
+from modules.ai.galleryManager import GalleryManager
+from modules.ai.faceTracker import FaceTracker, DEFAULT_DETECT_EVERY, box_iou
+from modules.ai.adaptiveScaler import AdaptiveScaler, DEFAULT_TARGET_MS
+from modules.storage.imageWriter import image_writer
+from modules.ai.unknownClusters import unknown_faces
+from modules.storage.eventStore import event_store, FACE
+from modules.monitoring.metrics import metrics
 
 DATASET_PATH = os.path.expanduser("/home/webbywonder/raspberrypi-learning/SecuritySystem/data/faceData")
 ENCODINGS_PATH = os.path.expanduser("/home/webbywonder/raspberrypi-learning/SecuritySystem/data/encodings.pickle")
 CAPTURED_PATH = os.path.expanduser("/home/webbywonder/raspberrypi-learning/SecuritySystem/data/faceCaptured")
+GALLERY_PATH = os.path.expanduser("/home/webbywonder/raspberrypi-learning/SecuritySystem/data/gallery")
+MANIFEST_PATH = os.path.expanduser("/home/webbywonder/raspberrypi-learning/SecuritySystem/data/encodings_manifest.json")
+TRAINING_WORKERS = int(os.environ.get("TRAINING_WORKERS", DEFAULT_WORKERS))
+TRACK_SCALE = 0.25
+# Sightings that are not saved as images are logged at most this often per name.
+SIGHTING_COOLDOWN_S = 30.0
 
-def train_faces():
-    known_encodings = []
-    known_names = []
-    
-    print("Starting face training...")
+gallery_manager = GalleryManager(GALLERY_PATH, tolerance=0.6, legacy_pickle_path=ENCODINGS_PATH)
+
+def train_faces(incremental=True, workers=TRAINING_WORKERS, progress=None):
+    print("Starting incremental face training..." if incremental else "Starting face training...")
     
     if not os.path.exists(DATASET_PATH):
         print(f"Dataset path does not exist: {DATASET_PATH}")
         return {"encodings": [], "names": []}
     
-    for person_name in os.listdir(DATASET_PATH):
-        person_dir = os.path.join(DATASET_PATH, person_name)
-        if not os.path.isdir(person_dir):
-            continue
-            
-        print(f"Processing images for: {person_name}")
-        image_count = 0
-        
-        for image_file in os.listdir(person_dir):
-            if image_file.endswith((".jpg", ".png", ".jpeg")):
-                image_path = os.path.join(person_dir, image_file)
-                try:
-                    image = cv2.imread(image_path)
-                    if image is None:
-                        print(f"Could not load image: {image_path}")
-                        continue
-                        
-                    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-                    boxes = face_recognition.face_locations(rgb, model="hog")
-                    encodings = face_recognition.face_encodings(rgb, boxes)
-                    
-                    for encoding in encodings:
-                        known_encodings.append(encoding)
-                        known_names.append(person_name)
-                        image_count += 1
-                        
-                except Exception as e:
-                    print(f"Error processing {image_path}: {e}")
-        
-        print(f"Added {image_count} face encodings for {person_name}")
+    scanned = scan_dataset(DATASET_PATH)
+    entries = load_manifest(MANIFEST_PATH) if incremental and gallery_exists(GALLERY_PATH) else {}
+    unchanged, to_encode, removed = plan_update(entries, scanned)
     
-    data = {"encodings": known_encodings, "names": known_names}
+    print(f"{len(unchanged)} images unchanged, {len(to_encode)} to encode, {len(removed)} removed")
     
-    os.makedirs(os.path.dirname(ENCODINGS_PATH), exist_ok=True)
-    with open(ENCODINGS_PATH, "wb") as f:
-        f.write(pickle.dumps(data))
+    for rel_path in removed:
+        print(f"Dropping encodings for deleted image: {rel_path}")
+    
+    # Photos assigned from the unknown review queue were already encoded at
+    # capture time; reuse those encodings instead of running HOG again.
+    reused = {}
+    assigned = unknown_faces.assigned_encodings()
+    if assigned:
+        remaining = []
+        for image in to_encode:
+            sha1 = file_sha1(image["path"])
+            if sha1 in assigned:
+                reused[image["rel_path"]] = make_entry(image, [assigned[sha1]], sha1=sha1)
+            else:
+                remaining.append(image)
+        to_encode = remaining
+        if reused:
+            print(f"Reusing capture-time encodings for {len(reused)} assigned photos")
+    
+    counts = {"images_total": len(to_encode), "images_processed": 0, "encodings_added": 0, "images_removed": len(removed)}
+    if progress is not None:
+        progress(dict(counts))
+    
+    def report(result):
+        if result["error"]:
+            print(f"Error processing {result['rel_path']}: {result['error']}")
+        else:
+            print(f"Added {len(result['encodings'])} face encodings from {result['rel_path']} ({result['seconds']:.2f}s)")
+        counts["images_processed"] += 1
+        counts["encodings_added"] += len(result["encodings"])
+        if progress is not None:
+            progress(dict(counts))
+    
+    results, stats = encode_images(to_encode, workers=workers, on_result=report)
+    
+    updated = dict(unchanged)
+    updated.update(reused)
+    for image, result in zip(to_encode, results):
+        if result["error"] is None:
+            updated[image["rel_path"]] = make_entry(image, result["encodings"], sha1=result["sha1"])
+    
+    if to_encode:
+        print(f"Encoded {stats['images']} images on {stats['workers']} workers in {stats['elapsed_s']:.1f}s "
+              f"({stats['images_per_s']:.2f} images/s, {stats['mean_image_s']:.2f}s mean per image)")
+    
+    known_encodings, known_names = gallery_from_entries(updated)
+    data = {"encodings": [np.array(e) for e in known_encodings], "names": known_names}
+    
+    save_gallery(GALLERY_PATH, known_encodings, known_names)
+    save_manifest(MANIFEST_PATH, updated)
+    if assigned:
+        unknown_faces.retain_assigned({entry["sha1"] for entry in updated.values()})
+    gallery_manager.notify()
     
     print(f"Training complete! Total encodings: {len(known_encodings)}")
     return data
 
 class FacialRecognitionCamera:
-    def __init__(self, picam2_instance):
+    def __init__(self, picam2_instance, tracking=True, detect_every=DEFAULT_DETECT_EVERY, target_ms=DEFAULT_TARGET_MS,
+                 gallery=None, save_captures=True, recognizer=None):
         self.picam2 = picam2_instance
-        self.encodings_path = ENCODINGS_PATH
+        # Something with recognize(rgb) that does the work elsewhere (a
+        # RemoteRecognizer); this object then only annotates and saves.
+        self.recognizer = recognizer
+        self.tracker = FaceTracker(detect_every=detect_every) if tracking else None
+        self.scaler = AdaptiveScaler(target_ms=target_ms)
+        self._last_boxes = []
+        self.gallery_manager = gallery or gallery_manager
+        # Also covers events, so benchmark runs leave no trace in the database.
+        self.save_captures = save_captures
+        self._last_sighting = {}
+        # Set to a dict to collect per-stage milliseconds (see recognitionBenchmark).
+        self.timings = None
+        self._stage_histograms = {}
+        self._frames_metric = metrics.counter("ai_frames_total", "Frames run through face recognition")
+        self._faces_metric = metrics.counter("ai_faces_total", "Faces found in recognised frames")
+        self._errors_metric = metrics.counter("ai_errors_total", "Frames that failed face recognition")
         self.captured_today = set()       
         self.current_date = datetime.now().strftime("%Y-%m-%d")
+        self.gallery_manager.start()
+
+    @property
+    def matcher(self):
+        return self.gallery_manager.matcher
+
+    def stop(self):
+        if self.recognizer is not None:
+            self.recognizer.stop()
+        stop_camera = getattr(self.picam2, "stop", None)
+        if stop_camera is not None:
+            stop_camera()
+
+    def _lap(self, stage, started):
+        now = time.perf_counter()
+        histogram = self._stage_histograms.get(stage)
+        if histogram is None:
+            histogram = metrics.stage("ai", stage)
+            self._stage_histograms[stage] = histogram
+        histogram.observe(now - started)
+        if self.timings is not None:
+            self.timings[stage] = self.timings.get(stage, 0.0) + (now - started) * 1000.0
+        return now
+
+    def _detect(self, rgb, focus_boxes, luma=None):
+        # Returns face boxes in full-frame coordinates. The whole frame is
+        # searched at the adaptive scale; regions around recently seen faces
+        # get a second pass at the sharper focus scale. With a greyscale
+        # lores frame the search runs on that instead, never above its own
+        # resolution, so a bigger main frame does not make detection slower.
+        image = rgb if luma is None else luma
+        # Main-frame pixels per detection-image pixel, per axis: the lores
+        # stream need not have the main stream's aspect ratio.
+        rx = rgb.shape[1] / float(image.shape[1])
+        ry = rgb.shape[0] / float(image.shape[0])
+        scale = min(1.0, self.scaler.scale * rx)
+        t0 = time.perf_counter()
+        small = cv2.resize(image, (0, 0), fx=scale, fy=scale)
+        t0 = self._lap("resize", t0)
+        boxes = [(int(t * ry / scale), int(r * rx / scale), int(b * ry / scale), int(l * rx / scale))
+                 for t, r, b, l in face_recognition.face_locations(small, model="hog")]
+        t0 = self._lap("detect", t0)
         
-        if os.path.exists(self.encodings_path):
-            try:
-                with open(self.encodings_path, "rb") as f:
-                    self.data = pickle.loads(f.read())
-                print(f"Loaded {len(self.data['encodings'])} face encodings")
-            except Exception as e:
-                print(f"Error loading encodings: {e}")
-                self.data = {"encodings": [], "names": []}
+        for top, right, bottom, left in self.scaler.focus_regions(focus_boxes, rgb.shape):
+            focus_scale = min(1.0, self.scaler.focus_scale * rx)
+            region_top, region_left = int(top / ry), int(left / rx)
+            region = image[region_top:int(bottom / ry), region_left:int(right / rx)]
+            if region.size == 0:
+                continue
+            crop = cv2.resize(region, (0, 0), fx=focus_scale, fy=focus_scale)
+            t0 = self._lap("resize", t0)
+            locations = face_recognition.face_locations(crop, model="hog")
+            t0 = self._lap("detect", t0)
+            # Back to full-frame coordinates via the region's origin.
+            for (t, r, b, l) in locations:
+                box = (int((region_top + t / focus_scale) * ry), int((region_left + r / focus_scale) * rx),
+                       int((region_top + b / focus_scale) * ry), int((region_left + l / focus_scale) * rx))
+                if all(box_iou(box, other) < 0.3 for other in boxes):
+                    boxes.append(box)
+        return boxes
+
+    def _recognize(self, rgb, luma=None):
+        if self.recognizer is not None:
+            return self.recognizer.recognize(rgb, luma)
+        return self.recognize(rgb, luma)
+
+    def recognize(self, rgb, luma=None):
+        # `luma` is an optional greyscale lores copy of the frame used for
+        # detection and tracking; encodings always come from `rgb`.
+        # Read the matcher once so a gallery swap never lands mid-frame.
+        matcher = self.matcher
+        if self.tracker is None:
+            started = time.perf_counter()
+            boxes = self._detect(rgb, self._last_boxes, luma)
+            t0 = time.perf_counter()
+            encodings = face_recognition.face_encodings(rgb, boxes)
+            t0 = self._lap("encode", t0)
+            names, distances = matcher.match(encodings)
+            self._lap("match", t0)
+            self.scaler.record((time.perf_counter() - started) * 1000.0)
+            self._last_boxes = boxes
+            return boxes, names, list(distances), list(encodings)
+        
+        t0 = time.perf_counter()
+        if luma is None:
+            track_image = cv2.resize(rgb, (0, 0), fx=TRACK_SCALE, fy=TRACK_SCALE)
+            gray_track = cv2.cvtColor(track_image, cv2.COLOR_RGB2GRAY)
         else:
-            print("No face encodings found. Please train faces first.")
-            self.data = {"encodings": [], "names": []}
+            gray_track = cv2.resize(luma, (int(rgb.shape[1] * TRACK_SCALE), int(rgb.shape[0] * TRACK_SCALE)),
+                                    interpolation=cv2.INTER_AREA)
+        self._lap("track", t0)
+        if self.tracker.needs_detection():
+            started = time.perf_counter()
+            boxes = self._detect(rgb, [t.box for t in self.tracker.tracks], luma)
+            t0 = time.perf_counter()
+            pending = self.tracker.update_detections(boxes, gray_track, TRACK_SCALE)
+            t0 = self._lap("track", t0)
+            if pending:
+                encodings = face_recognition.face_encodings(rgb, [t.box for t in pending])
+                t0 = self._lap("encode", t0)
+                names, distances = matcher.match(encodings)
+                self._lap("match", t0)
+                self.tracker.assign(pending, names, distances, encodings)
+            self.scaler.record((time.perf_counter() - started) * 1000.0)
+        else:
+            t0 = time.perf_counter()
+            self.tracker.propagate(gray_track, TRACK_SCALE)
+            self._lap("track", t0)
+        
+        tracks = [t for t in self.tracker.tracks if t.name is not None]
+        return [t.box for t in tracks], [t.name for t in tracks], [t.distance for t in tracks], [t.encoding for t in tracks]
+
+    def _record_sighting(self, detection, media_path=None):
+        event_store.record(FACE, person=detection["name"], box=detection["box"], media_path=media_path,
+                           confidence=None if detection["distance"] is None else max(0.0, 1.0 - detection["distance"]),
+                           distance=detection["distance"])
+        self._last_sighting[detection["name"]] = time.time()
+
+    def _save_person_image(self, image, name, encoding=None, detection=None):
+        # Returns True when an image was queued; its event is logged once
+        # it has been written.
+        if not self.save_captures:
+            return False
 
-    def _save_person_image(self, image, name):
         today = datetime.now().strftime("%Y-%m-%d")
         
         if today != self.current_date:
             self.captured_today = set()
             self.current_date = today
 
-        if name in self.captured_today:
-            return  
+        # Unknown faces are saved once per day per unknown cluster rather
+        # than once per day in total, so the review queue sees each stranger.
+        # A new stranger gets its cluster reserved now, before the image is
+        # written, so the frames that follow see the capture as taken.
+        key = name
+        cluster_id = None
+        if name == UNKNOWN_NAME and encoding is not None:
+            cluster_id = unknown_faces.reserve(encoding)
+            key = (name, cluster_id)
+
+        if key in self.captured_today:
+            return False
 
         save_dir = os.path.join(CAPTURED_PATH, today)
-        os.makedirs(save_dir, exist_ok=True)
         timestamp = datetime.now().strftime("%H-%M-%S")
         filename = os.path.join(save_dir, f"{name}_{timestamp}.jpg")
 
-        try:
-            cv2.imwrite(filename, image)
-            print(f"[INFO] Saved full frame image for {name} at {filename}")
-            self.captured_today.add(name)
-        except Exception as e:
-            print(f"Error saving image for {name}: {e}")
+        def release():
+            self.captured_today.discard(key)
+            if cluster_id is not None:
+                unknown_faces.release(cluster_id)
+
+        def saved(path, ok):
+            if ok:
+                print(f"[INFO] Saved full frame image for {name} at {path}")
+                rel_path = os.path.join("faceCaptured", today, os.path.basename(path))
+                if detection is not None:
+                    self._record_sighting(detection, media_path=rel_path)
+                if cluster_id is not None:
+                    unknown_faces.add(rel_path, encoding, path, cluster_id=cluster_id)
+            else:
+                print(f"Error saving image for {name}")
+                # Dropped or failed: let a later frame of this face try again.
+                release()
+
+        # Claimed before submitting, so a quick failure can release it again.
+        self.captured_today.add(key)
+        # The frame keeps being annotated after this call, so the writer gets its own copy.
+        if not image_writer.submit(filename, image.copy(), on_done=saved):
+            release()
+            return False
+        return True
 
     def get_frame_with_recognition(self):
+        frame, _ = self.process_frame()
+        return frame
+
+    def process_frame(self):
         try:
-            frame = self.picam2.capture_array()
+            t0 = time.perf_counter()
+            if getattr(self.picam2, "has_lores", False):
+                (frame, luma), _ = self.picam2.capture_arrays(["main", "lores"])
+            else:
+                frame, luma = self.picam2.capture_array(), None
+            t0 = self._lap("capture", t0)
             
             if len(frame.shape) == 3 and frame.shape[2] == 3:
+                rgb = frame
                 image = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
             else:
+                rgb = cv2.cvtColor(frame, cv2.COLOR_GRAY2RGB)
                 image = frame
+            self._lap("convert", t0)
             
-            small_image = cv2.resize(image, (0, 0), fx=0.25, fy=0.25)
-            rgb_small = cv2.cvtColor(small_image, cv2.COLOR_BGR2RGB)
+            boxes, names, distances, encodings = self._recognize(rgb, luma)
             
-            boxes = face_recognition.face_locations(rgb_small, model="hog")
-            encodings = face_recognition.face_encodings(rgb_small, boxes)
-            
-            names = []
-            for encoding in encodings:
-                matches = face_recognition.compare_faces(
-                    self.data["encodings"], encoding, tolerance=0.6
-                )
-                name = "Unknown"
-                
-                if True in matches:
-                    matched_idxs = [i for (i, b) in enumerate(matches) if b]
-                    counts = {}
-                    for i in matched_idxs:
-                        face_name = self.data["names"][i]
-                        counts[face_name] = counts.get(face_name, 0) + 1
-                    name = max(counts, key=counts.get)
-                names.append(name)
-            
-            for ((top, right, bottom, left), name) in zip(boxes, names):
-                top *= 4
-                right *= 4
-                bottom *= 4
-                left *= 4
+            t0 = time.perf_counter()
+            detections = []
+            for ((top, right, bottom, left), name, distance, encoding) in zip(boxes, names, distances, encodings):
+                detection = {
+                    "name": name,
+                    "box": [int(top), int(right), int(bottom), int(left)],
+                    "distance": float(distance) if distance is not None and np.isfinite(distance) else None,
+                }
+                detections.append(detection)
                 
-                color = (0, 255, 0) if name != "Unknown" else (0, 0, 255)  
+                color = (0, 255, 0) if name != UNKNOWN_NAME else (0, 0, 255)  
                 
                 cv2.rectangle(image, (left, top), (right, bottom), color, 2)
                 
@@ -150,13 +336,23 @@ class FacialRecognitionCamera:
                 cv2.putText(image, name, (left + 6, top - 6), font, 0.6, (0, 0, 0), 1)
 
                 if len(names) > 0:  # Only save if at least one face is detected
-                    self._save_person_image(image, name)
+                    saved = self._save_person_image(image, name, encoding, detection)
+                    if (not saved and self.save_captures
+                            and time.time() - self._last_sighting.get(name, 0.0) >= SIGHTING_COOLDOWN_S):
+                        self._record_sighting(detection)
+            
+            t0 = self._lap("annotate", t0)
             
             ret, jpeg = cv2.imencode('.jpg', image)
+            self._lap("jpeg", t0)
+            self._frames_metric.inc()
+            if detections:
+                self._faces_metric.inc(len(detections))
             if ret:
-                return jpeg.tobytes()
-            return None
+                return jpeg.tobytes(), detections
+            return None, detections
             
         except Exception as e:
+            self._errors_metric.inc()
             print(f"Error in facial recognition: {e}")
-            return None
+            return None, []
@@ -0,0 +1,234 @@
+import sys
+import json
+import time
+import math
+import numpy as np
+
+EXACT = "exact"
+IVF = "ivf"
+AUTO = "auto"
+IVF_MIN_SIZE = 20000
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+
+
+def _sq_norms(x):
+    return np.einsum("ij,ij->i", x, x)
+
+
+def pairwise_distances(queries, vectors, vector_sq_norms=None):
+    if vector_sq_norms is None:
+        vector_sq_norms = _sq_norms(vectors)
+    d2 = queries @ vectors.T
+    d2 *= -2.0
+    d2 += _sq_norms(queries)[:, None]
+    d2 += vector_sq_norms[None, :]
+    np.maximum(d2, 0.0, out=d2)
+    return np.sqrt(d2, out=d2)
+
+
+class ExactIndex:
+    # Brute-force scan over the whole matrix: a single matrix product per
+    # frame, exact, and the fastest option for small and medium galleries.
+    kind = EXACT
+    dense = True
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self._sq_norms = _sq_norms(matrix)
+
+    def __len__(self):
+        return len(self.matrix)
+
+    def distances(self, queries):
+        return pairwise_distances(queries, self.matrix, self._sq_norms)
+
+    def search(self, queries):
+        dist = self.distances(queries)
+        rows = np.arange(len(self.matrix))
+        return [(rows, dist[i]) for i in range(len(queries))]
+
+
+class IVFIndex:
+    # Inverted-file index: vectors are partitioned by their nearest k-means
+    # centroid and a query only scans the `nprobe` closest partitions.
+    # `centroids` and `assignment` (each row's partition) saved with a
+    # gallery skip both k-means and the assignment pass.
+    kind = IVF
+    dense = False
+
+    def __init__(self, matrix, nlist=None, nprobe=DEFAULT_NPROBE, centroids=None, seed=0, assignment=None):
+        self.nprobe = nprobe
+        if centroids is None:
+            nlist = nlist or max(1, int(math.sqrt(len(matrix))))
+            centroids = _kmeans(matrix, nlist, seed=seed)
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self._centroid_sq_norms = _sq_norms(self.centroids)
+        self._list_rows = [np.empty(0, dtype=np.int64) for _ in range(len(self.centroids))]
+        self._list_vectors = [np.empty((0, self.centroids.shape[1]), dtype=np.float32) for _ in range(len(self.centroids))]
+        self._list_sq_norms = [np.empty(0, dtype=np.float32) for _ in range(len(self.centroids))]
+        self.assignment = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self.add(matrix, assignment)
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def __len__(self):
+        return self._size
+
+    def add(self, vectors, assignment=None):
+        # New rows are numbered after the existing ones, matching an append
+        # to the gallery matrix. Centroids are not retrained.
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        rows = np.arange(self._size, self._size + len(vectors))
+        if assignment is None:
+            assignment = self._nearest_lists(vectors, 1)[:, 0]
+        assignment = np.asarray(assignment, dtype=np.int32)
+        self.assignment = np.concatenate([self.assignment, assignment])
+        for l in np.unique(assignment):
+            members = assignment == l
+            self._list_rows[l] = np.concatenate([self._list_rows[l], rows[members]])
+            self._list_vectors[l] = np.ascontiguousarray(np.concatenate([self._list_vectors[l], vectors[members]]))
+            self._list_sq_norms[l] = _sq_norms(self._list_vectors[l])
+        self._size += len(vectors)
+
+    def _nearest_lists(self, queries, n):
+        dist = pairwise_distances(queries, self.centroids, self._centroid_sq_norms)
+        n = min(n, self.nlist)
+        if n == self.nlist:
+            return np.argsort(dist, axis=1)
+        return np.argpartition(dist, n - 1, axis=1)[:, :n]
+
+    def search(self, queries, nprobe=None):
+        probes = self._nearest_lists(queries, nprobe or self.nprobe)
+        results = []
+        for i, lists in enumerate(probes):
+            lists = [l for l in lists if len(self._list_rows[l])]
+            if not lists:
+                results.append((np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)))
+                continue
+            rows = np.concatenate([self._list_rows[l] for l in lists])
+            vectors = np.concatenate([self._list_vectors[l] for l in lists])
+            norms = np.concatenate([self._list_sq_norms[l] for l in lists])
+            results.append((rows, pairwise_distances(queries[i:i + 1], vectors, norms)[0]))
+        return results
+
+
+def _kmeans(matrix, k, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    data = matrix
+    if len(data) > KMEANS_SAMPLE:
+        data = matrix[rng.choice(len(matrix), KMEANS_SAMPLE, replace=False)]
+    data = np.asarray(data, dtype=np.float32)
+    k = max(1, min(k, len(data)))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmin(pairwise_distances(data, centroids), axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def train_ivf(matrix, nlist=None, seed=0):
+    # Centroids and per-row partitions for a gallery, computed when it is
+    # saved so that loading it never runs k-means.
+    index = IVFIndex(matrix, nlist=nlist, seed=seed)
+    return index.centroids, index.assignment
+
+
+def extend_ivf(centroids, vectors):
+    # Partitions for rows added since `centroids` were trained, through the
+    # same add() an index uses for new rows; the centroids are kept as-is.
+    index = IVFIndex(np.empty((0, centroids.shape[1]), dtype=np.float32), centroids=centroids)
+    index.add(vectors)
+    return index.assignment
+
+
+def build_index(matrix, kind=AUTO, nprobe=DEFAULT_NPROBE, ivf=None):
+    # `ivf` is the {"centroids", "assignment"} pair stored with the gallery,
+    # used as-is when it matches the matrix.
+    if kind == AUTO:
+        kind = IVF if len(matrix) >= IVF_MIN_SIZE else EXACT
+    if kind == EXACT:
+        return ExactIndex(matrix)
+    if kind == IVF:
+        if (ivf is not None and len(ivf["assignment"]) == len(matrix)
+                and ivf["centroids"].shape[1:] == matrix.shape[1:]):
+            return IVFIndex(matrix, nprobe=nprobe, centroids=ivf["centroids"], assignment=ivf["assignment"])
+        return IVFIndex(matrix, nprobe=nprobe)
+    raise ValueError(f"Unknown gallery index kind: {kind}")
+
+
+def synthetic_gallery(n, identities, dim=128, seed=0):
+    # Roughly face-like geometry: same-identity encodings ~0.4 apart,
+    # different identities well beyond the 0.6 match tolerance.
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(0.0, 0.09, (identities, dim)).astype(np.float32)
+    name_ids = rng.integers(0, identities, n)
+    matrix = centers[name_ids] + rng.normal(0.0, 0.025, (n, dim)).astype(np.float32)
+    return np.ascontiguousarray(matrix, dtype=np.float32), name_ids, centers
+
+
+def benchmark(sizes=(1000, 10000, 50000), nprobes=(1, 2, 4, 8, 16), n_queries=200, tolerance=0.6, seed=0):
+    rng = np.random.default_rng(seed + 1)
+    results = []
+    for n in sizes:
+        matrix, name_ids, centers = synthetic_gallery(n, max(10, n // 20), seed=seed)
+        picks = rng.integers(0, len(centers), n_queries)
+        queries = (centers[picks] + rng.normal(0.0, 0.025, (n_queries, matrix.shape[1]))).astype(np.float32)
+
+        # Queries are timed one at a time, as they arrive from a frame.
+        exact = ExactIndex(matrix)
+        started = time.perf_counter()
+        for i in range(n_queries):
+            exact.distances(queries[i:i + 1])
+        exact_ms = (time.perf_counter() - started) * 1000.0 / n_queries
+        exact_dist = exact.distances(queries)
+        exact_nearest = np.argmin(exact_dist, axis=1)
+        exact_within = exact_dist <= tolerance
+
+        started = time.perf_counter()
+        ivf = IVFIndex(matrix, seed=seed)
+        build_s = time.perf_counter() - started
+        results.append({"size": n, "index": EXACT, "nprobe": None, "ms_per_query": exact_ms,
+                        "recall_at_1": 1.0, "recall_within_tolerance": 1.0})
+
+        for nprobe in nprobes:
+            if nprobe > ivf.nlist:
+                continue
+            started = time.perf_counter()
+            found = [ivf.search(queries[i:i + 1], nprobe=nprobe)[0] for i in range(n_queries)]
+            ivf_ms = (time.perf_counter() - started) * 1000.0 / n_queries
+            hits_at_1 = 0
+            hits_within = 0
+            total_within = int(exact_within.sum())
+            for i, (rows, dist) in enumerate(found):
+                if len(rows) and rows[np.argmin(dist)] == exact_nearest[i]:
+                    hits_at_1 += 1
+                hits_within += int((dist <= tolerance).sum())
+            results.append({"size": n, "index": IVF, "nprobe": nprobe, "nlist": ivf.nlist,
+                            "build_s": build_s, "ms_per_query": ivf_ms,
+                            "recall_at_1": hits_at_1 / n_queries,
+                            "recall_within_tolerance": (hits_within / total_within) if total_within else 1.0})
+    return results
+
+
+if __name__ == "__main__":
+    rows = benchmark()
+    if "--json" in sys.argv:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'size':>7} {'index':>6} {'nprobe':>6} {'ms/query':>9} {'recall@1':>9} {'recall<=tol':>11}")
+        for r in rows:
+            print(f"{r['size']:>7} {r['index']:>6} {str(r['nprobe'] or '-'):>6} {r['ms_per_query']:>9.3f} "
+                  f"{r['recall_at_1']:>9.3f} {r['recall_within_tolerance']:>11.3f}")
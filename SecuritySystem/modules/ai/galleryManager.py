@@ -0,0 +1,104 @@
+import os
+import time
+import threading
+from modules.ai.galleryMatcher import GalleryMatcher, DEFAULT_TOLERANCE
+from modules.ai.galleryStore import load_gallery, gallery_exists, gallery_generation, migrate_pickle
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class GalleryManager:
+    # Owns the live GalleryMatcher. New gallery generations are loaded on a
+    # background thread and published by swapping a single reference, so a
+    # frame in progress keeps the matcher it started with and the next frame
+    # picks up the new one.
+    def __init__(self, gallery_path, tolerance=DEFAULT_TOLERANCE, legacy_pickle_path=None, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.gallery_path = gallery_path
+        self.tolerance = tolerance
+        self.legacy_pickle_path = legacy_pickle_path
+        self.poll_interval = poll_interval
+        self._active = (GalleryMatcher(tolerance=tolerance), None, None, None)
+        self._retired = None
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._running = False
+
+    @property
+    def matcher(self):
+        return self._active[0]
+
+    @property
+    def generation(self):
+        return self._active[1]
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._migrate_legacy()
+        if gallery_exists(self.gallery_path):
+            self._load()
+        else:
+            print("No face encodings found. Please train faces first.")
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+
+    def notify(self):
+        self._wake.set()
+
+    def _migrate_legacy(self):
+        if self.legacy_pickle_path is None or gallery_exists(self.gallery_path):
+            return
+        if not os.path.exists(self.legacy_pickle_path):
+            return
+        try:
+            migrate_pickle(self.legacy_pickle_path, self.gallery_path)
+        except Exception as e:
+            print(f"Error migrating {self.legacy_pickle_path}: {e}")
+
+    def _watch(self):
+        while self._running:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            if not self._running:
+                break
+            generation = gallery_generation(self.gallery_path)
+            if generation is not None and generation != self.generation:
+                self._load()
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            gallery = load_gallery(self.gallery_path)
+            matcher = GalleryMatcher.from_gallery(gallery, tolerance=self.tolerance)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Error loading encodings: {e}")
+            return False
+
+        load_ms = (time.perf_counter() - started) * 1000.0
+        # Keep the previous matcher alive until the next swap so its
+        # memory map is released here rather than on the frame thread.
+        self._retired = self._active
+        self._active = (matcher, gallery["generation"], load_ms, time.time())
+        self.last_error = None
+        print(f"[GALLERY] Loaded {len(matcher)} face encodings (generation {gallery['generation']}, {load_ms:.1f} ms)")
+        return True
+
+    def status(self):
+        matcher, generation, load_ms, loaded_at = self._active
+        return {
+            "generation": generation,
+            "encodings": len(matcher),
+            "identities": len(matcher.labels),
+            "load_ms": load_ms,
+            "loaded_at": loaded_at,
+            "last_error": self.last_error,
+        }
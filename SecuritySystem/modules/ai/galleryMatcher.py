@@ -0,0 +1,98 @@
+import numpy as np
+from modules.ai.galleryIndex import build_index, AUTO
+
+UNKNOWN_NAME = "Unknown"
+DEFAULT_TOLERANCE = 0.6
+
+
+class GalleryMatcher:
+    def __init__(self, encodings=None, names=None, tolerance=DEFAULT_TOLERANCE, index=AUTO):
+        self.tolerance = float(tolerance)
+        self.index_kind = index
+        self.set_gallery(encodings if encodings is not None else [], names if names is not None else [])
+
+    @classmethod
+    def from_gallery(cls, gallery, tolerance=DEFAULT_TOLERANCE, index=AUTO):
+        matcher = cls(tolerance=tolerance, index=index)
+        matcher.set_matrix(gallery["matrix"], gallery["name_ids"], gallery["labels"], ivf=gallery.get("ivf"))
+        return matcher
+
+    def set_gallery(self, encodings, names):
+        if len(encodings) != len(names):
+            raise ValueError(f"Got {len(encodings)} encodings but {len(names)} names")
+
+        labels = sorted(set(names))
+        label_ids = {label: i for i, label in enumerate(labels)}
+        name_ids = np.fromiter((label_ids[n] for n in names), dtype=np.int32, count=len(names))
+
+        if len(encodings):
+            matrix = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+        else:
+            matrix = np.empty((0, 128), dtype=np.float32)
+        self.set_matrix(matrix, name_ids, labels)
+
+    def set_matrix(self, matrix, name_ids, labels, ivf=None):
+        # Rows are grouped by identity so per-identity reductions become a
+        # single reduceat over contiguous column segments. Galleries loaded
+        # from galleryStore are already grouped and are used without a copy.
+        name_ids = np.asarray(name_ids)
+        if np.any(np.diff(name_ids) < 0):
+            order = np.argsort(name_ids, kind="stable")
+            matrix = matrix[order]
+            name_ids = name_ids[order]
+            # Saved IVF partitions follow the stored row order.
+            ivf = None
+        self.matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        self.name_ids = name_ids
+        self.labels = list(labels)
+        self.index = build_index(self.matrix, kind=self.index_kind, ivf=ivf)
+        if len(self.name_ids):
+            self._segment_starts = np.flatnonzero(np.r_[True, np.diff(self.name_ids) != 0])
+        else:
+            self._segment_starts = np.empty(0, dtype=np.intp)
+        self._segment_labels = [self.labels[self.name_ids[start]] for start in self._segment_starts]
+
+    def __len__(self):
+        return len(self.name_ids)
+
+    def distances(self, encodings):
+        queries = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+        return self.index.distances(queries)
+
+    def match(self, encodings):
+        n_faces = len(encodings)
+        if n_faces == 0:
+            return [], np.empty(0, dtype=np.float32)
+        if len(self) == 0:
+            return [UNKNOWN_NAME] * n_faces, np.full(n_faces, np.inf, dtype=np.float32)
+
+        queries = np.asarray(encodings, dtype=np.float32).reshape(n_faces, -1)
+        if self.index.dense:
+            dist = self.index.distances(queries)
+            within = dist <= self.tolerance
+            # votes[f, k]: gallery encodings of identity k within tolerance of face f
+            # nearest[f, k]: closest encoding of identity k to face f
+            votes = np.add.reduceat(within, self._segment_starts, axis=1, dtype=np.int32)
+            nearest = np.minimum.reduceat(dist, self._segment_starts, axis=1)
+            column_labels = self._segment_labels
+        else:
+            # Approximate index: only the probed candidates vote.
+            n_labels = len(self.labels)
+            votes = np.zeros((n_faces, n_labels), dtype=np.int32)
+            nearest = np.full((n_faces, n_labels), np.inf, dtype=np.float32)
+            for f, (rows, dist) in enumerate(self.index.search(queries)):
+                ids = self.name_ids[rows]
+                votes[f] = np.bincount(ids[dist <= self.tolerance], minlength=n_labels)
+                np.minimum.at(nearest[f], ids, dist)
+            column_labels = self.labels
+
+        # Most votes wins; ties go to the identity with the nearest encoding.
+        top_votes = votes.max(axis=1)
+        contenders = np.where(votes == top_votes[:, None], nearest, np.inf)
+        best = np.argmin(contenders, axis=1)
+        best_dist = nearest[np.arange(n_faces), best]
+
+        names = [column_labels[k] if top_votes[f] > 0 else UNKNOWN_NAME for f, k in enumerate(best)]
+        unknown = top_votes == 0
+        best_dist[unknown] = nearest[unknown].min(axis=1)
+        return names, best_dist
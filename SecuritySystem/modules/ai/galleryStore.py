@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import pickle
+import numpy as np
+from modules.ai.galleryIndex import train_ivf, extend_ivf, IVF_MIN_SIZE
+
+FORMAT_VERSION = 1
+INDEX_FILE = "index.json"
+ENCODING_DIM = 128
+
+
+def _matrix_file(generation):
+    return f"encodings.{generation}.npy"
+
+
+def _ids_file(generation):
+    return f"name_ids.{generation}.npy"
+
+
+def _centroids_file(generation):
+    return f"ivf_centroids.{generation}.npy"
+
+
+def _assignment_file(generation):
+    return f"ivf_assignment.{generation}.npy"
+
+
+def _write_durable(path, write):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_index(gallery_dir):
+    index_path = os.path.join(gallery_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path, "r") as f:
+        index = json.load(f)
+    if index.get("version") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported gallery format version {index.get('version')} in {gallery_dir}")
+    return index
+
+
+def gallery_generation(gallery_dir):
+    try:
+        index = read_index(gallery_dir)
+    except (OSError, ValueError, json.JSONDecodeError):
+        return None
+    return index["generation"] if index else None
+
+
+def gallery_exists(gallery_dir):
+    return os.path.exists(os.path.join(gallery_dir, INDEX_FILE))
+
+
+def _row_keys(matrix):
+    # One bytes object per row, for matching rows between generations.
+    matrix = np.ascontiguousarray(matrix)
+    return matrix.view(np.dtype((np.void, matrix.dtype.itemsize * matrix.shape[1]))).ravel().tolist()
+
+
+def _ivf_partitions(gallery_dir, previous, matrix):
+    # Centroids, per-row partitions and the gallery size the centroids were
+    # trained on. The previous generation's centroids are kept until the
+    # gallery grows past twice that size: rows carried over from it keep
+    # their partition and only the training delta is assigned.
+    ivf = previous.get("ivf") if previous else None
+    if ivf and ivf.get("trained_on") and len(matrix) <= 2 * ivf["trained_on"]:
+        try:
+            centroids = np.load(os.path.join(gallery_dir, ivf["centroids"]))
+            old_assignment = np.load(os.path.join(gallery_dir, ivf["assignment"]), mmap_mode="r")
+            old_matrix = np.load(os.path.join(gallery_dir, previous["matrix"]), mmap_mode="r")
+        except (OSError, ValueError) as e:
+            print(f"[GALLERY] Retraining IVF partitions, previous ones unreadable: {e}")
+        else:
+            if centroids.shape[1:] == matrix.shape[1:] and len(old_assignment) == len(old_matrix):
+                # Unchanged photos give byte-identical rows, wherever they sort to now.
+                carried = dict(zip(_row_keys(old_matrix), old_assignment.tolist()))
+                assignment = np.fromiter((carried.get(key, -1) for key in _row_keys(matrix)),
+                                         dtype=np.int32, count=len(matrix))
+                new = assignment < 0
+                if new.any():
+                    assignment[new] = extend_ivf(centroids, matrix[new])
+                return centroids, assignment, ivf["trained_on"]
+    centroids, assignment = train_ivf(matrix)
+    return centroids, assignment, len(matrix)
+
+
+def save_gallery(gallery_dir, encodings, names):
+    if len(encodings) != len(names):
+        raise ValueError(f"Got {len(encodings)} encodings but {len(names)} names")
+    os.makedirs(gallery_dir, exist_ok=True)
+
+    labels = sorted(set(names))
+    label_ids = {label: i for i, label in enumerate(labels)}
+    name_ids = np.fromiter((label_ids[n] for n in names), dtype=np.int32, count=len(names))
+    if len(encodings):
+        matrix = np.asarray(encodings, dtype=np.float32).reshape(len(encodings), -1)
+    else:
+        matrix = np.empty((0, ENCODING_DIM), dtype=np.float32)
+
+    # Stored grouped by identity so GalleryMatcher can use the mapped matrix as-is.
+    order = np.argsort(name_ids, kind="stable")
+    matrix = np.ascontiguousarray(matrix[order])
+    name_ids = np.ascontiguousarray(name_ids[order])
+
+    try:
+        previous = read_index(gallery_dir)
+    except (OSError, ValueError, json.JSONDecodeError):
+        previous = None
+    generation = (previous["generation"] if previous else 0) + 1
+    _write_durable(os.path.join(gallery_dir, _matrix_file(generation)), lambda f: np.save(f, matrix))
+    _write_durable(os.path.join(gallery_dir, _ids_file(generation)), lambda f: np.save(f, name_ids))
+
+    # Galleries big enough for the IVF index get its partitions here, when
+    # training saves them, instead of on every load.
+    ivf = None
+    if len(matrix) >= IVF_MIN_SIZE:
+        centroids, assignment, trained_on = _ivf_partitions(gallery_dir, previous, matrix)
+        _write_durable(os.path.join(gallery_dir, _centroids_file(generation)), lambda f: np.save(f, centroids))
+        _write_durable(os.path.join(gallery_dir, _assignment_file(generation)), lambda f: np.save(f, assignment))
+        ivf = {"centroids": _centroids_file(generation), "assignment": _assignment_file(generation),
+               "trained_on": int(trained_on)}
+
+    index = {
+        "version": FORMAT_VERSION,
+        "generation": generation,
+        "count": int(matrix.shape[0]),
+        "dim": int(matrix.shape[1]),
+        "labels": labels,
+        "matrix": _matrix_file(generation),
+        "name_ids": _ids_file(generation),
+        "ivf": ivf,
+        "saved_at": time.time(),
+    }
+    # Swapping the index is the commit point: readers see either the old or
+    # the new generation, never a half-written one.
+    _write_durable(os.path.join(gallery_dir, INDEX_FILE), lambda f: f.write(json.dumps(index).encode("utf-8")))
+
+    keep = {INDEX_FILE, index["matrix"], index["name_ids"]}
+    if ivf is not None:
+        keep.update((ivf["centroids"], ivf["assignment"]))
+    for filename in os.listdir(gallery_dir):
+        if filename not in keep and filename.endswith(".npy"):
+            try:
+                os.remove(os.path.join(gallery_dir, filename))
+            except OSError:
+                pass
+    return generation
+
+
+def load_gallery(gallery_dir):
+    index = read_index(gallery_dir)
+    if index is None:
+        return None
+    # Memory-mapped read-only: opening is O(1) and the page cache is shared
+    # between every process that maps the same generation.
+    matrix = np.load(os.path.join(gallery_dir, index["matrix"]), mmap_mode="r")
+    name_ids = np.load(os.path.join(gallery_dir, index["name_ids"]), mmap_mode="r")
+    if matrix.dtype != np.float32 or matrix.shape != (index["count"], index["dim"]) or name_ids.shape != (index["count"],):
+        raise ValueError(f"Gallery files in {gallery_dir} do not match their index")
+    ivf = None
+    if index.get("ivf"):
+        ivf = {key: np.load(os.path.join(gallery_dir, index["ivf"][key]), mmap_mode="r")
+               for key in ("centroids", "assignment")}
+    return {
+        "matrix": matrix,
+        "name_ids": name_ids,
+        "labels": index["labels"],
+        "generation": index["generation"],
+        "ivf": ivf,
+    }
+
+
+def migrate_pickle(pickle_path, gallery_dir):
+    # One-shot import of the legacy encodings.pickle. Only run this on a
+    # pickle this system wrote itself: unpickling executes arbitrary code.
+    with open(pickle_path, "rb") as f:
+        data = pickle.loads(f.read())
+    generation = save_gallery(gallery_dir, data["encodings"], data["names"])
+    print(f"[GALLERY] Migrated {len(data['encodings'])} encodings from {pickle_path} to {gallery_dir} (generation {generation})")
+    return generation
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m modules.ai.galleryStore <encodings.pickle> <gallery_dir>")
+        sys.exit(1)
+    migrate_pickle(sys.argv[1], sys.argv[2])
@@ -1,6 +1,7 @@
 import os
 import shutil
 from datetime import datetime
+from modules.ai.unknownClusters import unknown_faces
 
 BASE_DIR = os.path.join(os.path.dirname(__file__), "../../data")
 FACE_CAPTURED = os.path.join(BASE_DIR, "faceCaptured")
@@ -34,13 +35,15 @@ def get_all_photos_with_names():
                 dt = datetime.min
 
             rel_path = os.path.join("faceCaptured", date_folder, filename)
+            is_unknown = person.lower() == "unknown"
 
             photos.append({
                 "path": rel_path,
                 "person": person,
                 "date": date_folder,
                 "time": time_str.replace("-", ":"),
-                "is_unknown": (person.lower() == "unknown"),
+                "is_unknown": is_unknown,
+                "cluster": unknown_faces.cluster_of(rel_path) if is_unknown else None,
                 "datetime": dt
             })
 
@@ -65,15 +68,42 @@ def assign_photo(photo_rel_path, person_name, create_new=False):
 
     timestamp = datetime.now().strftime("%H-%M-%S")
     new_filename = f"{person_name}_{timestamp}.jpg"
+    suffix = 1
+    while (os.path.exists(os.path.join(person_dir, new_filename))
+           or os.path.exists(os.path.join(os.path.dirname(src), new_filename))):
+        suffix += 1
+        new_filename = f"{person_name}_{timestamp}_{suffix}.jpg"
 
     dst = os.path.join(person_dir, new_filename)
     shutil.copy2(src, dst)
 
     faceCaptured_new_path = os.path.join(os.path.dirname(src), new_filename)
     os.rename(src, faceCaptured_new_path)
+    unknown_faces.resolve(photo_rel_path, person_name)
 
     return {
         "faceData_path": dst,
         "faceCaptured_path": faceCaptured_new_path
     }
 
+
+def get_unknown_clusters(photos=None):
+    if photos is None:
+        photos = get_all_photos_with_names()
+    groups = {}
+    for photo in photos:
+        if photo["is_unknown"] and photo["cluster"] is not None:
+            groups.setdefault(photo["cluster"], []).append(photo)
+    clusters = [{"id": cluster_id, "photos": members} for cluster_id, members in groups.items()]
+    clusters.sort(key=lambda c: len(c["photos"]), reverse=True)
+    return clusters
+
+
+def assign_cluster(cluster_id, person_name):
+    assigned = []
+    for rel_path in unknown_faces.clusters().get(cluster_id, []):
+        if os.path.exists(os.path.join(BASE_DIR, rel_path)):
+            assigned.append(assign_photo(rel_path, person_name, create_new=True))
+        else:
+            unknown_faces.resolve(rel_path, person_name)
+    return assigned
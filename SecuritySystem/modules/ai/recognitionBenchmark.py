@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import contextlib
+import platform
+import resource
+import tempfile
+import tracemalloc
+import cv2
+import numpy as np
+import face_recognition
+from modules.camera.fakeCamera import FakeCamera, load_face_tiles
+from modules.ai.facialRecognition import FacialRecognitionCamera
+from modules.ai.galleryIndex import synthetic_gallery
+from modules.ai.galleryManager import GalleryManager
+from modules.ai.galleryStore import save_gallery
+from modules.ai.trainingManifest import scan_dataset
+from modules.ai.trainingEngine import encode_images
+
+STAGES = ("capture", "convert", "resize", "detect", "track", "encode", "match", "annotate", "jpeg")
+DEFAULT_GALLERY_SIZES = (100, 1000, 10000)
+DEFAULT_FACE_COUNTS = (0, 1, 3)
+DEFAULT_FRAMES = 60
+DEFAULT_WARMUP = 5
+DEFAULT_MEMORY_FRAMES = 20
+
+
+def _build_gallery(path, size, face_tiles, seed):
+    # Synthetic identities fill the gallery up to `size`; the face tiles
+    # used in the frames are enrolled as well so known faces get matched.
+    encodings, names = [], []
+    for i, tile in enumerate(face_tiles):
+        for encoding in face_recognition.face_encodings(tile):
+            encodings.append(encoding)
+            names.append(f"face{i}")
+    filler = max(0, size - len(encodings))
+    if filler:
+        matrix, name_ids, _ = synthetic_gallery(filler, max(1, filler // 20), seed=seed)
+        encodings.extend(matrix)
+        names.extend(f"person{i}" for i in name_ids)
+    save_gallery(path, encodings, names)
+    return GalleryManager(path, poll_interval=3600)
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else None
+
+
+def run_recognition(gallery_size, faces, face_tiles, args):
+    gallery_dir = tempfile.mkdtemp(prefix="bench_gallery_")
+    manager = None
+    try:
+        manager = _build_gallery(gallery_dir, gallery_size, face_tiles[:faces or 0], args.seed)
+        camera_source = FakeCamera(args.source, size=(args.width, args.height), fps=args.fps,
+                                   face_tiles=face_tiles, faces=faces or 0, seed=args.seed)
+        camera = FacialRecognitionCamera(camera_source, tracking=not args.no_tracking,
+                                         detect_every=args.detect_every,
+                                         target_ms=args.target_ms if args.adaptive else None,
+                                         gallery=manager, save_captures=False)
+
+        for _ in range(args.warmup):
+            camera.process_frame()
+
+        stage_ms = {stage: [] for stage in STAGES}
+        frame_ms = []
+        detections = 0
+        camera.timings = {}
+        started = time.perf_counter()
+        for _ in range(args.frames):
+            camera.timings.clear()
+            t0 = time.perf_counter()
+            _, found = camera.process_frame()
+            frame_ms.append((time.perf_counter() - t0) * 1000.0)
+            detections += len(found)
+            for stage in STAGES:
+                stage_ms[stage].append(camera.timings.get(stage, 0.0))
+        elapsed = time.perf_counter() - started
+
+        # Memory is measured in a separate pass: tracemalloc slows every
+        # allocation down and would distort the timings above.
+        camera.timings = None
+        tracemalloc.start()
+        for _ in range(args.memory_frames):
+            camera.process_frame()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {
+            "gallery_size": gallery_size,
+            "faces": faces,
+            "frames": args.frames,
+            "fps": args.frames / elapsed if elapsed > 0 else 0.0,
+            "frame_ms_mean": float(np.mean(frame_ms)),
+            "frame_ms_p50": _percentile(frame_ms, 50),
+            "frame_ms_p95": _percentile(frame_ms, 95),
+            "stage_ms_mean": {stage: float(np.mean(v)) for stage, v in stage_ms.items()},
+            "stage_ms_p95": {stage: _percentile(v, 95) for stage, v in stage_ms.items()},
+            "detections_per_frame": detections / args.frames,
+            "final_scale": camera.scaler.scale,
+            "peak_traced_mb": peak / (1024 * 1024),
+            "max_rss_mb": _max_rss_mb(),
+        }
+    finally:
+        if manager is not None:
+            manager.stop()
+        shutil.rmtree(gallery_dir, ignore_errors=True)
+
+
+def run_training(train_dir, workers_list):
+    images = scan_dataset(train_dir)
+    results = []
+    for workers in workers_list:
+        _, stats = encode_images(images, workers=workers)
+        stats["max_rss_mb"] = _max_rss_mb()
+        results.append(stats)
+    return results
+
+
+def _max_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS.
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _environment(args):
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "args": vars(args),
+    }
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the facial recognition pipeline on a fake camera.")
+    parser.add_argument("--source", help="video file, image file or image directory to replay (default: synthetic frames)")
+    parser.add_argument("--faces-dir", help="face images pasted into synthetic frames and enrolled in the gallery")
+    parser.add_argument("--gallery-sizes", type=_int_list, default=list(DEFAULT_GALLERY_SIZES))
+    parser.add_argument("--face-counts", type=_int_list, default=list(DEFAULT_FACE_COUNTS))
+    parser.add_argument("--frames", type=int, default=DEFAULT_FRAMES)
+    parser.add_argument("--warmup", type=int, default=DEFAULT_WARMUP)
+    parser.add_argument("--memory-frames", type=int, default=DEFAULT_MEMORY_FRAMES)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=float, default=None, help="pace the fake camera (default: as fast as possible)")
+    parser.add_argument("--detect-every", type=int, default=5)
+    parser.add_argument("--no-tracking", action="store_true")
+    parser.add_argument("--adaptive", action="store_true", help="let the detection scale adapt (not deterministic)")
+    parser.add_argument("--target-ms", type=float, default=120.0)
+    parser.add_argument("--train-dir", help="dataset directory to benchmark training encoding on")
+    parser.add_argument("--workers", type=_int_list, default=[1, os.cpu_count() or 1])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    face_tiles = load_face_tiles(args.faces_dir) if args.faces_dir else []
+    face_counts = args.face_counts
+    if args.source is not None:
+        # Replayed footage has whatever faces it has.
+        face_counts = [None]
+    elif not face_tiles and any(args.face_counts):
+        print("[BENCH] No --faces-dir given, running with 0 faces only", file=sys.stderr)
+        face_counts = [0]
+
+    results = {"environment": _environment(args), "recognition": [], "training": []}
+    # Log lines from the pipeline go to stderr so stdout stays parseable.
+    with contextlib.redirect_stdout(sys.stderr):
+        for gallery_size in args.gallery_sizes:
+            for faces in face_counts:
+                print(f"[BENCH] gallery={gallery_size} faces={faces}")
+                results["recognition"].append(run_recognition(gallery_size, faces, face_tiles, args))
+        if args.train_dir:
+            results["training"] = run_training(args.train_dir, args.workers)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+
+    print(f"{'gallery':>8} {'faces':>5} {'fps':>7} {'p50 ms':>8} {'p95 ms':>8} "
+          + " ".join(f"{stage:>8}" for stage in STAGES) + f" {'peak MB':>8}")
+    for r in results["recognition"]:
+        print(f"{r['gallery_size']:>8} {str(r['faces']):>5} {r['fps']:>7.2f} {r['frame_ms_p50']:>8.2f} {r['frame_ms_p95']:>8.2f} "
+              + " ".join(f"{r['stage_ms_mean'][stage]:>8.2f}" for stage in STAGES) + f" {r['peak_traced_mb']:>8.2f}")
+    for r in results["training"]:
+        print(f"[BENCH] training: {r['images']} images on {r['workers']} workers, "
+              f"{r['images_per_s']:.2f} images/s, {r['max_rss_mb']:.1f} MB max RSS")
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import time
+import threading
+from modules.camera.streamHub import keepalive_frames
+
+
+class RecognitionService:
+    def __init__(self, camera_factory, scheduler=None, name="recognition"):
+        self._camera_factory = camera_factory
+        # Recognition counts against the same analytics budget as motion.
+        self.scheduler = scheduler
+        self.name = name
+        self._camera = None
+        self._lifecycle_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._stop = None
+        self._subscribers = 0
+        self._seq = 0
+        self._frame = None
+        self._detections = []
+        self._published_at = 0.0
+
+    @property
+    def subscribers(self):
+        with self._lifecycle_lock:
+            return self._subscribers
+
+    def subscribe(self):
+        with self._lifecycle_lock:
+            self._subscribers += 1
+            if self._subscribers == 1:
+                self._start_locked()
+
+    def unsubscribe(self):
+        with self._lifecycle_lock:
+            self._subscribers = max(0, self._subscribers - 1)
+            if self._subscribers == 0 and self._stop is not None:
+                self._stop.set()
+                print("[RECOGNITION] Last viewer left, stopping recognition")
+
+    def _start_locked(self):
+        if self._thread is not None and self._thread.is_alive():
+            if not self._stop.is_set():
+                return
+            # A previous run is finishing its last frame.
+            self._thread.join()
+        if self._camera is None:
+            self._camera = self._camera_factory()
+        self._stop = threading.Event()
+        if self.scheduler is not None:
+            # Registered either way; with a remote recognizer only its worker
+            # process is charged, under this name.
+            self.scheduler.register(self.name)
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+        self._thread.start()
+        print("[RECOGNITION] Recognition service started")
+
+    def _run(self, stop):
+        # What is left here when recognition runs in a worker process is
+        # drawing and JPEG encoding, which is streaming work like the plain
+        # camera feed and is not held to the analytics budget.
+        budgeted = self.scheduler is not None and getattr(self._camera, "recognizer", None) is None
+        while not stop.is_set():
+            if budgeted:
+                self.scheduler.admit(self.name, stop)
+                if stop.is_set():
+                    break
+            started = time.perf_counter()
+            error = None
+            try:
+                frame, detections = self._camera.process_frame()
+            except Exception as e:
+                error = e
+            if budgeted:
+                self.scheduler.charge(self.name, time.perf_counter() - started)
+            if error is not None:
+                print(f"[RECOGNITION] Error processing frame: {error}")
+                time.sleep(0.1)
+                continue
+            if frame is None:
+                continue
+            with self._cond:
+                self._seq += 1
+                self._frame = frame
+                self._detections = detections
+                self._published_at = time.time()
+                self._cond.notify_all()
+        if self.scheduler is not None:
+            self.scheduler.unregister(self.name)
+        # Lets a shared camera go idle while nobody is watching.
+        stop_camera = getattr(self._camera, "stop", None)
+        if stop_camera is not None:
+            stop_camera()
+
+    def latest(self):
+        with self._cond:
+            return self._seq, self._frame, list(self._detections), self._published_at
+
+    def wait_for_frame(self, after_seq, timeout=1.0):
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > after_seq, timeout=timeout)
+            if self._seq > after_seq:
+                return self._seq, self._frame
+            return after_seq, None
+
+    def frames(self):
+        # One generator per HTTP client; all of them share the single
+        # recognition thread and only ever receive frames newer than the
+        # last one they were sent, apart from the keep-alive repeats. A
+        # write to a closed socket is what ends the generator and runs the
+        # unsubscribe below.
+        self.subscribe()
+        try:
+            yield from keepalive_frames(self.wait_for_frame, self._seq)
+        finally:
+            self.unsubscribe()
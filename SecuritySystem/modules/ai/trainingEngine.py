@@ -0,0 +1,86 @@
+import os
+import time
+import cv2
+import face_recognition
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from modules.ai.trainingManifest import file_sha1
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_CHUNK_SIZE = 4
+
+
+def encode_image(image_path):
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Could not load image: {image_path}")
+
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    boxes = face_recognition.face_locations(rgb, model="hog")
+    return face_recognition.face_encodings(rgb, boxes)
+
+
+def _encode_one(image):
+    started = time.perf_counter()
+    try:
+        encodings = [[float(x) for x in e] for e in encode_image(image["path"])]
+        sha1 = file_sha1(image["path"])
+        error = None
+    except Exception as e:
+        encodings, sha1, error = [], None, str(e)
+    return {
+        "rel_path": image["rel_path"],
+        "encodings": encodings,
+        "sha1": sha1,
+        "error": error,
+        "seconds": time.perf_counter() - started,
+    }
+
+
+def _encode_chunk(chunk):
+    return [_encode_one(image) for image in chunk]
+
+
+def _chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def encode_images(images, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, on_result=None):
+    # Results come back in the order of `images` regardless of which worker
+    # finished first, so the trained gallery never depends on scheduling.
+    workers = max(1, int(workers or DEFAULT_WORKERS))
+    workers = min(workers, max(1, len(images)))
+    started = time.perf_counter()
+    results = {}
+
+    def collect(chunk_results):
+        for result in chunk_results:
+            results[result["rel_path"]] = result
+            if on_result is not None:
+                on_result(result)
+
+    if workers == 1:
+        for chunk in _chunks(images, chunk_size):
+            collect(_encode_chunk(chunk))
+    else:
+        # Spawned, not forked: training runs on a background thread of the
+        # web app, and a fork would copy the other threads' locks mid-use.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [pool.submit(_encode_chunk, chunk) for chunk in _chunks(images, chunk_size)]
+            for future in as_completed(futures):
+                collect(future.result())
+
+    elapsed = time.perf_counter() - started
+    ordered = [results[image["rel_path"]] for image in images]
+    per_image = [r["seconds"] for r in ordered]
+    stats = {
+        "images": len(ordered),
+        "failed": sum(1 for r in ordered if r["error"]),
+        "encodings": sum(len(r["encodings"]) for r in ordered),
+        "workers": workers,
+        "elapsed_s": elapsed,
+        "images_per_s": (len(ordered) / elapsed) if elapsed > 0 else 0.0,
+        "mean_image_s": (sum(per_image) / len(per_image)) if per_image else 0.0,
+        "max_image_s": max(per_image) if per_image else 0.0,
+    }
+    return ordered, stats
@@ -0,0 +1,142 @@
+import time
+import queue
+import sqlite3
+import threading
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+INTERRUPTED = "interrupted"
+
+_COLUMNS = (
+    "id", "status", "incremental", "created_at", "started_at", "finished_at",
+    "images_total", "images_processed", "images_removed", "encodings_added",
+    "encodings_total", "error",
+)
+
+
+def init_training_jobs_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS training_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT NOT NULL,
+            incremental INTEGER NOT NULL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL,
+            images_total INTEGER DEFAULT 0,
+            images_processed INTEGER DEFAULT 0,
+            images_removed INTEGER DEFAULT 0,
+            encodings_added INTEGER DEFAULT 0,
+            encodings_total INTEGER,
+            error TEXT
+        )
+    ''')
+
+
+class TrainingJobQueue:
+    # Runs train_faces() on a single background thread, one job at a time.
+    # Job rows live in the app database so results survive restarts; live
+    # progress is kept in memory and flushed to the row as it changes.
+    def __init__(self, db_path, train_fn):
+        self.db_path = db_path
+        self.train_fn = train_fn
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._live = {}
+        self._thread = None
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            with self._connect() as conn:
+                init_training_jobs_table(conn)
+                conn.execute("UPDATE training_jobs SET status = ?, finished_at = ? WHERE status IN (?, ?)",
+                             (INTERRUPTED, time.time(), QUEUED, RUNNING))
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def submit(self, incremental=True):
+        # A job that has not started yet already covers any newer request.
+        self.start()
+        with self._lock:
+            for job in self._live.values():
+                if job["status"] == QUEUED and job["incremental"] == incremental:
+                    return job["id"], False
+            with self._connect() as conn:
+                cursor = conn.execute("INSERT INTO training_jobs (status, incremental, created_at) VALUES (?, ?, ?)",
+                                      (QUEUED, int(incremental), time.time()))
+                job_id = cursor.lastrowid
+            self._live[job_id] = self._read(job_id)
+        self._queue.put(job_id)
+        return job_id, True
+
+    def _read(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM training_jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(_COLUMNS, row))
+        job["incremental"] = bool(job["incremental"])
+        return job
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._live:
+                self._live[job_id].update(fields)
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE training_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _run(self):
+        while True:
+            job_id = self._queue.get()
+            with self._lock:
+                incremental = self._live[job_id]["incremental"]
+            self._update(job_id, status=RUNNING, started_at=time.time())
+            print(f"[TRAIN] Job {job_id} started")
+            try:
+                result = self.train_fn(incremental=incremental, progress=lambda p: self._update(job_id, **p))
+                self._update(job_id, status=DONE, finished_at=time.time(), encodings_total=len(result["encodings"]))
+                print(f"[TRAIN] Job {job_id} finished with {len(result['encodings'])} encodings")
+            except Exception as e:
+                self._update(job_id, status=FAILED, finished_at=time.time(), error=str(e))
+                print(f"[TRAIN] Job {job_id} failed: {e}")
+            finally:
+                with self._lock:
+                    self._live.pop(job_id, None)
+
+    def get(self, job_id):
+        with self._lock:
+            job = dict(self._live[job_id]) if job_id in self._live else None
+        if job is None:
+            job = self._read(job_id)
+        return _with_eta(job) if job is not None else None
+
+    def latest(self):
+        with self._lock:
+            live = sorted(self._live)
+        if live:
+            return self.get(live[0])
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(id) FROM training_jobs").fetchone()
+        return self.get(row[0]) if row and row[0] is not None else None
+
+    def recent(self, limit=20):
+        with self._connect() as conn:
+            ids = [r[0] for r in conn.execute("SELECT id FROM training_jobs ORDER BY id DESC LIMIT ?", (limit,))]
+        return [self.get(job_id) for job_id in ids]
+
+
+def _with_eta(job):
+    job["eta_s"] = None
+    if job["status"] == RUNNING and job["started_at"] and job["images_processed"]:
+        elapsed = time.time() - job["started_at"]
+        remaining = max(0, job["images_total"] - job["images_processed"])
+        job["eta_s"] = elapsed / job["images_processed"] * remaining
+    return job
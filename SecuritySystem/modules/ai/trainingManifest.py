@@ -0,0 +1,109 @@
+import os
+import json
+import hashlib
+
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = (".jpg", ".png", ".jpeg")
+
+
+def file_sha1(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scan_dataset(dataset_path):
+    images = []
+    if not os.path.exists(dataset_path):
+        return images
+
+    for person_name in sorted(os.listdir(dataset_path)):
+        person_dir = os.path.join(dataset_path, person_name)
+        if not os.path.isdir(person_dir):
+            continue
+
+        for image_file in sorted(os.listdir(person_dir)):
+            if not image_file.endswith(IMAGE_EXTENSIONS):
+                continue
+            image_path = os.path.join(person_dir, image_file)
+            try:
+                st = os.stat(image_path)
+            except OSError:
+                continue
+            images.append({
+                "rel_path": os.path.join(person_name, image_file),
+                "path": image_path,
+                "person": person_name,
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+            })
+    return images
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[TRAIN] Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("images", {})
+
+
+def save_manifest(manifest_path, entries):
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "images": entries}, f)
+    os.replace(tmp_path, manifest_path)
+
+
+def plan_update(entries, scanned):
+    # Returns (unchanged entries keyed by rel_path, images needing encoding, removed rel_paths).
+    # A size/mtime change alone is not enough to re-encode: the content hash
+    # decides, so touched or copied-over files with identical bytes are reused.
+    unchanged = {}
+    to_encode = []
+    for image in scanned:
+        entry = entries.get(image["rel_path"])
+        if entry is not None and entry.get("person") == image["person"]:
+            if entry["size"] == image["size"] and entry["mtime"] == image["mtime"]:
+                unchanged[image["rel_path"]] = entry
+                continue
+            if entry["size"] == image["size"]:
+                sha1 = file_sha1(image["path"])
+                if sha1 == entry["sha1"]:
+                    unchanged[image["rel_path"]] = dict(entry, mtime=image["mtime"])
+                    continue
+        to_encode.append(image)
+
+    seen = {image["rel_path"] for image in scanned}
+    removed = sorted(path for path in entries if path not in seen)
+    return unchanged, to_encode, removed
+
+
+def make_entry(image, encodings, sha1=None):
+    return {
+        "person": image["person"],
+        "size": image["size"],
+        "mtime": image["mtime"],
+        "sha1": sha1 if sha1 is not None else file_sha1(image["path"]),
+        "encodings": [[float(x) for x in encoding] for encoding in encodings],
+    }
+
+
+def gallery_from_entries(entries):
+    known_encodings = []
+    known_names = []
+    for rel_path in sorted(entries):
+        entry = entries[rel_path]
+        for encoding in entry["encodings"]:
+            known_encodings.append(encoding)
+            known_names.append(entry["person"])
+    return known_encodings, known_names
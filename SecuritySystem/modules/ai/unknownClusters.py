@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import atexit
+import threading
+import numpy as np
+from modules.ai.trainingManifest import file_sha1
+
+STORE_PATH = os.path.join(os.path.dirname(__file__), "../../data/unknownFaces.json")
+STORE_VERSION = 1
+CLUSTER_THRESHOLD = 0.5
+# Captures kept per cluster; older ones leave the store (not the disk).
+MAX_CLUSTER_MEMBERS = 50
+# Changes are written out at most this often, not on every capture.
+SAVE_DELAY_S = 5.0
+
+
+class UnknownFaceStore:
+    # Keeps the encoding of every saved Unknown capture and groups them
+    # online: a new face joins the nearest cluster whose centroid is within
+    # `threshold`, otherwise it starts a new one. recluster() rebuilds all
+    # clusters from the stored vectors with a density (DBSCAN-style) pass.
+    # Each cluster keeps its newest `max_members` captures. Changes are
+    # saved by a timer `save_delay` seconds after the first one, and on exit.
+    def __init__(self, path=STORE_PATH, threshold=CLUSTER_THRESHOLD, max_members=MAX_CLUSTER_MEMBERS,
+                 save_delay=SAVE_DELAY_S):
+        self.path = path
+        self.threshold = threshold
+        self.max_members = max_members
+        self.save_delay = save_delay
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._save_timer = None
+        self._faces = {}
+        self._clusters = {}
+        self._assigned = {}
+        self._next_cluster = 1
+        self._centroids = np.empty((0, 128), dtype=np.float32)
+        self._centroid_ids = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[UNKNOWN] Ignoring unreadable store {self.path}: {e}")
+            return
+        if data.get("version") != STORE_VERSION:
+            return
+        self._faces = data.get("faces", {})
+        self._clusters = {int(cid): c for cid, c in data.get("clusters", {}).items()}
+        self._assigned = data.get("assigned", {})
+        self._next_cluster = data.get("next_cluster", max(self._clusters, default=0) + 1)
+        self._rebuild_centroids()
+        atexit.register(self.flush)
+
+    def _save_later_locked(self):
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+
+    def flush(self):
+        # Writes pending changes now. Serialised under the lock, written
+        # outside it so captures are not held up by the SD card.
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            text = json.dumps({
+                "version": STORE_VERSION,
+                "faces": self._faces,
+                # Reserved clusters no capture has joined yet are not kept.
+                "clusters": {str(cid): c for cid, c in self._clusters.items() if c["count"]},
+                "assigned": self._assigned,
+                "next_cluster": self._next_cluster,
+            })
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    f.write(text)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(f"[UNKNOWN] Could not save {self.path}: {e}")
+
+    def _refresh_cluster_locked(self, cluster_id):
+        # Recomputes a cluster's centroid and count from its members, and
+        # drops its oldest members beyond max_members.
+        members = sorted((f["added_at"], p) for p, f in self._faces.items() if f["cluster"] == cluster_id)
+        for _, rel_path in members[:max(0, len(members) - self.max_members)]:
+            del self._faces[rel_path]
+        members = members[-self.max_members:] if self.max_members > 0 else []
+        if not members:
+            self._clusters.pop(cluster_id, None)
+            return
+        vectors = np.array([self._faces[p]["encoding"] for _, p in members], dtype=np.float32)
+        self._clusters[cluster_id] = {"centroid": vectors.mean(axis=0).tolist(), "count": len(members)}
+
+    def _rebuild_centroids(self):
+        self._centroid_ids = sorted(self._clusters)
+        if self._centroid_ids:
+            self._centroids = np.array([self._clusters[cid]["centroid"] for cid in self._centroid_ids], dtype=np.float32)
+        else:
+            self._centroids = np.empty((0, 128), dtype=np.float32)
+
+    def _nearest_cluster(self, encoding):
+        if not self._centroid_ids:
+            return None
+        dist = np.linalg.norm(self._centroids - np.asarray(encoding, dtype=np.float32), axis=1)
+        best = int(np.argmin(dist))
+        return self._centroid_ids[best] if dist[best] <= self.threshold else None
+
+    def match_cluster(self, encoding):
+        with self._lock:
+            return self._nearest_cluster(encoding)
+
+    def reserve(self, encoding):
+        # The cluster a capture of this face will join, created empty if no
+        # cluster is near enough, so later frames of the same face match it
+        # while the capture is still being written. release() undoes it.
+        encoding = [float(x) for x in encoding]
+        with self._lock:
+            cluster_id = self._nearest_cluster(encoding)
+            if cluster_id is None:
+                cluster_id = self._next_cluster
+                self._next_cluster += 1
+                self._clusters[cluster_id] = {"centroid": encoding, "count": 0}
+                self._rebuild_centroids()
+            return cluster_id
+
+    def release(self, cluster_id):
+        # Drops a reserved cluster again if no capture ever joined it.
+        with self._lock:
+            cluster = self._clusters.get(cluster_id)
+            if cluster is not None and cluster["count"] == 0:
+                del self._clusters[cluster_id]
+                self._rebuild_centroids()
+
+    def add(self, rel_path, encoding, abs_path=None, cluster_id=None):
+        # Joins `cluster_id` when given (as returned by reserve()), otherwise
+        # the nearest cluster.
+        encoding = [float(x) for x in encoding]
+        sha1 = file_sha1(abs_path) if abs_path and os.path.exists(abs_path) else None
+        with self._lock:
+            if cluster_id not in self._clusters:
+                cluster_id = self._nearest_cluster(encoding)
+            if cluster_id is None:
+                cluster_id = self._next_cluster
+                self._next_cluster += 1
+                self._clusters[cluster_id] = {"centroid": encoding, "count": 0}
+            cluster = self._clusters[cluster_id]
+            n = cluster["count"]
+            self._faces[rel_path] = {"encoding": encoding, "sha1": sha1, "cluster": cluster_id, "added_at": time.time()}
+            if n >= self.max_members:
+                self._refresh_cluster_locked(cluster_id)
+            else:
+                cluster["centroid"] = [(c * n + e) / (n + 1) for c, e in zip(cluster["centroid"], encoding)]
+                cluster["count"] = n + 1
+            self._rebuild_centroids()
+            self._save_later_locked()
+        return cluster_id
+
+    def cluster_of(self, rel_path):
+        with self._lock:
+            face = self._faces.get(rel_path)
+            return face["cluster"] if face else None
+
+    def clusters(self):
+        with self._lock:
+            members = {}
+            for rel_path, face in self._faces.items():
+                members.setdefault(face["cluster"], []).append(rel_path)
+        return {cid: sorted(paths) for cid, paths in members.items()}
+
+    def resolve(self, rel_path, person):
+        # Called when a capture is assigned to a person: the face leaves the
+        # review queue and its encoding is kept, keyed by file hash, so
+        # training can reuse it instead of encoding the image again.
+        with self._lock:
+            face = self._faces.pop(rel_path, None)
+            if face is None:
+                return
+            if face["sha1"]:
+                self._assigned[face["sha1"]] = {"person": person, "encoding": face["encoding"]}
+            if face["cluster"] in self._clusters:
+                self._refresh_cluster_locked(face["cluster"])
+            self._rebuild_centroids()
+            self._save_later_locked()
+
+    def assigned_encodings(self):
+        with self._lock:
+            return {sha1: entry["encoding"] for sha1, entry in self._assigned.items()}
+
+    def retain_assigned(self, sha1s):
+        # Drops cached encodings of assigned photos that are no longer in
+        # the training set; the rest stay available for full rebuilds.
+        with self._lock:
+            stale = [sha1 for sha1 in self._assigned if sha1 not in sha1s]
+            for sha1 in stale:
+                del self._assigned[sha1]
+            if stale:
+                self._save_later_locked()
+
+    def recluster(self, eps=None, min_samples=2):
+        eps = self.threshold if eps is None else eps
+        with self._lock:
+            paths = sorted(self._faces)
+            if not paths:
+                return 0
+            vectors = np.array([self._faces[p]["encoding"] for p in paths], dtype=np.float32)
+            sq = np.einsum("ij,ij->i", vectors, vectors)
+            d2 = sq[:, None] + sq[None, :] - 2.0 * (vectors @ vectors.T)
+            neighbours = d2 <= eps * eps
+            core = neighbours.sum(axis=1) >= min_samples
+
+            labels = np.full(len(paths), -1, dtype=np.int64)
+            next_label = 0
+            for i in range(len(paths)):
+                if labels[i] != -1 or not core[i]:
+                    continue
+                labels[i] = next_label
+                frontier = [i]
+                while frontier:
+                    j = frontier.pop()
+                    for k in np.flatnonzero(neighbours[j] & (labels == -1)):
+                        labels[k] = next_label
+                        if core[k]:
+                            frontier.append(k)
+                next_label += 1
+            for i in np.flatnonzero(labels == -1):
+                labels[i] = next_label
+                next_label += 1
+
+            self._clusters = {}
+            for label in range(next_label):
+                cluster_id = self._next_cluster
+                self._next_cluster += 1
+                for i in np.flatnonzero(labels == label):
+                    self._faces[paths[i]]["cluster"] = cluster_id
+                self._refresh_cluster_locked(cluster_id)
+            self._rebuild_centroids()
+            self._save_later_locked()
+            return len(self._clusters)
+
+
+unknown_faces = UnknownFaceStore()
@@ -0,0 +1,103 @@
+import time
+import threading
+from collections import deque
+
+DEFAULT_BUDGET = 1.0
+DEFAULT_WINDOW_S = 2.0
+MAX_WAIT_S = 1.0
+
+
+class AnalyticsScheduler:
+    # Caps the processing time all analytics workers (motion detection per
+    # camera, face recognition) may use together to `budget` cores, split
+    # evenly between the workers currently registered. Workers call admit()
+    # before a frame and charge() with the wall time the frame took; admit()
+    # holds a worker back until its spend over the last `window` seconds is
+    # within its share again. Capture and streaming are never throttled.
+    def __init__(self, budget=DEFAULT_BUDGET, window=DEFAULT_WINDOW_S):
+        self.budget = budget
+        self.window = window
+        self._lock = threading.Lock()
+        self._workers = {}
+
+    def register(self, name):
+        with self._lock:
+            self._workers.setdefault(name, {"costs": deque(), "spent": 0.0, "frames": 0, "throttled_s": 0.0})
+
+    def unregister(self, name):
+        with self._lock:
+            self._workers.pop(name, None)
+
+    def _share_locked(self):
+        return self.budget / max(1, len(self._workers))
+
+    def share(self):
+        # Cores each registered worker may use right now.
+        with self._lock:
+            return self._share_locked()
+
+    def _expire_locked(self, worker, now):
+        costs = worker["costs"]
+        while costs and costs[0][0] <= now - self.window:
+            worker["spent"] -= costs.popleft()[1]
+
+    def _wait_locked(self, worker, now):
+        # How long until enough old work leaves the window.
+        allowed = self._share_locked() * self.window
+        excess = worker["spent"] - allowed
+        if excess <= 0:
+            return 0.0
+        for finished, cost in worker["costs"]:
+            excess -= cost
+            if excess <= 0:
+                return finished + self.window - now
+        return self.window
+
+    def admit(self, name, stop=None):
+        # Returns the seconds spent waiting. `stop` (an Event) cuts the wait
+        # short so a worker can still shut down promptly.
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                worker = self._workers.get(name)
+                if worker is None:
+                    return waited
+                self._expire_locked(worker, now)
+                delay = self._wait_locked(worker, now)
+                if delay <= 0:
+                    worker["throttled_s"] += waited
+                    return waited
+            delay = min(delay, MAX_WAIT_S)
+            if stop is not None:
+                if stop.wait(delay):
+                    return waited
+            else:
+                time.sleep(delay)
+            waited += delay
+
+    def charge(self, name, seconds):
+        now = time.monotonic()
+        with self._lock:
+            worker = self._workers.get(name)
+            if worker is None:
+                return
+            worker["costs"].append((now, seconds))
+            worker["spent"] += seconds
+            worker["frames"] += 1
+            self._expire_locked(worker, now)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            share = self._share_locked()
+            workers = {}
+            for name, worker in self._workers.items():
+                self._expire_locked(worker, now)
+                workers[name] = {
+                    "share": share,
+                    "used": worker["spent"] / self.window,
+                    "frames": worker["frames"],
+                    "throttled_s": worker["throttled_s"],
+                }
+            return {"budget": self.budget, "window": self.window, "workers": workers}
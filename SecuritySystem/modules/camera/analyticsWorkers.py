@@ -0,0 +1,266 @@
+import time
+import queue
+import threading
+import multiprocessing
+import cv2
+import numpy as np
+from modules.camera.sharedRing import SharedFrameRing
+from modules.camera.motionEngine import MotionEngine
+from modules.monitoring.metrics import metrics
+
+THREAD = "thread"
+PROCESS = "process"
+RESULT_QUEUE_SIZE = 16
+# Longest a worker rests between frames to stay within its budget share.
+MAX_PAUSE_S = 1.0
+# Remote recognition results older than this are not drawn any more.
+STALE_RESULT_S = 1.0
+
+# Workers are spawned rather than forked: a fork would copy the camera,
+# Flask and picamera2 threads' locks in whatever state they happen to be.
+context = multiprocessing.get_context("spawn")
+
+
+def _serve(ring, results, stop, share, analyse, min_interval):
+    # Worker side: analyse the newest shared frame, send back a small result,
+    # then rest long enough to stay within `share` cores. Results are
+    # dropped rather than waited on when the parent falls behind.
+    # analyse(shared) returns (result, torn). It should copy what it needs
+    # out of the slot first and check shared.valid() straight after the
+    # copy: a slow analysis is still good once its input was copied whole,
+    # even if the writer has lapped the slot by the time it finishes.
+    last_generation = 0
+    dropped = 0
+    while not stop.is_set():
+        shared = ring.wait_next(last_generation, timeout=0.5)
+        if shared is None:
+            continue
+        last_generation = shared.generation
+        started = time.perf_counter()
+        result, error, torn = None, None, False
+        try:
+            result, torn = analyse(shared)
+        except Exception as e:
+            error = str(e)
+        elapsed = time.perf_counter() - started
+        message = {"generation": shared.generation, "timestamp": shared.timestamp, "elapsed": elapsed,
+                   "torn": torn, "error": error, "dropped": dropped, "result": None if torn else result}
+        shared = None
+        try:
+            results.put_nowait(message)
+        except queue.Full:
+            dropped += 1
+        cores = share.value
+        pause = elapsed * (1.0 / cores - 1.0) if cores > 0 else MAX_PAUSE_S
+        stop.wait(min(MAX_PAUSE_S, max(min_interval, pause)))
+
+
+def motion_worker(spec, cond, results, stop, share, zones, min_interval):
+    ring = SharedFrameRing.attach(spec, cond)
+    engine = MotionEngine(zones=zones)
+
+    def analyse(shared):
+        # The engine downscales the frame as its first step, so checking
+        # afterwards costs next to nothing.
+        result = engine.process(shared.frame)
+        return result, not shared.valid()
+
+    try:
+        _serve(ring, results, stop, share, analyse, min_interval)
+    finally:
+        ring.close()
+        results.cancel_join_thread()
+
+
+def face_worker(spec, cond, results, stop, share, options, lores_spec=None):
+    # Imported here so only the worker loads dlib and the gallery; the
+    # gallery manager's watcher picks up retraining in this process too.
+    from modules.ai.facialRecognition import FacialRecognitionCamera
+    recognizer = FacialRecognitionCamera(None, save_captures=False, **options)
+    # Only read for the partner of each main frame, so it needs no Condition.
+    lores_ring = SharedFrameRing.attach(lores_spec) if lores_spec else None
+
+    def analyse(shared):
+        luma = None
+        if lores_ring is not None:
+            lores = lores_ring.latest()
+            if lores is not None and lores.timestamp == shared.timestamp:
+                luma = lores.frame.copy()
+                if not lores.valid():
+                    luma = None
+        rgb = cv2.cvtColor(shared.frame, cv2.COLOR_BGR2RGB)
+        if not shared.valid():
+            return None, True
+        boxes, names, distances, encodings = recognizer.recognize(rgb, luma)
+        return {
+            "boxes": [[int(v) for v in box] for box in boxes],
+            "names": list(names),
+            "distances": [None if d is None else float(d) for d in distances],
+            "encodings": [None if e is None else np.asarray(e) for e in encodings],
+        }, False
+
+    ring = SharedFrameRing.attach(spec, cond)
+    try:
+        _serve(ring, results, stop, share, analyse, 0.0)
+    finally:
+        ring.close()
+        if lores_ring is not None:
+            lores_ring.close()
+        results.cancel_join_thread()
+
+
+class AnalyticsWorker:
+    # Main-process handle on one worker process reading a SharedFrameRing.
+    # A reader thread takes the worker's results off its queue, charges the
+    # time the worker reports to `scheduler` under `name` (registering the
+    # name is up to the caller, as for thread workers), keeps the worker's
+    # share of the budget current and passes each usable result to
+    # on_result(result, message).
+    def __init__(self, name, target, ring, args=(), scheduler=None, on_result=None):
+        self.name = name
+        self.target = target
+        self.ring = ring
+        self.args = tuple(args)
+        self.scheduler = scheduler
+        self.on_result = on_result
+        self._process = None
+        self._reader = None
+        self._stop = None
+        self._share = None
+        self._results = None
+        self._last_error = None
+        self.received = 0
+        self.torn = 0
+        self.errors = 0
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._process is not None and self._process.is_alive()
+
+    def _current_share(self):
+        return self.scheduler.share() if self.scheduler is not None else 1.0
+
+    def start(self):
+        if self._process is not None:
+            return
+        self._stop = context.Event()
+        self._share = context.Value("d", self._current_share(), lock=False)
+        self._results = context.Queue(RESULT_QUEUE_SIZE)
+        self._process = context.Process(target=self.target,
+                                        args=(self.ring.spec(), self.ring.cond, self._results, self._stop,
+                                              self._share) + self.args,
+                                        name=f"analytics-{self.name}", daemon=True)
+        self._process.start()
+        self._reader = threading.Thread(target=self._read, args=(self._process, self._results, self._share),
+                                        name=f"analytics-{self.name}-results", daemon=True)
+        self._reader.start()
+        print(f"[ANALYTICS] Started worker process {self.name} (pid {self._process.pid})")
+
+    def stop(self, timeout=2.0):
+        process, self._process = self._process, None
+        if process is None:
+            return
+        self._stop.set()
+        process.join(timeout)
+        if process.is_alive():
+            process.terminate()
+            process.join(1.0)
+        self._reader.join(timeout)
+        print(f"[ANALYTICS] Stopped worker process {self.name}")
+
+    def _read(self, process, results, share):
+        while True:
+            try:
+                message = results.get(timeout=0.5)
+            except queue.Empty:
+                if not process.is_alive():
+                    break
+                share.value = self._current_share()
+                continue
+            except (EOFError, OSError):
+                break
+            share.value = self._current_share()
+            self.received += 1
+            self.dropped = message["dropped"]
+            if self.scheduler is not None:
+                self.scheduler.charge(self.name, message["elapsed"])
+            if message["torn"]:
+                self.torn += 1
+                continue
+            if message["error"] is not None:
+                self.errors += 1
+                if message["error"] != self._last_error:
+                    print(f"[ANALYTICS] {self.name}: {message['error']}")
+                self._last_error = message["error"]
+                continue
+            if self.on_result is not None:
+                try:
+                    self.on_result(message["result"], message)
+                except Exception as e:
+                    print(f"[ANALYTICS] Error handling a result from {self.name}: {e}")
+        if process.exitcode not in (0, None) and self._process is process:
+            print(f"[ANALYTICS] Worker process {self.name} exited with code {process.exitcode}")
+
+    def stats(self):
+        process = self._process
+        return {
+            "pid": process.pid if process is not None else None,
+            "running": self.running,
+            "received": self.received,
+            "torn": self.torn,
+            "errors": self.errors,
+            "dropped": self.dropped,
+        }
+
+
+class RemoteRecognizer:
+    # Takes the place of FacialRecognitionCamera.recognize() when face
+    # recognition runs in a worker process. recognize() returns the
+    # worker's latest boxes, names, distances and encodings without
+    # waiting, so the calling thread only annotates and encodes the frame.
+    # The worker starts on the first call and stops with stop().
+    def __init__(self, pipeline, scheduler=None, name="recognition", options=None):
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.name = name
+        self.options = options or {}
+        self._lock = threading.Lock()
+        self._worker = None
+        self._latest = ([], [], [], [])
+        self._latest_ts = 0.0
+        self._worker_time = metrics.stage("ai", "worker")
+
+    def recognize(self, rgb, luma=None):
+        with self._lock:
+            if self._worker is None:
+                ring = self.pipeline.shared_ring()
+                if ring is None:
+                    return [], [], [], []
+                lores = self.pipeline.shared_ring("lores") if self.pipeline.has_lores else None
+                self._worker = AnalyticsWorker(self.name, face_worker, ring,
+                                               (self.options, lores.spec() if lores is not None else None),
+                                               self.scheduler, on_result=self._on_result)
+                self._worker.start()
+            if time.time() - self._latest_ts > STALE_RESULT_S:
+                return [], [], [], []
+            return self._latest
+
+    def _on_result(self, result, message):
+        self._worker_time.observe(message["elapsed"])
+        with self._lock:
+            self._latest = (result["boxes"], result["names"], result["distances"], result["encodings"])
+            self._latest_ts = message["timestamp"]
+
+    def stop(self):
+        with self._lock:
+            worker, self._worker = self._worker, None
+            self._latest = ([], [], [], [])
+            self._latest_ts = 0.0
+        if worker is not None:
+            worker.stop()
+
+    def stats(self):
+        with self._lock:
+            worker = self._worker
+        return worker.stats() if worker is not None else None
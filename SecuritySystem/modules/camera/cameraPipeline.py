@@ -0,0 +1,544 @@
+import os
+import cv2
+import time
+import threading
+from datetime import datetime
+from modules.storage.imageWriter import image_writer
+from modules.storage.eventStore import event_store, MOTION, RECORDING
+from modules.camera.streamHub import StreamHub
+from modules.camera.frameRing import FrameRing
+from modules.camera.preRoll import PreRollBuffer
+from modules.camera.recorder import Recorder
+from modules.camera.motionEngine import MotionEngine, load_zones
+from modules.camera.sharedRing import SharedFrameRing
+from modules.camera.analyticsWorkers import AnalyticsWorker, RemoteRecognizer, motion_worker, context, THREAD, PROCESS
+from modules.monitoring.metrics import metrics
+
+DEFAULT_RECORD_FPS = 20.0
+DEFAULT_SEGMENT_SECONDS = 60.0
+DEFAULT_PREROLL_SECONDS = 5.0
+DEFAULT_PREROLL_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_IDLE_SECONDS = 10.0
+MOTION_PERSISTENCE_S = 5.0
+# Consecutive analysed frames with motion needed before recording starts.
+MOTION_CONFIRM_FRAMES = 2
+# Floor between motion frames even when the analytics budget has room.
+MOTION_MIN_INTERVAL_S = 0.05
+
+
+def _stat(source, key):
+    return lambda: source.stats()[key]
+
+
+def _timestamp_name(prefix, ext):
+    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
+
+
+class CameraPipeline:
+    # Everything one camera needs: its frame source and capture thread,
+    # frame ring, stream hub, pre-roll, recorder and motion detection.
+    # When the source has a lores stream its greyscale frames go to a
+    # second, small ring that motion and face detection read, so their cost
+    # does not grow with the resolution being recorded and streamed.
+    # Nothing is opened until the first consumer calls acquire(); the
+    # source is stopped again once it has been unused for `idle_seconds`.
+    # Motion analysis asks `scheduler` for time, so several cameras share
+    # one analytics budget. With analytics_mode=PROCESS, motion detection
+    # (and recognition through remote_recognizer()) run in worker processes
+    # that read frames from a shared-memory ring instead of this process.
+    def __init__(self, camera_id, source, videos_dir, photos_dir, retention, scheduler=None,
+                 zones_path=None, record_fps=DEFAULT_RECORD_FPS, segment_seconds=DEFAULT_SEGMENT_SECONDS,
+                 preroll_seconds=DEFAULT_PREROLL_SECONDS, preroll_max_bytes=DEFAULT_PREROLL_MAX_BYTES,
+                 idle_seconds=DEFAULT_IDLE_SECONDS, analytics_mode=THREAD):
+        if analytics_mode not in (THREAD, PROCESS):
+            raise ValueError(f"Unknown analytics mode: {analytics_mode}")
+        self.camera_id = camera_id
+        self.source = source
+        self.videos_dir = videos_dir
+        self.photos_dir = photos_dir
+        self.retention = retention
+        self.scheduler = scheduler
+        self.zones_path = zones_path
+        self.idle_seconds = idle_seconds
+        self.analytics_mode = analytics_mode
+        os.makedirs(videos_dir, exist_ok=True)
+        os.makedirs(photos_dir, exist_ok=True)
+
+        labels = {"camera": camera_id}
+        self.frame_ring = FrameRing()
+        self.analytics_ring = FrameRing()
+        # Main-frame pixels per lores pixel (x, y), for mapping boxes back.
+        self._lores_ratio = (1.0, 1.0)
+        self.stream_hub = StreamHub(self.frame_ring, name=f"stream-{camera_id}", metric_labels=labels)
+        self.pre_roll = PreRollBuffer(self.frame_ring, seconds=preroll_seconds, fps=record_fps,
+                                      max_bytes=preroll_max_bytes, metric_labels=labels)
+        self.recorder = Recorder(videos_dir, fps=record_fps, pre_roll=self.pre_roll,
+                                 segment_seconds=segment_seconds, on_segment=self._segment_closed,
+                                 name=f"recorder-{camera_id}", metric_labels=labels)
+
+        self._camera_lock = threading.Lock()
+        self._users = 0
+        self._thread = None
+        self._stop = None
+        self._idle_timer = None
+        self._starts = 0
+
+        self._lock = threading.Lock()
+        self._manual_recording = False
+        self._motion_recording = False
+        self._recording_active = False
+        self._last_motion_ts = 0.0
+        self._last_motion_result = None
+        self._motion_running = False
+        self._motion_thread = None
+        self._motion_stop = None
+        self._motion_worker = None
+        self._motion_streak = 0
+
+        self._shared_lock = threading.Lock()
+        self._shared_rings = {}
+
+        # Hot-path metrics are looked up once; everything that already keeps
+        # its own stats() is read through callbacks when /metrics is scraped.
+        self._capture_time = metrics.stage("camera", "capture", labels)
+        self._convert_time = metrics.stage("camera", "convert", labels)
+        self._motion_time = metrics.stage("motion", "analyse", labels)
+        self._camera_frames = metrics.counter("camera_frames_total", "Frames captured from the camera", labels)
+        self._motion_frames = metrics.counter("motion_frames_total", "Frames analysed for motion", labels)
+        self._motion_triggers = metrics.counter("motion_triggers_total", "Analysed frames that contained motion", labels)
+        metrics.gauge("camera_fps", "Capture rate over the last few seconds", labels, fn=self._camera_frames.rate)
+        metrics.gauge("motion_fps", "Motion analysis rate over the last few seconds", labels,
+                      fn=self._motion_frames.rate)
+        callbacks = [
+            # (kind, name, help, source, stats key)
+            ("gauge", "frame_ring_held", "Ring slots currently held by readers", self.frame_ring, "held"),
+            ("counter", "frame_ring_overruns_total", "Frames written while every slot was held", self.frame_ring, "overruns"),
+            ("gauge", "stream_clients", "Connected MJPEG viewers", self.stream_hub, "subscribers"),
+            ("counter", "stream_frames_encoded_total", "Frames encoded for the MJPEG stream", self.stream_hub, "encoded"),
+            ("counter", "stream_frames_skipped_total", "Camera frames the stream encoder skipped", self.stream_hub, "skipped"),
+            ("gauge", "recorder_queue_depth", "Frames waiting for the video writer", self.recorder, "queue_depth"),
+            ("gauge", "recorder_queue_capacity", "Recorder frame buffer pool size", self.recorder, "max_queue"),
+            ("counter", "recorder_frames_written_total", "Frames written to video files", self.recorder, "written"),
+            ("counter", "recorder_frames_dropped_total", "Frames dropped because the video writer was behind", self.recorder, "dropped"),
+            ("counter", "recorder_segments_total", "Video segments opened", self.recorder, "segments"),
+            ("counter", "recorder_failures_total", "Video files that could not be opened", self.recorder, "failed"),
+            ("gauge", "pre_roll_frames", "Frames held in the pre-roll buffer", self.pre_roll, "frames"),
+            ("gauge", "pre_roll_bytes", "Bytes held in the pre-roll buffer", self.pre_roll, "bytes"),
+            ("counter", "pre_roll_evicted_total", "Pre-roll frames dropped to stay under the memory cap", self.pre_roll, "evicted_for_memory"),
+        ]
+        for kind, name, help_text, component, key in callbacks:
+            getattr(metrics, kind)(name, help_text, labels, fn=_stat(component, key))
+        metrics.gauge("recording_active", "1 while a recording is open", labels, fn=lambda: self.recorder.active)
+        metrics.gauge("camera_running", "1 while the camera source is open", labels, fn=lambda: self.source.running)
+        metrics.gauge("camera_users", "Consumers currently holding the camera", labels, fn=lambda: self._users)
+        metrics.counter("camera_starts_total", "Times the camera source was opened", labels, fn=lambda: self._starts)
+
+    @property
+    def analytics_name(self):
+        return f"motion:{self.camera_id}"
+
+    @property
+    def has_lores(self):
+        return self.source.lores_size is not None
+
+    @property
+    def motion_ring(self):
+        return self.analytics_ring if self.has_lores else self.frame_ring
+
+    def acquire(self):
+        # Every consumer (viewer, motion detection, recording, recognition)
+        # holds the camera between acquire() and release().
+        with self._camera_lock:
+            self._users += 1
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            if self._thread is None:
+                self._start_locked()
+
+    def release(self):
+        with self._camera_lock:
+            self._users = max(0, self._users - 1)
+            if self._users or self._thread is None or self._idle_timer is not None:
+                return
+            # A short grace period so a page reload does not restart the sensor.
+            self._idle_timer = threading.Timer(self.idle_seconds, self._stop_if_idle)
+            self._idle_timer.daemon = True
+            self._idle_timer.start()
+
+    def _start_locked(self):
+        started = time.perf_counter()
+        self.source.start()
+        self._starts += 1
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._camera_loop, args=(self._stop,),
+                                        name=f"camera-{self.camera_id}", daemon=True)
+        self._thread.start()
+        print(f"[CAMERA] Started {self.camera_id} ({self.source.kind}) in "
+              f"{(time.perf_counter() - started) * 1000.0:.0f} ms")
+
+    def _stop_locked(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout=5.0)
+        self._thread = None
+        self._stop = None
+        # The loop may have exited before closing a recording that was stopped.
+        with self._lock:
+            self._update_recording_state()
+        try:
+            self.source.stop()
+        except Exception as e:
+            print(f"[CAMERA] Error stopping {self.camera_id}: {e}")
+        print(f"[CAMERA] Stopped {self.camera_id} ({self.source.kind})")
+
+    def _stop_if_idle(self):
+        with self._camera_lock:
+            self._idle_timer = None
+            if self._users == 0:
+                self._stop_locked()
+
+    def shutdown(self):
+        self.stop_motion_detection()
+        with self._camera_lock:
+            if self._idle_timer is not None:
+                self._idle_timer.cancel()
+                self._idle_timer = None
+            self._stop_locked()
+        with self._shared_lock:
+            rings, self._shared_rings = self._shared_rings, {}
+        for ring in rings.values():
+            ring.close()
+
+    def _camera_loop(self, stop):
+        while not stop.is_set():
+            t0 = time.perf_counter()
+            try:
+                rgb, luma = self.source.read_frames()
+            except Exception as e:
+                print(f"[CAMERA] Failed to read a frame from {self.camera_id}: {e}")
+                stop.wait(0.5)
+                continue
+            t1 = time.perf_counter()
+            self._capture_time.observe(t1 - t0)
+            # Convert straight into a ring slot; read() already blocks until
+            # the source has a new frame, so there is no need to sleep.
+            bgr = self.frame_ring.writable(rgb.shape)
+            if bgr is None:
+                continue
+            cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR, dst=bgr)
+            self._convert_time.observe(time.perf_counter() - t1)
+            self._camera_frames.inc()
+
+            now = time.time()
+            with self._lock:
+                self._update_recording_state()
+
+            # The lores frame goes first, so whoever wakes up for the main
+            # frame finds its lores partner (same timestamp) already there.
+            shared_rings = self._shared_rings
+            if luma is not None:
+                self._lores_ratio = (rgb.shape[1] / luma.shape[1], rgb.shape[0] / luma.shape[0])
+                lores_generation = self.analytics_ring.publish(luma, now)
+                if "lores" in shared_rings and lores_generation is not None:
+                    shared_rings["lores"].publish(luma, now, lores_generation)
+
+            # Copies into the recorder's queue or drops; never waits on disk.
+            self.recorder.submit(bgr, now)
+            generation = self.frame_ring.commit(now)
+            # Nothing writes to a committed slot, so it can be read after commit.
+            if "main" in shared_rings:
+                shared_rings["main"].publish(bgr, now, generation)
+
+    def shared_ring(self, stream="main", timeout=5.0):
+        # The shared-memory copy of the frame ring ("main") or the lores
+        # ring ("lores") for worker processes. It is sized from the first
+        # frame, so it is made the first time a worker needs it; the camera
+        # loop feeds it from then on.
+        source = self.analytics_ring if stream == "lores" else self.frame_ring
+        with self._shared_lock:
+            ring = self._shared_rings.get(stream)
+            if ring is None:
+                handle = source.latest() or source.wait_next(0, timeout)
+                if handle is None:
+                    return None
+                with handle:
+                    ring = SharedFrameRing(handle.frame.shape, handle.frame.dtype, cond=context.Condition())
+                    ring.publish(handle.frame, handle.timestamp, handle.generation)
+                # Replaced rather than mutated: the camera loop reads it unlocked.
+                self._shared_rings = dict(self._shared_rings, **{stream: ring})
+            return ring
+
+    def remote_recognizer(self, name="recognition", **options):
+        # A RemoteRecognizer for FacialRecognitionCamera in process mode,
+        # otherwise None (recognition stays in the caller's thread).
+        if self.analytics_mode != PROCESS:
+            return None
+        return RemoteRecognizer(self, self.scheduler, name, options)
+
+    def get_latest_frame(self, timeout=5.0):
+        # Returns a private copy of a frame taken after the call, starting the
+        # camera for it if nobody else is using it; use latest_frame() /
+        # wait_for_frame() to read the shared buffer without copying.
+        after = self.frame_ring.generation
+        self.acquire()
+        try:
+            handle = self.frame_ring.wait_next(after, timeout)
+            if handle is None:
+                return None
+            with handle:
+                return handle.frame.copy()
+        finally:
+            self.release()
+
+    def latest_frame(self):
+        return self.frame_ring.latest()
+
+    def wait_for_frame(self, after_generation, timeout=1.0):
+        return self.frame_ring.wait_next(after_generation, timeout)
+
+    def save_photo(self, path=None):
+        frame = self.get_latest_frame()
+        if frame is None:
+            raise RuntimeError(f"No frame available to save from {self.camera_id}")
+        if path is None:
+            path = os.path.join(self.photos_dir, _timestamp_name("photo", "jpg"))
+        if not image_writer.submit(path, frame, on_done=lambda p, ok: ok and self.retention.add(p)):
+            raise RuntimeError("Photo writer queue is full")
+        return path
+
+    def generate_frames(self):
+        self.acquire()
+        try:
+            for jpg in self.stream_hub.frames():
+                yield (b"--frame\r\n"
+                       b"Content-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n")
+        finally:
+            self.release()
+
+    def ring_camera(self, timeout=1.0):
+        return RingCamera(self, timeout)
+
+    def _segment_closed(self, path):
+        self.retention.add(path)
+        event_store.record(RECORDING, media_path=path, camera=self.camera_id)
+
+    def _record_motion_event(self, result, media_path):
+        box = None
+        if result["boxes"]:
+            left = min(b[0] for b in result["boxes"])
+            top = min(b[1] for b in result["boxes"])
+            right = max(b[0] + b[2] for b in result["boxes"])
+            bottom = max(b[1] + b[3] for b in result["boxes"])
+            box = [left, top, right - left, bottom - top]
+        event_store.record(MOTION, ts=result["timestamp"], confidence=result["score"], box=box,
+                           media_path=media_path, zones=result["zones"], camera=self.camera_id)
+
+    def _update_recording_state(self):
+        # Only queues open/close requests; the recorder thread does the file work.
+        want_active = self._manual_recording or self._motion_recording
+        if want_active and not self._recording_active:
+            self.recorder.start()
+            self._recording_active = True
+        elif not want_active and self._recording_active:
+            self.recorder.stop()
+            self._recording_active = False
+
+    def start_manual_recording(self):
+        with self._lock:
+            if self._manual_recording:
+                return
+            self._manual_recording = True
+        self.acquire()
+
+    def stop_manual_recording(self):
+        with self._lock:
+            if not self._manual_recording:
+                return
+            self._manual_recording = False
+        self.release()
+
+    def is_recording(self):
+        with self._lock:
+            return self._recording_active
+
+    def start_motion_detection(self):
+        with self._lock:
+            if self._motion_running:
+                return
+            self._motion_running = True
+        self.acquire()
+        self.pre_roll.start()
+        if self.scheduler is not None:
+            self.scheduler.register(self.analytics_name)
+        # A fresh engine per start picks up edits to the zone file.
+        zones = load_zones(self.zones_path) if self.zones_path else load_zones()
+        with self._lock:
+            self._motion_streak = 0
+        if self.analytics_mode == PROCESS:
+            ring = self.shared_ring("lores" if self.has_lores else "main")
+            if ring is None:
+                print(f"[MOTION] No frames from {self.camera_id}, motion detection not started.")
+                self.stop_motion_detection()
+                return
+            self._motion_worker = AnalyticsWorker(self.analytics_name, motion_worker, ring,
+                                                  (zones, MOTION_MIN_INTERVAL_S), self.scheduler,
+                                                  on_result=self._on_motion_result)
+            self._motion_worker.start()
+        else:
+            stop = threading.Event()
+            self._motion_thread = threading.Thread(target=self._motion_loop, args=(MotionEngine(zones=zones), stop),
+                                                   name=f"motion-{self.camera_id}", daemon=True)
+            self._motion_stop = stop
+            self._motion_thread.start()
+        print(f"[MOTION] Motion detection started on {self.camera_id} ({self.analytics_mode}).")
+
+    def stop_motion_detection(self):
+        with self._lock:
+            if not self._motion_running:
+                return
+            self._motion_running = False
+            if self._motion_stop is not None:
+                self._motion_stop.set()
+                self._motion_stop = None
+            worker, self._motion_worker = self._motion_worker, None
+        if worker is not None:
+            worker.stop()
+        self.pre_roll.stop()
+        if self.scheduler is not None:
+            self.scheduler.unregister(self.analytics_name)
+        self.release()
+        print(f"[MOTION] Motion detection stopped on {self.camera_id}.")
+
+    def _motion_loop(self, engine, stop):
+        last_generation = 0
+        while not stop.is_set():
+            if self.scheduler is not None:
+                self.scheduler.admit(self.analytics_name, stop)
+            handle = self.motion_ring.wait_next(last_generation, timeout=0.5)
+            if handle is None:
+                continue
+            with handle:
+                last_generation = handle.generation
+                started = time.perf_counter()
+                result = engine.process(handle.frame)
+                elapsed = time.perf_counter() - started
+            if self.scheduler is not None:
+                self.scheduler.charge(self.analytics_name, elapsed)
+            self._handle_motion_result(result, elapsed)
+            stop.wait(MOTION_MIN_INTERVAL_S)
+
+    def _on_motion_result(self, result, message):
+        # Results from the motion worker process; the worker has already
+        # been charged to the scheduler.
+        self._handle_motion_result(result, message["elapsed"])
+
+    def _handle_motion_result(self, result, elapsed):
+        self._motion_time.observe(elapsed)
+        if self.has_lores and result["boxes"]:
+            rx, ry = self._lores_ratio
+            result = dict(result, boxes=[[int(x * rx), int(y * ry), int(w * rx), int(h * ry)]
+                                         for x, y, w, h in result["boxes"]])
+        self._motion_frames.inc()
+        if result["motion"]:
+            self._motion_triggers.inc()
+
+        media_path = None
+        with self._lock:
+            self._motion_streak = self._motion_streak + 1 if result["motion"] else 0
+            self._last_motion_result = result
+            # Every newly confirmed motion is an event, whether it starts a
+            # recording, lands in a manual one or in a recording's cooldown.
+            confirmed = self._motion_streak == MOTION_CONFIRM_FRAMES
+            if self._motion_streak >= MOTION_CONFIRM_FRAMES:
+                self._motion_recording = True
+                self._last_motion_ts = time.time()
+            elif self._motion_recording and (time.time() - self._last_motion_ts) > MOTION_PERSISTENCE_S:
+                self._motion_recording = False
+            if confirmed:
+                # Started here rather than on the next camera frame so the
+                # event can name the recording it is in.
+                self._update_recording_state()
+                media_path = self.recorder.path if self._recording_active else None
+        if confirmed:
+            self._record_motion_event(result, media_path)
+
+    def stats(self):
+        with self._lock:
+            recording = {"active": self._recording_active, "manual": self._manual_recording,
+                         "motion": self._motion_recording}
+            motion = self._last_motion_result
+            motion_running = self._motion_running
+            worker = self._motion_worker
+        with self._camera_lock:
+            camera = dict(self.source.describe(), id=self.camera_id, users=self._users, starts=self._starts,
+                          idle_timeout=self.idle_seconds, motion_detection=motion_running,
+                          analytics_mode=self.analytics_mode)
+        if worker is not None:
+            camera["motion_worker"] = worker.stats()
+        return {
+            "camera": camera,
+            "recording": recording,
+            "recorder": self.recorder.stats(),
+            "motion": motion,
+            "pre_roll": self.pre_roll.stats(),
+            "frame_ring": self.frame_ring.stats(),
+            "analytics_ring": self.analytics_ring.stats() if self.has_lores else None,
+            "stream": self.stream_hub.stats(),
+        }
+
+
+class RingCamera:
+    # The capture_array() side of Picamera2 backed by a pipeline's frame
+    # ring, for code that pulls frames itself (FacialRecognitionCamera).
+    # Each call returns the next frame as RGB; the camera is held from the
+    # first call until stop(). capture_arrays() adds the lores frame.
+    def __init__(self, pipeline, timeout=1.0):
+        self.pipeline = pipeline
+        self.timeout = timeout
+        self._generation = 0
+        self._holding = False
+        self._hold_lock = threading.Lock()
+
+    def start(self):
+        with self._hold_lock:
+            if self._holding:
+                return
+            self._holding = True
+        self._generation = self.pipeline.frame_ring.generation
+        self.pipeline.acquire()
+
+    def stop(self):
+        with self._hold_lock:
+            if not self._holding:
+                return
+            self._holding = False
+        self.pipeline.release()
+
+    @property
+    def has_lores(self):
+        return self.pipeline.has_lores
+
+    def capture_array(self, name="main"):
+        arrays, _ = self.capture_arrays([name])
+        return arrays[0]
+
+    def capture_arrays(self, names=("main", "lores")):
+        # Like Picamera2.capture_arrays(). "lores" is the greyscale frame
+        # taken with "main", or None if it has already been replaced.
+        self.start()
+        handle = self.pipeline.frame_ring.wait_next(self._generation, timeout=self.timeout)
+        if handle is None:
+            raise RuntimeError(f"No frame from {self.pipeline.camera_id}")
+        with handle:
+            self._generation = handle.generation
+            timestamp = handle.timestamp
+            arrays = {"main": cv2.cvtColor(handle.frame, cv2.COLOR_BGR2RGB), "lores": None}
+        if "lores" in names and self.has_lores:
+            lores = self.pipeline.analytics_ring.latest()
+            if lores is not None:
+                with lores:
+                    if lores.timestamp == timestamp:
+                        arrays["lores"] = lores.frame.copy()
+        return [arrays[name] for name in names], {"timestamp": timestamp}
@@ -0,0 +1,186 @@
+import os
+import time
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+DEFAULT_SIZE = (640, 480)
+SYNTHETIC_FRAMES = 120
+MAX_REPLAY_FRAMES = 600
+
+
+def _load_image_rgb(path, size=None):
+    image = cv2.imread(path)
+    if image is None:
+        raise ValueError(f"Could not load image: {path}")
+    if size is not None:
+        image = cv2.resize(image, size)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def load_face_tiles(faces_dir, limit=None):
+    paths = []
+    for root, _, files in os.walk(faces_dir):
+        for filename in files:
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, filename))
+    paths.sort()
+    if limit is not None:
+        paths = paths[:limit]
+    return [_load_image_rgb(path) for path in paths]
+
+
+class FakeCamera:
+    # Stands in for the parts of Picamera2 the app uses (configure, start,
+    # capture_array, stop) so the recognition pipeline can run on any
+    # machine. Frames come from a video file, an image file or directory, or
+    # a seeded synthetic scene, are prepared up front and then replayed in a
+    # loop, so every run sees the same pixels. With `fps` set,
+    # capture_array() blocks until the next frame is due, like the sensor.
+    # A `lores_size` adds a YUV420 "lores" stream scaled from the same
+    # frames, the way the camera's ISP produces one alongside "main".
+    def __init__(self, source=None, size=DEFAULT_SIZE, fps=None, face_tiles=None, faces=0,
+                 frames=SYNTHETIC_FRAMES, seed=0, lores_size=None):
+        self.source = source
+        self.size = tuple(size)
+        self.lores_size = tuple(lores_size) if lores_size else None
+        self.fps = fps
+        self.face_tiles = face_tiles or []
+        self.faces = faces
+        self.frame_count = frames
+        self.seed = seed
+        self.frames_served = 0
+        self._frames = []
+        self._lores = []
+        self._started_at = None
+        self._prepare()
+
+    def create_preview_configuration(self, main=None, **kwargs):
+        return {"main": dict(main or {}), **kwargs}
+
+    create_video_configuration = create_preview_configuration
+    create_still_configuration = create_preview_configuration
+
+    def configure(self, config):
+        size = (config or {}).get("main", {}).get("size")
+        lores_size = (config or {}).get("lores", {}).get("size")
+        if lores_size is not None and tuple(lores_size) != self.lores_size:
+            self.lores_size = tuple(lores_size)
+            self._lores = []
+        if size is not None and tuple(size) != self.size:
+            self.size = tuple(size)
+            self._prepare()
+        elif self.lores_size and not self._lores:
+            self._prepare_lores()
+
+    def start(self, *args, **kwargs):
+        self._started_at = time.perf_counter()
+        self.frames_served = 0
+
+    def stop(self):
+        self._started_at = None
+
+    def close(self):
+        self.stop()
+
+    def capture_array(self, name="main"):
+        arrays, _ = self.capture_arrays([name])
+        return arrays[0]
+
+    def capture_arrays(self, names=("main",)):
+        # One frame from each named stream, all from the same capture.
+        if self._started_at is None:
+            self.start()
+        if self.fps:
+            due = self._started_at + self.frames_served / self.fps
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        index = self.frames_served % len(self._frames)
+        self.frames_served += 1
+        streams = {"main": self._frames, "lores": self._lores}
+        if "lores" in names and not self._lores:
+            raise RuntimeError("No lores stream configured")
+        # A real camera hands out a fresh buffer every time.
+        return [streams[name][index].copy() for name in names], {"FrameCount": self.frames_served}
+
+    def _prepare(self):
+        if self.source is None:
+            self._frames = self._synthetic_frames()
+        elif os.path.isdir(self.source):
+            paths = sorted(os.path.join(self.source, f) for f in os.listdir(self.source)
+                           if f.lower().endswith(IMAGE_EXTENSIONS))
+            self._frames = [_load_image_rgb(path, self.size) for path in paths[:MAX_REPLAY_FRAMES]]
+        elif self.source.lower().endswith(IMAGE_EXTENSIONS):
+            self._frames = [_load_image_rgb(self.source, self.size)]
+        else:
+            self._frames = self._video_frames()
+        if not self._frames:
+            raise ValueError(f"No frames available from {self.source}")
+        self._prepare_lores()
+
+    def _prepare_lores(self):
+        # I420 like the sensor's lores output: the luma plane on top, then
+        # the quarter-size chroma planes.
+        self._lores = []
+        if self.lores_size is None:
+            return
+        width, height = self.lores_size
+        for frame in self._frames:
+            small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+            self._lores.append(cv2.cvtColor(small, cv2.COLOR_RGB2YUV_I420))
+
+    def _video_frames(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            raise ValueError(f"Could not open video: {self.source}")
+        frames = []
+        try:
+            while len(frames) < MAX_REPLAY_FRAMES:
+                ok, frame = capture.read()
+                if not ok:
+                    break
+                frames.append(cv2.cvtColor(cv2.resize(frame, self.size), cv2.COLOR_BGR2RGB))
+        finally:
+            capture.release()
+        return frames
+
+    def _synthetic_frames(self):
+        # A textured background with some sensor noise, plus `faces` face
+        # tiles drifting across it on fixed paths.
+        rng = np.random.default_rng(self.seed)
+        w, h = self.size
+        x = np.linspace(0, 255, w, dtype=np.float32)
+        y = np.linspace(0, 255, h, dtype=np.float32)
+        background = np.stack([
+            np.add.outer(y * 0.5, x * 0.3),
+            np.add.outer(y * 0.2, x * 0.6),
+            np.add.outer(y * 0.7, x * 0.1),
+        ], axis=-1)
+        background = np.clip(background, 0, 255).astype(np.uint8)
+
+        tiles = []
+        if self.face_tiles and self.faces:
+            tile_h = max(32, h // 3)
+            for i in range(self.faces):
+                tile = self.face_tiles[i % len(self.face_tiles)]
+                tile_w = max(32, int(tile.shape[1] * tile_h / tile.shape[0]))
+                tile_w = min(tile_w, w // max(1, self.faces))
+                tiles.append(cv2.resize(tile, (tile_w, tile_h)))
+
+        frames = []
+        for n in range(self.frame_count):
+            frame = background.copy()
+            noise = rng.integers(-8, 9, frame.shape, dtype=np.int16)
+            frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+            slot_w = w // max(1, len(tiles))
+            for i, tile in enumerate(tiles):
+                th, tw = tile.shape[:2]
+                phase = 2.0 * np.pi * (n / self.frame_count + i / max(1, len(tiles)))
+                left = int(i * slot_w + (slot_w - tw) * (0.5 + 0.4 * np.sin(phase)))
+                top = int((h - th) * (0.5 + 0.3 * np.cos(phase)))
+                left = max(0, min(w - tw, left))
+                top = max(0, min(h - th, top))
+                frame[top:top + th, left:left + tw] = tile
+            frames.append(frame)
+        return frames
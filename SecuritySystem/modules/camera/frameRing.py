@@ -0,0 +1,136 @@
+import time
+import threading
+import numpy as np
+
+DEFAULT_SLOTS = 4
+
+
+class FrameHandle:
+    # A read-only view of one ring slot. The slot is not reused for a new
+    # frame until the handle is released, so hold it only as long as needed.
+    __slots__ = ("frame", "generation", "timestamp", "_ring", "_slot", "_epoch", "_released")
+
+    def __init__(self, ring, slot, epoch, frame, generation, timestamp):
+        self.frame = frame
+        self.generation = generation
+        self.timestamp = timestamp
+        self._ring = ring
+        self._slot = slot
+        self._epoch = epoch
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._ring._release(self._slot, self._epoch)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class FrameRing:
+    # Fixed set of preallocated frame buffers. The producer writes straight
+    # into a free slot (writable() + commit()) and readers get handles to
+    # the newest committed slot instead of copies. Every commit bumps the
+    # generation counter, which readers use to wait for the next frame. The
+    # lock only guards slot bookkeeping, never a frame copy.
+    def __init__(self, slots=DEFAULT_SLOTS):
+        self.slots = max(2, int(slots))
+        self._cond = threading.Condition()
+        self._buffers = []
+        self._refs = []
+        self._generations = []
+        self._timestamps = []
+        self._epoch = 0
+        self._latest = None
+        self._writing = None
+        self._generation = 0
+        self.overruns = 0
+
+    @property
+    def generation(self):
+        with self._cond:
+            return self._generation
+
+    def _allocate_locked(self, shape, dtype):
+        # Outstanding handles keep the old arrays alive; the epoch stops
+        # their release from touching the new slots.
+        self._epoch += 1
+        self._buffers = [np.empty(shape, dtype=dtype) for _ in range(self.slots)]
+        self._refs = [0] * self.slots
+        self._generations = [0] * self.slots
+        self._timestamps = [0.0] * self.slots
+        self._latest = None
+        self._writing = None
+
+    def writable(self, shape, dtype=np.uint8):
+        # Returns a buffer to fill for the next frame, or None when every
+        # slot is still held by a reader (the frame should be dropped).
+        with self._cond:
+            if not self._buffers or self._buffers[0].shape != tuple(shape) or self._buffers[0].dtype != dtype:
+                self._allocate_locked(tuple(shape), dtype)
+            free = [i for i in range(self.slots)
+                    if i != self._latest and self._refs[i] == 0]
+            if not free:
+                self.overruns += 1
+                return None
+            self._writing = min(free, key=lambda i: self._generations[i])
+            return self._buffers[self._writing]
+
+    def commit(self, timestamp=None):
+        with self._cond:
+            if self._writing is None:
+                return self._generation
+            self._generation += 1
+            self._generations[self._writing] = self._generation
+            self._timestamps[self._writing] = time.time() if timestamp is None else timestamp
+            self._latest = self._writing
+            self._writing = None
+            self._cond.notify_all()
+            return self._generation
+
+    def publish(self, frame, timestamp=None):
+        # Copying variant for producers that cannot write in place.
+        buf = self.writable(frame.shape, frame.dtype)
+        if buf is None:
+            return None
+        np.copyto(buf, frame)
+        return self.commit(timestamp)
+
+    def _handle_locked(self):
+        if self._latest is None:
+            return None
+        slot = self._latest
+        self._refs[slot] += 1
+        view = self._buffers[slot].view()
+        view.flags.writeable = False
+        return FrameHandle(self, slot, self._epoch, view, self._generations[slot], self._timestamps[slot])
+
+    def latest(self):
+        with self._cond:
+            return self._handle_locked()
+
+    def wait_next(self, after_generation, timeout=None):
+        # Blocks until a frame newer than `after_generation` is committed and
+        # returns a handle to the newest one, or None on timeout.
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._generation > after_generation, timeout=timeout):
+                return None
+            return self._handle_locked()
+
+    def _release(self, slot, epoch):
+        with self._cond:
+            if epoch == self._epoch and self._refs[slot] > 0:
+                self._refs[slot] -= 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "slots": self.slots,
+                "generation": self._generation,
+                "held": sum(1 for r in self._refs if r),
+                "overruns": self.overruns,
+            }
@@ -0,0 +1,147 @@
+import os
+from modules.camera.fakeCamera import FakeCamera, load_face_tiles
+
+DEFAULT_SIZE = (640, 480)
+DEFAULT_FPS = 20.0
+
+PICAMERA2 = "picamera2"
+REPLAY = "replay"
+SYNTHETIC = "synthetic"
+
+
+class FrameSource:
+    # A camera as the pipeline sees it: start() opens the device, read()
+    # blocks until the next frame and returns it as an RGB array, stop()
+    # releases the device so it can idle. Nothing is opened in __init__, so
+    # building a source is cheap and works on machines without the camera.
+    # With `lores_size` the camera also delivers a small YUV420 stream, and
+    # read_frames() returns its luma plane with each frame for analytics.
+    kind = None
+
+    def __init__(self, size=DEFAULT_SIZE, lores_size=None):
+        self.size = tuple(size)
+        self.lores_size = tuple(lores_size) if lores_size else None
+        self.camera = None
+
+    @property
+    def running(self):
+        return self.camera is not None
+
+    def start(self):
+        raise NotImplementedError
+
+    def read(self):
+        return self.camera.capture_array("main")
+
+    def read_frames(self):
+        # The main RGB frame and the greyscale lores frame of the same
+        # capture; the second is None without a lores stream.
+        if self.lores_size is None:
+            return self.read(), None
+        (main, yuv), _ = self.camera.capture_arrays(["main", "lores"])
+        width, height = self.lores_size
+        return main, yuv[:height, :width]
+
+    def stop(self):
+        camera, self.camera = self.camera, None
+        if camera is not None:
+            try:
+                camera.stop()
+            finally:
+                camera.close()
+
+    def describe(self):
+        return {"kind": self.kind, "size": list(self.size), "running": self.running,
+                "lores_size": list(self.lores_size) if self.lores_size else None}
+
+
+class Picamera2Source(FrameSource):
+    kind = PICAMERA2
+
+    def start(self):
+        if self.camera is not None:
+            return
+        # Imported here so the app still imports where picamera2 is missing.
+        from picamera2 import Picamera2
+        camera = Picamera2()
+        # BGR888 hands out arrays in RGB order. The ISP scales the lores
+        # stream for free, and its YUV420 luma plane is already greyscale.
+        streams = {"main": {"size": self.size, "format": "BGR888"}}
+        if self.lores_size is not None:
+            streams["lores"] = {"size": self.lores_size, "format": "YUV420"}
+        camera.configure(camera.create_preview_configuration(**streams))
+        camera.start()
+        self.camera = camera
+
+
+class ReplaySource(FrameSource):
+    # Loops a video file, an image, or a directory of images at `fps`.
+    kind = REPLAY
+
+    def __init__(self, path, size=DEFAULT_SIZE, fps=DEFAULT_FPS, lores_size=None):
+        super().__init__(size, lores_size)
+        self.path = path
+        self.fps = fps
+
+    def _make_camera(self):
+        return FakeCamera(source=self.path, size=self.size, fps=self.fps, lores_size=self.lores_size)
+
+    def start(self):
+        if self.camera is not None:
+            return
+        camera = self._make_camera()
+        camera.start()
+        self.camera = camera
+
+    def describe(self):
+        return dict(super().describe(), path=self.path, fps=self.fps)
+
+
+class SyntheticSource(ReplaySource):
+    # A seeded generated scene, optionally with face tiles from `faces_dir`
+    # moving across it.
+    kind = SYNTHETIC
+
+    def __init__(self, size=DEFAULT_SIZE, fps=DEFAULT_FPS, faces_dir=None, faces=0, seed=0, lores_size=None):
+        super().__init__(None, size, fps, lores_size)
+        self.faces_dir = faces_dir
+        self.faces = faces
+        self.seed = seed
+
+    def _make_camera(self):
+        tiles = load_face_tiles(self.faces_dir) if self.faces_dir and self.faces else None
+        return FakeCamera(size=self.size, fps=self.fps, face_tiles=tiles, faces=self.faces if tiles else 0,
+                          seed=self.seed, lores_size=self.lores_size)
+
+    def describe(self):
+        return dict(FrameSource.describe(self), fps=self.fps, faces=self.faces)
+
+
+def _parse_size(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+def create_source(spec=None, size=None, fps=None, lores_size=None):
+    # `spec` (default: CAMERA_SOURCE) is "picamera2", "synthetic",
+    # "synthetic:<faces dir>" or "replay:<path>"; a bare path is replayed.
+    # CAMERA_SIZE ("640x480"), CAMERA_FPS and CAMERA_LORES_SIZE fill in
+    # what is not given; the fps only paces replay and synthetic sources.
+    # Without a lores size (the default) analytics use the main frames.
+    spec = spec or os.environ.get("CAMERA_SOURCE", PICAMERA2)
+    size = size or _parse_size(os.environ.get("CAMERA_SIZE", "%dx%d" % DEFAULT_SIZE))
+    fps = fps or float(os.environ.get("CAMERA_FPS", DEFAULT_FPS))
+    if lores_size is None and os.environ.get("CAMERA_LORES_SIZE"):
+        lores_size = _parse_size(os.environ["CAMERA_LORES_SIZE"])
+    if lores_size is not None and (lores_size[0] > size[0] or lores_size[1] > size[1]):
+        raise ValueError(f"Lores size {lores_size} is larger than the main size {size}")
+    kind, _, arg = spec.partition(":")
+    if kind == PICAMERA2:
+        return Picamera2Source(size, lores_size)
+    if kind == SYNTHETIC:
+        return SyntheticSource(size, fps, faces_dir=arg or None, faces=2 if arg else 0, lores_size=lores_size)
+    if kind == REPLAY and arg:
+        return ReplaySource(arg, size, fps, lores_size)
+    if os.path.exists(spec):
+        return ReplaySource(spec, size, fps, lores_size)
+    raise ValueError(f"Unknown camera source: {spec}")
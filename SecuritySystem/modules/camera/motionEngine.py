@@ -0,0 +1,217 @@
+import os
+import sys
+import json
+import time
+import cv2
+import numpy as np
+
+ZONES_PATH = os.path.join(os.path.dirname(__file__), "../../config/motionZones.json")
+INCLUDE = "include"
+EXCLUDE = "exclude"
+
+DEFAULT_WIDTH = 160
+DEFAULT_ALPHA = 0.05
+DEFAULT_THRESHOLD = 25
+DEFAULT_MIN_AREA_RATIO = 0.01
+DEFAULT_SENSITIVITY = 0.5
+DEFAULT_WARMUP_FRAMES = 10
+# Most of the frame changing at once is the exposure or the lights, not
+# something moving; the background is reset instead of triggering.
+GLOBAL_CHANGE_RATIO = 0.6
+
+
+def load_zones(path=ZONES_PATH):
+    # Zone file format, coordinates as fractions of the frame:
+    # [{"name": "door", "mode": "include", "sensitivity": 0.7,
+    #   "polygon": [[0.1, 0.2], [0.5, 0.2], [0.5, 0.9], [0.1, 0.9]]}, ...]
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[MOTION] Ignoring unreadable zone file {path}: {e}")
+        return []
+
+
+class MotionEngine:
+    # Motion detection on a small grayscale copy of the frame against a
+    # running-average background, so slow lighting drift is absorbed
+    # instead of triggering. Changed pixels are counted per zone; a zone
+    # triggers when its changed fraction exceeds its own minimum, which
+    # `sensitivity` (0..1) scales from twice the default down to zero.
+    def __init__(self, width=DEFAULT_WIDTH, alpha=DEFAULT_ALPHA, threshold=DEFAULT_THRESHOLD,
+                 min_area_ratio=DEFAULT_MIN_AREA_RATIO, zones=None, warmup_frames=DEFAULT_WARMUP_FRAMES):
+        self.width = width
+        self.alpha = alpha
+        self.threshold = threshold
+        self.min_area_ratio = min_area_ratio
+        self.zones = zones or []
+        self.warmup_frames = warmup_frames
+        self._background = None
+        self._frames_seen = 0
+        self._shape = None
+        self._zone_masks = []
+        self._active_mask = None
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+        self.resets = 0
+
+    def _prepare(self, frame_shape):
+        h, w = frame_shape[:2]
+        scale = min(1.0, self.width / float(w))
+        size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+        self._shape = frame_shape[:2]
+        self._size = size
+        self._scale = scale
+        self._background = None
+        self._frames_seen = 0
+
+        self._zone_masks = []
+        include = np.zeros((size[1], size[0]), dtype=np.uint8)
+        exclude = np.zeros_like(include)
+        has_include = False
+        for zone in self.zones:
+            mask = np.zeros_like(include)
+            polygon = np.array([[x * size[0], y * size[1]] for x, y in zone["polygon"]], dtype=np.int32)
+            cv2.fillPoly(mask, [polygon], 255)
+            if zone.get("mode", INCLUDE) == EXCLUDE:
+                exclude |= mask
+                continue
+            has_include = True
+            include |= mask
+            self._zone_masks.append((zone, mask))
+        if not has_include:
+            include[:] = 255
+            self._zone_masks.append(({"name": "frame", "sensitivity": DEFAULT_SENSITIVITY}, include.copy()))
+        self._active_mask = cv2.bitwise_and(include, cv2.bitwise_not(exclude))
+        self._zone_masks = [(zone, cv2.bitwise_and(mask, self._active_mask)) for zone, mask in self._zone_masks]
+
+    def _zone_min_ratio(self, zone):
+        if "min_area_ratio" in zone:
+            return zone["min_area_ratio"]
+        sensitivity = min(1.0, max(0.0, zone.get("sensitivity", DEFAULT_SENSITIVITY)))
+        return self.min_area_ratio * 2.0 * (1.0 - sensitivity)
+
+    def process(self, frame):
+        if self._shape != frame.shape[:2]:
+            self._prepare(frame.shape)
+
+        small = cv2.resize(frame, self._size, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+        self._frames_seen += 1
+
+        if self._background is None:
+            self._background = gray.astype(np.float32)
+            return self._result(False, 0.0, [], {})
+
+        delta = cv2.absdiff(gray, cv2.convertScaleAbs(self._background))
+        _, fg = cv2.threshold(delta, self.threshold, 255, cv2.THRESH_BINARY)
+        fg = cv2.bitwise_and(fg, self._active_mask)
+        fg = cv2.morphologyEx(fg, cv2.MORPH_OPEN, self._kernel)
+
+        active_pixels = cv2.countNonZero(self._active_mask)
+        changed = cv2.countNonZero(fg)
+        if active_pixels and changed / active_pixels > GLOBAL_CHANGE_RATIO:
+            self._background = gray.astype(np.float32)
+            self.resets += 1
+            return self._result(False, 0.0, [], {})
+
+        # Moving pixels are blended in far more slowly than the rest so
+        # someone standing still is not absorbed into the background at once.
+        cv2.accumulateWeighted(gray, self._background, self.alpha, mask=cv2.bitwise_not(fg))
+        cv2.accumulateWeighted(gray, self._background, self.alpha * 0.1, mask=fg)
+
+        zone_scores = {}
+        triggered = False
+        score = 0.0
+        for zone, mask in self._zone_masks:
+            pixels = cv2.countNonZero(mask)
+            if not pixels:
+                continue
+            ratio = cv2.countNonZero(cv2.bitwise_and(fg, mask)) / pixels
+            zone_scores[zone.get("name", "zone")] = ratio
+            min_ratio = self._zone_min_ratio(zone)
+            score = max(score, ratio / min_ratio if min_ratio > 0 else (1.0 if ratio > 0 else 0.0))
+            if ratio > 0 and ratio >= min_ratio:
+                triggered = True
+
+        boxes = []
+        if changed:
+            contours, _ = cv2.findContours(cv2.dilate(fg, self._kernel, iterations=2),
+                                           cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            inv = 1.0 / self._scale
+            for contour in contours:
+                x, y, w, h = cv2.boundingRect(contour)
+                boxes.append([int(x * inv), int(y * inv), int(w * inv), int(h * inv)])
+
+        motion = triggered and self._frames_seen > self.warmup_frames
+        return self._result(motion, score, boxes, zone_scores)
+
+    def _result(self, motion, score, boxes, zones):
+        return {"motion": motion, "score": float(score), "boxes": boxes, "zones": zones, "timestamp": time.time()}
+
+
+def _legacy_motion(prev_gray, frame, min_area=5000):
+    # The full-resolution previous-frame diff this engine replaced, kept
+    # only for the benchmark below.
+    gray = cv2.GaussianBlur(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), (21, 21), 0)
+    if prev_gray is None:
+        return gray, False
+    thresh = cv2.threshold(cv2.absdiff(prev_gray, gray), 25, 255, cv2.THRESH_BINARY)[1]
+    thresh = cv2.dilate(thresh, None, iterations=2)
+    contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return gray, any(cv2.contourArea(c) > min_area for c in contours)
+
+
+def benchmark(frames=200, size=(640, 480), seed=0):
+    # A static scene with a slow brightness ramp, a light switched on a
+    # quarter of the way in, and a block crossing it in the second half:
+    # only the block should count as motion.
+    rng = np.random.default_rng(seed)
+    w, h = size
+    base = rng.integers(40, 160, (h, w, 3), dtype=np.uint8)
+    sequence = []
+    for i in range(frames):
+        beta = 40.0 * i / frames + (50.0 if i >= frames // 4 else 0.0)
+        frame = cv2.convertScaleAbs(base, alpha=1.0, beta=beta)
+        moving = i >= frames // 2
+        if moving:
+            x = int((i - frames // 2) / (frames / 2) * (w - 120))
+            frame[h // 3:h // 3 + 120, x:x + 120] = 255
+        sequence.append((frame, moving))
+
+    engine = MotionEngine()
+    started = time.perf_counter()
+    engine_hits = [engine.process(frame)["motion"] for frame, _ in sequence]
+    engine_ms = (time.perf_counter() - started) * 1000.0 / frames
+
+    prev = None
+    legacy_hits = []
+    started = time.perf_counter()
+    for frame, _ in sequence:
+        prev, hit = _legacy_motion(prev, frame)
+        legacy_hits.append(hit)
+    legacy_ms = (time.perf_counter() - started) * 1000.0 / frames
+
+    def summary(hits):
+        return {
+            "false_triggers": sum(1 for hit, (_, moving) in zip(hits, sequence) if hit and not moving),
+            "detected": sum(1 for hit, (_, moving) in zip(hits, sequence) if hit and moving),
+            "moving_frames": sum(1 for _, moving in sequence if moving),
+        }
+
+    return [
+        dict(method="legacy", ms_per_frame=legacy_ms, **summary(legacy_hits)),
+        dict(method="engine", ms_per_frame=engine_ms, **summary(engine_hits)),
+    ]
+
+
+if __name__ == "__main__":
+    rows = benchmark()
+    if "--json" in sys.argv:
+        print(json.dumps(rows, indent=2))
+    else:
+        print(f"{'method':>8} {'ms/frame':>9} {'detected':>9} {'false':>6}")
+        for r in rows:
+            print(f"{r['method']:>8} {r['ms_per_frame']:>9.3f} {r['detected']:>5}/{r['moving_frames']:<3} {r['false_triggers']:>6}")
@@ -0,0 +1,79 @@
+import os
+import re
+import json
+from collections import OrderedDict
+from modules.camera.cameraPipeline import CameraPipeline
+from modules.camera.frameSources import create_source
+from modules.camera.motionEngine import ZONES_PATH
+
+CAMERAS_PATH = os.path.join(os.path.dirname(__file__), "../../config/cameras.json")
+DEFAULT_CAMERA_ID = "main"
+_CAMERA_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def load_camera_config(path=CAMERAS_PATH):
+    # Camera file format; only "id" is required, "source" takes the same
+    # values as CAMERA_SOURCE, "lores" is the analytics stream size and
+    # "zones" is a motion zone file:
+    # [{"id": "front", "source": "picamera2", "size": [1920, 1080], "lores": [320, 240]},
+    #  {"id": "garage", "source": "replay:/media/garage.mp4", "fps": 10,
+    #   "zones": "config/motionZones.garage.json"}, ...]
+    # Without the file there is one camera, configured from the environment.
+    if not os.path.exists(path):
+        return [{"id": os.environ.get("CAMERA_ID", DEFAULT_CAMERA_ID)}]
+    with open(path, "r") as f:
+        cameras = json.load(f)
+    if not cameras:
+        raise ValueError(f"No cameras configured in {path}")
+    seen = set()
+    for camera in cameras:
+        camera_id = camera.get("id", "")
+        if not _CAMERA_ID.match(camera_id):
+            raise ValueError(f"Invalid camera id {camera_id!r} in {path}")
+        if camera_id in seen:
+            raise ValueError(f"Duplicate camera id {camera_id!r} in {path}")
+        seen.add(camera_id)
+    return cameras
+
+
+class PipelineManager:
+    # One CameraPipeline per configured camera, all sharing the retention
+    # quota and the analytics scheduler. The first camera is the default:
+    # it keeps writing straight into the photo and video folders, while the
+    # others get a sub-folder named after their id.
+    def __init__(self, cameras, videos_dir, photos_dir, retention, scheduler=None, **pipeline_options):
+        self.retention = retention
+        self.scheduler = scheduler
+        self.pipelines = OrderedDict()
+        for index, camera in enumerate(cameras):
+            camera_id = camera["id"]
+            size = camera.get("size")
+            lores = camera.get("lores")
+            source = create_source(camera.get("source"), size=tuple(size) if size else None, fps=camera.get("fps"),
+                                   lores_size=tuple(lores) if lores else None)
+            if index == 0:
+                camera_videos, camera_photos = videos_dir, photos_dir
+                zones = camera.get("zones", ZONES_PATH)
+            else:
+                camera_videos = os.path.join(videos_dir, camera_id)
+                camera_photos = os.path.join(photos_dir, camera_id)
+                zones = camera.get("zones", os.path.join(os.path.dirname(ZONES_PATH), f"motionZones.{camera_id}.json"))
+            self.pipelines[camera_id] = CameraPipeline(camera_id, source, camera_videos, camera_photos, retention,
+                                                       scheduler=scheduler, zones_path=zones, **pipeline_options)
+
+    @property
+    def default(self):
+        return next(iter(self.pipelines.values()))
+
+    def get(self, camera_id):
+        return self.pipelines.get(camera_id)
+
+    def ids(self):
+        return list(self.pipelines)
+
+    def shutdown(self):
+        for pipeline in self.pipelines.values():
+            pipeline.shutdown()
+
+    def stats(self):
+        return {camera_id: pipeline.stats() for camera_id, pipeline in self.pipelines.items()}
@@ -0,0 +1,126 @@
+import time
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from modules.monitoring.metrics import metrics
+
+DEFAULT_SECONDS = 5.0
+DEFAULT_FPS = 20.0
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+DEFAULT_JPEG_QUALITY = 85
+
+
+class PreRollBuffer:
+    # Keeps the last `seconds` of camera frames as JPEGs, sampled at the
+    # recording frame rate, so a recording that starts on motion can begin
+    # with what happened just before it. Frames are compressed because ring
+    # slots cannot be held for seconds at a time; memory is capped by both
+    # age and `max_bytes`.
+    def __init__(self, ring, seconds=DEFAULT_SECONDS, fps=DEFAULT_FPS, max_bytes=DEFAULT_MAX_BYTES,
+                 jpeg_quality=DEFAULT_JPEG_QUALITY, metric_labels=None):
+        self.ring = ring
+        self.seconds = seconds
+        self.fps = fps
+        self.max_bytes = max_bytes
+        self.jpeg_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)]
+        self._lock = threading.Lock()
+        self._frames = deque()
+        self._bytes = 0
+        self._evicted_for_memory = 0
+        self._encode_ms_total = 0.0
+        self._encoded = 0
+        self._encode_time = metrics.stage("pre_roll", "jpeg_encode", metric_labels)
+        self._thread = None
+        self._stop = None
+
+    def start(self):
+        with self._lock:
+            # A thread that was told to stop but has not exited yet does not
+            # count: it is left to finish and a fresh one takes over.
+            if self._thread is not None and self._thread.is_alive() and not self._stop.is_set():
+                return
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+            self._thread.start()
+        print(f"[PREROLL] Buffering last {self.seconds:.1f}s at {self.fps:.0f} fps")
+
+    def stop(self, timeout=1.0):
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if self._stop is not None:
+                self._stop.set()
+            self._frames.clear()
+            self._bytes = 0
+        # Joined outside the lock: the thread takes it to append its last frame.
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop.is_set()
+
+    def _run(self, stop):
+        last_generation = 0
+        last_kept = 0.0
+        interval = 1.0 / self.fps if self.fps else 0.0
+        while not stop.is_set():
+            handle = self.ring.wait_next(last_generation, timeout=0.5)
+            if handle is None:
+                continue
+            with handle:
+                last_generation = handle.generation
+                timestamp = handle.timestamp
+                if timestamp - last_kept < interval:
+                    continue
+                started = time.perf_counter()
+                ok, buf = cv2.imencode(".jpg", handle.frame, self.jpeg_params)
+            if not ok:
+                continue
+            last_kept = timestamp
+            elapsed = time.perf_counter() - started
+            self._encode_time.observe(elapsed)
+            self._append(stop, timestamp, buf.tobytes(), elapsed * 1000.0)
+
+    def _append(self, stop, timestamp, jpeg, encode_ms):
+        # `stop` is the calling thread's own event, so a thread that is still
+        # winding down after a restart cannot add to the new buffer.
+        with self._lock:
+            if stop.is_set():
+                return
+            self._frames.append((timestamp, jpeg))
+            self._bytes += len(jpeg)
+            self._encoded += 1
+            self._encode_ms_total += encode_ms
+            while self._frames and self._frames[0][0] < timestamp - self.seconds:
+                self._bytes -= len(self._frames.popleft()[1])
+            while self._frames and self._bytes > self.max_bytes:
+                self._bytes -= len(self._frames.popleft()[1])
+                self._evicted_for_memory += 1
+
+    def drain(self):
+        # Hands over the buffered (timestamp, jpeg) pairs, oldest first, and
+        # empties the buffer.
+        with self._lock:
+            frames = list(self._frames)
+            self._frames.clear()
+            self._bytes = 0
+        return frames
+
+    @staticmethod
+    def decode(jpeg):
+        return cv2.imdecode(np.frombuffer(jpeg, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def stats(self):
+        with self._lock:
+            span = (self._frames[-1][0] - self._frames[0][0]) if len(self._frames) > 1 else 0.0
+            return {
+                "running": self.running,
+                "frames": len(self._frames),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "seconds": span,
+                "target_seconds": self.seconds,
+                "evicted_for_memory": self._evicted_for_memory,
+                "encode_ms_avg": (self._encode_ms_total / self._encoded) if self._encoded else 0.0,
+            }
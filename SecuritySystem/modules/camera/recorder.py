@@ -0,0 +1,241 @@
+import os
+import time
+import threading
+from collections import deque
+from datetime import datetime
+import cv2
+import numpy as np
+from modules.monitoring.metrics import metrics
+
+DEFAULT_FPS = 20.0
+DEFAULT_MAX_QUEUE = 30
+DEFAULT_FOURCC = "mp4v"
+DEFAULT_SEGMENT_SECONDS = 60.0
+
+_OPEN = "open"
+_FRAME = "frame"
+_CLOSE = "close"
+
+
+class Recorder:
+    # Owns the VideoWriter on its own thread. Callers only flip recording
+    # on and off and hand over frames; opening files, encoding and writing
+    # to the SD card all happen here. Frames are copied into a bounded pool
+    # of preallocated buffers, and when the pool is exhausted because the
+    # disk is behind, new frames are dropped and counted instead of
+    # blocking the caller. A recording is split into files of
+    # `segment_seconds` each (video_<start>_000.mp4, _001, ...) and
+    # `on_segment(path)` is called as each one is closed.
+    def __init__(self, videos_dir, fps=DEFAULT_FPS, max_queue=DEFAULT_MAX_QUEUE, pre_roll=None,
+                 fourcc=DEFAULT_FOURCC, segment_seconds=DEFAULT_SEGMENT_SECONDS, on_segment=None,
+                 name="recorder", metric_labels=None):
+        self.videos_dir = videos_dir
+        self.fps = fps
+        self.max_queue = max_queue
+        self.pre_roll = pre_roll
+        self.fourcc = fourcc
+        self.segment_seconds = segment_seconds
+        self.on_segment = on_segment
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._free = []
+        self._pool_shape = None
+        self._pool_size = 0
+        self._active = False
+        self._stem = None
+        self._path = None
+        self._last_submit = 0.0
+        self._counters = {"submitted": 0, "written": 0, "dropped": 0, "prerolled": 0, "recordings": 0,
+                          "segments": 0, "failed": 0}
+        self._write_ms_total = 0.0
+        self._write_ms_max = 0.0
+        self._open_ms_last = None
+        self._write_time = metrics.stage("recorder", "write", metric_labels)
+        self._open_time = metrics.stage("recorder", "open", metric_labels)
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def active(self):
+        with self._cond:
+            return self._active
+
+    @property
+    def path(self):
+        with self._cond:
+            return self._path
+
+    def _segment_path(self, stem, index):
+        return os.path.join(self.videos_dir, f"{stem}_{index:03d}.mp4")
+
+    def start(self):
+        with self._cond:
+            if self._active:
+                return self._path
+            base = f"video_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            stem = base
+            suffix = 1
+            # The previous recording may still be queued and not exist yet.
+            while stem == self._stem or os.path.exists(self._segment_path(stem, 0)):
+                suffix += 1
+                stem = f"{base}-{suffix}"
+            self._stem = stem
+            self._path = self._segment_path(stem, 0)
+            self._active = True
+            self._last_submit = 0.0
+            self._counters["recordings"] += 1
+            # Taken now, at the moment recording was asked for; the writer
+            # thread trims whatever overlaps the first live frame.
+            prerolled = self.pre_roll.drain() if self.pre_roll is not None else []
+            self._queue.append((_OPEN, stem, prerolled))
+            self._cond.notify()
+            return self._path
+
+    def stop(self):
+        with self._cond:
+            if not self._active:
+                return
+            self._active = False
+            self._queue.append((_CLOSE, None, None))
+            self._cond.notify()
+
+    def submit(self, frame, timestamp=None):
+        # Never blocks on disk: returns False when recording is off, the
+        # frame is not due yet at the target fps, or the queue is full.
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._cond:
+            if not self._active:
+                return False
+            if self._last_submit and timestamp - self._last_submit < 1.0 / self.fps:
+                return False
+            self._last_submit = timestamp
+            self._counters["submitted"] += 1
+            buf = self._take_buffer_locked(frame)
+            if buf is None:
+                self._counters["dropped"] += 1
+                return False
+        np.copyto(buf, frame)
+        with self._cond:
+            self._queue.append((_FRAME, buf, timestamp))
+            self._cond.notify()
+        return True
+
+    def _take_buffer_locked(self, frame):
+        if self._pool_shape != (frame.shape, frame.dtype):
+            self._pool_shape = (frame.shape, frame.dtype)
+            self._free = []
+            self._pool_size = 0
+        if self._free:
+            return self._free.pop()
+        if self._pool_size < self.max_queue:
+            self._pool_size += 1
+            return np.empty(frame.shape, dtype=frame.dtype)
+        return None
+
+    def _give_back(self, buf):
+        with self._cond:
+            if self._pool_shape == (buf.shape, buf.dtype):
+                self._free.append(buf)
+
+    def _run(self):
+        writer = None
+        path = None
+        stem = None
+        index = 0
+        segment_started = 0.0
+        prerolled = []
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                kind, payload, extra = self._queue.popleft()
+
+            if kind == _OPEN:
+                writer = self._close(writer, path)
+                stem, index, prerolled = payload, 0, extra
+            elif kind == _CLOSE:
+                writer = self._close(writer, path)
+                stem, prerolled = None, []
+            elif kind == _FRAME:
+                if stem is not None:
+                    if writer is not None and extra - segment_started >= self.segment_seconds:
+                        writer = self._close(writer, path)
+                        index += 1
+                    if writer is None:
+                        path = self._segment_path(stem, index)
+                        with self._cond:
+                            if self._stem == stem:
+                                self._path = path
+                        writer = self._open(path, payload.shape, prerolled, before=extra)
+                        segment_started = extra
+                        prerolled = []
+                        if writer is None:
+                            stem = None
+                    if writer is not None:
+                        self._write(writer, payload)
+                self._give_back(payload)
+
+    def _open(self, path, shape, prerolled, before):
+        started = time.perf_counter()
+        h, w = shape[:2]
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), self.fps, (w, h))
+        if not writer.isOpened():
+            print(f"[REC] Failed to open VideoWriter for {path}")
+            with self._cond:
+                self._counters["failed"] += 1
+            return None
+
+        count = 0
+        for timestamp, jpeg in prerolled:
+            if timestamp >= before:
+                break
+            frame = self.pre_roll.decode(jpeg)
+            if frame is None or frame.shape[:2] != (h, w):
+                continue
+            writer.write(frame)
+            count += 1
+        with self._cond:
+            self._counters["segments"] += 1
+            if prerolled:
+                self._counters["prerolled"] += count
+            self._open_ms_last = (time.perf_counter() - started) * 1000.0
+        self._open_time.observe(self._open_ms_last / 1000.0)
+        print(f"[REC] Started recording: {path} ({count} pre-roll frames)")
+        return writer
+
+    def _write(self, writer, frame):
+        started = time.perf_counter()
+        writer.write(frame)
+        elapsed = time.perf_counter() - started
+        self._write_time.observe(elapsed)
+        write_ms = elapsed * 1000.0
+        with self._cond:
+            self._counters["written"] += 1
+            self._write_ms_total += write_ms
+            self._write_ms_max = max(self._write_ms_max, write_ms)
+
+    def _close(self, writer, path):
+        if writer is not None:
+            writer.release()
+            print(f"[REC] Saved recording: {path}")
+            if self.on_segment is not None:
+                try:
+                    self.on_segment(path)
+                except Exception as e:
+                    print(f"[REC] Error in segment callback for {path}: {e}")
+        return None
+
+    def stats(self):
+        with self._cond:
+            written = self._counters["written"]
+            return dict(
+                self._counters,
+                active=self._active,
+                path=self._path if self._active else None,
+                queue_depth=sum(1 for item in self._queue if item[0] == _FRAME),
+                max_queue=self.max_queue,
+                write_ms_avg=(self._write_ms_total / written) if written else 0.0,
+                write_ms_max=self._write_ms_max,
+                open_ms_last=self._open_ms_last,
+            )
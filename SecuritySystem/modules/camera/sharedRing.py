@@ -0,0 +1,128 @@
+import numpy as np
+from multiprocessing import shared_memory
+
+DEFAULT_SLOTS = 4
+# Header words: newest generation, newest slot; then per slot: sequence,
+# generation, timestamp in microseconds.
+_HEADER_FIELDS = 2
+_SLOT_FIELDS = 3
+_ALIGN = 64
+
+
+class SharedFrame:
+    # A read-only view straight into a shared slot. The writer does not wait
+    # for readers, so a slow reader must call valid() after using the frame:
+    # False means the slot was rewritten underneath it and the result of
+    # whatever was computed from it should be thrown away.
+    __slots__ = ("frame", "generation", "timestamp", "_ring", "_slot", "_seq")
+
+    def __init__(self, ring, slot, seq, frame, generation, timestamp):
+        self.frame = frame
+        self.generation = generation
+        self.timestamp = timestamp
+        self._ring = ring
+        self._slot = slot
+        self._seq = seq
+
+    def valid(self):
+        return self._ring._slot_seq(self._slot) == self._seq
+
+
+class SharedFrameRing:
+    # Fixed-shape frame ring in a multiprocessing.shared_memory block, so
+    # analytics worker processes can read camera frames without a copy
+    # through a pipe. There is one writer, the camera loop of the process
+    # that created the ring; workers attach() by name. Each slot has a
+    # sequence number that is odd while the slot is being written (a
+    # seqlock), which is how readers detect a frame that was overwritten
+    # while they used it. `cond` is a multiprocessing Condition the writer
+    # notifies after every frame; without one readers only poll.
+    def __init__(self, shape, dtype=np.uint8, slots=DEFAULT_SLOTS, name=None, cond=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.slots = max(2, int(slots))
+        self.cond = cond
+        self.owner = name is None
+        header_words = _HEADER_FIELDS + _SLOT_FIELDS * self.slots
+        offset = -(-header_words * 8 // _ALIGN) * _ALIGN
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        if self.owner:
+            self._shm = shared_memory.SharedMemory(create=True, size=offset + frame_bytes * self.slots)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+        self._header = np.ndarray((header_words,), dtype=np.int64, buffer=self._shm.buf)
+        self._frames = np.ndarray((self.slots,) + self.shape, dtype=self.dtype, buffer=self._shm.buf, offset=offset)
+        if self.owner:
+            self._header[:] = 0
+            self._header[1] = -1
+
+    @classmethod
+    def attach(cls, spec, cond=None):
+        return cls(spec["shape"], spec["dtype"], spec["slots"], name=spec["name"], cond=cond)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def generation(self):
+        return int(self._header[0])
+
+    def spec(self):
+        # Everything a worker needs to attach(); small and picklable.
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype.str, "slots": self.slots}
+
+    def _slot_seq(self, slot):
+        return int(self._header[_HEADER_FIELDS + slot * _SLOT_FIELDS])
+
+    def publish(self, frame, timestamp, generation):
+        # Copies `frame` into the slot after the newest one. Returns False
+        # when the frame does not fit the ring (the camera changed size).
+        if frame.shape != self.shape or frame.dtype != self.dtype:
+            return False
+        header = self._header
+        slot = (int(header[1]) + 1) % self.slots
+        base = _HEADER_FIELDS + slot * _SLOT_FIELDS
+        header[base] += 1
+        np.copyto(self._frames[slot], frame)
+        header[base + 1] = generation
+        header[base + 2] = int(timestamp * 1e6)
+        header[base] += 1
+        header[1] = slot
+        header[0] = generation
+        if self.cond is not None:
+            with self.cond:
+                self.cond.notify_all()
+        return True
+
+    def latest(self):
+        header = self._header
+        slot = int(header[1])
+        if slot < 0:
+            return None
+        base = _HEADER_FIELDS + slot * _SLOT_FIELDS
+        seq = int(header[base])
+        if seq & 1:
+            return None
+        view = self._frames[slot].view()
+        view.flags.writeable = False
+        return SharedFrame(self, slot, seq, view, int(header[base + 1]), header[base + 2] / 1e6)
+
+    def wait_next(self, after_generation, timeout=None):
+        # The newest frame once one newer than `after_generation` has been
+        # published, or None on timeout.
+        if self.cond is not None:
+            with self.cond:
+                if not self.cond.wait_for(lambda: self._header[0] > after_generation, timeout=timeout):
+                    return None
+        elif self._header[0] <= after_generation:
+            return None
+        return self.latest()
+
+    def close(self):
+        # Views handed out by latest() must be gone before this is called.
+        self._header = None
+        self._frames = None
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
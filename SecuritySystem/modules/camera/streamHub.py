@@ -0,0 +1,127 @@
+import time
+import threading
+import cv2
+import numpy as np
+from modules.monitoring.metrics import metrics
+
+DEFAULT_JPEG_QUALITY = 95
+WAIT_TIMEOUT_S = 1.0
+# A viewer that has not been sent anything for this long gets the last
+# frame again, so a closed connection is noticed even while the camera is
+# stalled.
+KEEPALIVE_S = 5.0
+_placeholder_jpeg = None
+
+
+def _placeholder():
+    # Sent as the keep-alive before any frame has been produced.
+    global _placeholder_jpeg
+    if _placeholder_jpeg is None:
+        _placeholder_jpeg = cv2.imencode(".jpg", np.zeros((48, 64, 3), dtype=np.uint8))[1].tobytes()
+    return _placeholder_jpeg
+
+
+def keepalive_frames(wait_for_frame, last_seq, keepalive=KEEPALIVE_S):
+    # Yields every JPEG wait_for_frame(after_seq) -> (seq, jpeg or None)
+    # hands out after `last_seq`, plus a repeat of the last one every
+    # `keepalive` seconds while none arrives. A write to a closed socket is
+    # what ends an MJPEG generator, so without the repeats a viewer that
+    # leaves while the camera is stalled would never be unsubscribed.
+    last_jpeg = None
+    last_sent = time.monotonic()
+    while True:
+        seq, jpeg = wait_for_frame(last_seq)
+        if jpeg is None:
+            if time.monotonic() - last_sent >= keepalive:
+                last_sent = time.monotonic()
+                yield last_jpeg if last_jpeg is not None else _placeholder()
+            continue
+        last_seq = seq
+        last_jpeg = jpeg
+        last_sent = time.monotonic()
+        yield jpeg
+
+
+class StreamHub:
+    # Fan-out for the MJPEG feed. One encoder thread waits on the frame
+    # ring, turns the newest frame into a JPEG tagged with the frame's
+    # generation, and every client waits for a sequence newer than the last
+    # one it sent. Encoding cost is per frame, not per viewer, and nothing
+    # is encoded while nobody is watching.
+    def __init__(self, ring, jpeg_quality=DEFAULT_JPEG_QUALITY, name="stream", metric_labels=None):
+        self.ring = ring
+        self.jpeg_params = [int(cv2.IMWRITE_JPEG_QUALITY), int(jpeg_quality)]
+        self._lock = threading.Lock()
+        self._jpeg_ready = threading.Condition(self._lock)
+        self._jpeg = None
+        self._seq = 0
+        self._subscribers = 0
+        self._thread = None
+        self._encoded = 0
+        self._skipped = 0
+        self.name = name
+        self._encode_time = metrics.stage("stream", "jpeg_encode", metric_labels)
+
+    def subscribe(self):
+        with self._lock:
+            self._subscribers += 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._encode_loop, name=self.name, daemon=True)
+                self._thread.start()
+            return self._seq
+
+    def unsubscribe(self):
+        with self._lock:
+            self._subscribers = max(0, self._subscribers - 1)
+
+    def _encode_loop(self):
+        while True:
+            with self._lock:
+                if self._subscribers == 0:
+                    self._thread = None
+                    return
+                last_seq = self._seq
+
+            # Frames committed while the previous one was encoding are
+            # skipped; only the newest is worth sending.
+            handle = self.ring.wait_next(last_seq, timeout=WAIT_TIMEOUT_S)
+            if handle is None:
+                continue
+            with handle:
+                seq = handle.generation
+                with self._encode_time.time():
+                    ok, buf = cv2.imencode(".jpg", handle.frame, self.jpeg_params)
+            if not ok:
+                print(f"[STREAM] Failed to encode frame {seq}")
+                continue
+
+            with self._lock:
+                self._jpeg = buf.tobytes()
+                if last_seq:
+                    self._skipped += seq - last_seq - 1
+                self._seq = seq
+                self._encoded += 1
+                self._jpeg_ready.notify_all()
+
+    def wait_for_frame(self, after_seq, timeout=WAIT_TIMEOUT_S):
+        with self._lock:
+            self._jpeg_ready.wait_for(lambda: self._seq > after_seq, timeout=timeout)
+            if self._seq > after_seq:
+                return self._seq, self._jpeg
+            return after_seq, None
+
+    def frames(self):
+        last_seq = self.subscribe()
+        try:
+            yield from keepalive_frames(self.wait_for_frame, last_seq)
+        finally:
+            self.unsubscribe()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "subscribers": self._subscribers,
+                "seq": self._seq,
+                "encoded": self._encoded,
+                "skipped": self._skipped,
+            }
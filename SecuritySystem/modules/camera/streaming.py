@@ -1,192 +1,106 @@
 import os
-import cv2
-import time
-import threading
-from datetime import datetime
-from picamera2 import Picamera2
+import atexit
+from modules.storage.imageWriter import image_writer
+from modules.storage.retention import RetentionManager
+from modules.storage.eventStore import event_store
+from modules.camera.analyticsScheduler import AnalyticsScheduler
+from modules.camera.analyticsWorkers import THREAD
+from modules.camera.pipelineManager import PipelineManager, load_camera_config
+from modules.monitoring.metrics import metrics
 
 PHOTOS_DIR = os.path.join("data", "photos")
 VIDEOS_DIR = os.path.join("data", "videos")
 os.makedirs(PHOTOS_DIR, exist_ok=True)
 os.makedirs(VIDEOS_DIR, exist_ok=True)
 
-picam2 = Picamera2()
-config = picam2.create_preview_configuration(
-    main={"size": (640, 480), "format": "BGR888"}  
-)
-picam2.configure(config)
-picam2.start()
-
-_lock = threading.Lock()
-_current_frame = None  
-_running = True
-
-_manual_recording = False         
-_motion_recording = False         
-_recording_active = False         
-_writer = None
-_record_target_fps = 20.0
-_last_write_time = 0.0
-_current_video_path = None
-
-_MOTION_MIN_AREA = 5000           
-_MOTION_PERSISTENCE_S = 5.0       
-_last_motion_ts = 0.0
-_prev_gray = None
-
-# Motion control variables
-_motion_thread = None
-_motion_running = False
-
-
-def _now_ts():
-    return time.time()
-
-def _timestamp_name(prefix: str, ext: str):
-    return f"{prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{ext}"
-
-def get_latest_frame():
-    with _lock:
-        if _current_frame is None:
-            return None
-        return _current_frame.copy()
-
-def _open_writer(frame_shape):
-    global _writer, _current_video_path, _last_write_time
-    h, w = frame_shape[:2]
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    filename = _timestamp_name("video", "mp4")
-    path = os.path.join(VIDEOS_DIR, filename)
-    writer = cv2.VideoWriter(path, fourcc, _record_target_fps, (w, h))
-    if not writer.isOpened():
-        raise RuntimeError("Failed to open VideoWriter")
-    _writer = writer
-    _current_video_path = path
-    _last_write_time = 0.0
-    print(f"[REC] Started recording: {path}")
-
-def _close_writer():
-    global _writer, _current_video_path
-    if _writer is not None:
-        _writer.release()
-        print(f"[REC] Saved recording: {_current_video_path}")
-    _writer = None
-    _current_video_path = None
-
-def _update_recording_state(frame_shape):
-    global _recording_active
-    want_active = _manual_recording or _motion_recording
-    if want_active and not _recording_active:
-        _open_writer(frame_shape)
-        _recording_active = True
-    elif not want_active and _recording_active:
-        _close_writer()
-        _recording_active = False
-
-def start_manual_recording():
-    global _manual_recording
-    with _lock:
-        _manual_recording = True
-
-def stop_manual_recording():
-    global _manual_recording
-    with _lock:
-        _manual_recording = False
-
-def is_recording():
-    with _lock:
-        return _recording_active
-
-def save_photo_from_latest() -> str:
-    frame = get_latest_frame()
-    if frame is None:
-        raise RuntimeError("No frame available to save")
-    filename = _timestamp_name("photo", "jpg")
-    path = os.path.join(PHOTOS_DIR, filename)
-    if not cv2.imwrite(path, frame):
-        raise RuntimeError("Failed to write photo")
-    return path
-
-def _camera_loop():
-    global _current_frame, _last_write_time
-    while _running:
-        rgb = picam2.capture_array("main")
-        bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
-
-        with _lock:
-            _current_frame = bgr
-            _update_recording_state(bgr.shape)
-
-            if _recording_active and _writer is not None:
-                now = _now_ts()
-                if _last_write_time == 0.0 or (now - _last_write_time) >= (1.0 / _record_target_fps):
-                    _writer.write(bgr)
-                    _last_write_time = now
-
-        time.sleep(0.005)
-
-def start_motion_detection():
-    global _motion_thread, _motion_running
-    if _motion_running:
-        return
-    _motion_running = True
-    _motion_thread = threading.Thread(target=_motion_loop, daemon=True)
-    _motion_thread.start()
-    print("[MOTION] Motion detection started.")
-
-def stop_motion_detection():
-    global _motion_running
-    _motion_running = False
-    print("[MOTION] Motion detection stopped.")
-
-def _motion_loop():
-    global _prev_gray, _motion_recording, _last_motion_ts, _motion_running
-    while _running and _motion_running:
-        frame = get_latest_frame()
-        if frame is None:
-            time.sleep(0.02)
-            continue
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        gray = cv2.GaussianBlur(gray, (21, 21), 0)
-
-        if _prev_gray is None:
-            _prev_gray = gray
-            time.sleep(0.05)
-            continue
-
-        delta = cv2.absdiff(_prev_gray, gray)
-        thresh = cv2.threshold(delta, 25, 255, cv2.THRESH_BINARY)[1]
-        thresh = cv2.dilate(thresh, None, iterations=2)
-        contours, _ = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        motion_now = any(cv2.contourArea(c) > _MOTION_MIN_AREA for c in contours)
-
-        with _lock:
-            if motion_now:
-                _motion_recording = True
-                _last_motion_ts = _now_ts()
-            else:
-                if _motion_recording and (_now_ts() - _last_motion_ts) > _MOTION_PERSISTENCE_S:
-                    _motion_recording = False
-
-        _prev_gray = gray
-        time.sleep(0.05)
-
-def generate_frames():
-    import numpy as np 
-    while True:
-        frame = get_latest_frame()
-        if frame is None:
-            time.sleep(0.01)
-            continue
-        ok, buf = cv2.imencode(".jpg", frame)
-        if not ok:
-            continue
-        jpg = buf.tobytes()
-        yield (b"--frame\r\n"
-               b"Content-Type: image/jpeg\r\n\r\n" + jpg + b"\r\n")
-
-_thread_cam = threading.Thread(target=_camera_loop, daemon=True)
-_thread_cam.start()
-
+# Photos and recordings of every camera share one quota; the oldest files
+# go first once it is exceeded or the card drops below the free-space floor.
+_STORAGE_QUOTA_GB = float(os.environ.get("STORAGE_QUOTA_GB", 8))
+_STORAGE_MIN_FREE_MB = float(os.environ.get("STORAGE_MIN_FREE_MB", 1024))
+retention = RetentionManager([VIDEOS_DIR, PHOTOS_DIR],
+                             quota_bytes=int(_STORAGE_QUOTA_GB * 1024 ** 3),
+                             min_free_bytes=int(_STORAGE_MIN_FREE_MB * 1024 ** 2))
+retention.start()
+
+# Cores that motion detection on all cameras plus face recognition may use
+# between them.
+_ANALYTICS_CPU_BUDGET = float(os.environ.get("ANALYTICS_CPU_BUDGET", 1.0))
+scheduler = AnalyticsScheduler(budget=_ANALYTICS_CPU_BUDGET)
+# "thread" runs analytics beside capture and streaming in this process;
+# "process" moves them to worker processes fed through shared memory, so
+# they use other cores instead of competing for this one's GIL.
+_ANALYTICS_MODE = os.environ.get("ANALYTICS_MODE", THREAD)
+
+# Cameras come from config/cameras.json, or a single camera chosen by
+# CAMERA_SOURCE (see frameSources.create_source). Nothing is opened until a
+# consumer needs it; an unused camera stops after CAMERA_IDLE_SECONDS.
+# CAMERA_LORES_SIZE (e.g. 320x240) adds a small greyscale stream that motion
+# and face detection use, so CAMERA_SIZE can go up to 1920x1080 for
+# recording and viewing without slowing analytics down.
+_PREROLL_SECONDS = float(os.environ.get("PREROLL_SECONDS", 5.0))
+_PREROLL_MAX_MB = float(os.environ.get("PREROLL_MAX_MB", 32))
+_SEGMENT_SECONDS = float(os.environ.get("RECORDING_SEGMENT_SECONDS", 60))
+_CAMERA_IDLE_SECONDS = float(os.environ.get("CAMERA_IDLE_SECONDS", 10))
+pipelines = PipelineManager(load_camera_config(), VIDEOS_DIR, PHOTOS_DIR, retention, scheduler,
+                            segment_seconds=_SEGMENT_SECONDS, preroll_seconds=_PREROLL_SECONDS,
+                            preroll_max_bytes=int(_PREROLL_MAX_MB * 1024 * 1024),
+                            idle_seconds=_CAMERA_IDLE_SECONDS, analytics_mode=_ANALYTICS_MODE)
+atexit.register(pipelines.shutdown)
+
+
+def _stat(source, key):
+    return lambda: source.stats()[key]
+
+_CALLBACK_METRICS = [
+    # (kind, name, help, source, stats key)
+    ("gauge", "image_writer_queue_depth", "Images waiting to be written", image_writer, "queue_depth"),
+    ("counter", "image_writer_written_total", "Images written to disk", image_writer, "written"),
+    ("counter", "image_writer_dropped_total", "Images dropped because the writer queue was full", image_writer, "dropped"),
+    ("counter", "image_writer_failed_total", "Images that failed to write", image_writer, "failed"),
+    ("gauge", "storage_bytes", "Bytes of media under retention", retention, "bytes"),
+    ("gauge", "storage_files", "Media files under retention", retention, "files"),
+    ("gauge", "storage_free_bytes", "Free space on the media disk at the last check", retention, "free_bytes"),
+    ("counter", "storage_evicted_files_total", "Files deleted by retention", retention, "evicted_files"),
+    ("gauge", "event_store_queue_depth", "Events waiting to be written", event_store, "queued"),
+    ("counter", "event_store_written_total", "Events written to the database", event_store, "written"),
+    ("counter", "event_store_failed_total", "Events lost to database errors", event_store, "failed"),
+]
+for _kind, _name, _help, _source, _key in _CALLBACK_METRICS:
+    getattr(metrics, _kind)(_name, _help, fn=_stat(_source, _key))
+metrics.gauge("image_writer_latency_seconds", "Average time from queueing an image to it being on disk",
+              fn=lambda: image_writer.stats()["latency_ms_avg"] / 1000.0)
+metrics.gauge("image_writer_latency_max_seconds", "Longest time from queueing an image to it being on disk",
+              fn=lambda: image_writer.stats()["latency_ms_max"] / 1000.0)
+metrics.gauge("analytics_budget_cores", "Cores analytics may use across all cameras", fn=lambda: scheduler.budget)
+metrics.gauge("analytics_workers", "Analytics workers sharing the budget",
+              fn=lambda: len(scheduler.stats()["workers"]))
+
+# The module-level API below drives the default (first) camera, as it did
+# before there could be more than one.
+default_pipeline = pipelines.default
+camera_source = default_pipeline.source
+frame_ring = default_pipeline.frame_ring
+stream_hub = default_pipeline.stream_hub
+pre_roll = default_pipeline.pre_roll
+recorder = default_pipeline.recorder
+
+acquire_camera = default_pipeline.acquire
+release_camera = default_pipeline.release
+get_latest_frame = default_pipeline.get_latest_frame
+latest_frame = default_pipeline.latest_frame
+wait_for_frame = default_pipeline.wait_for_frame
+save_photo_from_latest = default_pipeline.save_photo
+start_manual_recording = default_pipeline.start_manual_recording
+stop_manual_recording = default_pipeline.stop_manual_recording
+is_recording = default_pipeline.is_recording
+start_motion_detection = default_pipeline.start_motion_detection
+stop_motion_detection = default_pipeline.stop_motion_detection
+generate_frames = default_pipeline.generate_frames
+shutdown_camera = pipelines.shutdown
+
+
+def camera_stats():
+    return default_pipeline.stats()["camera"]
+
+def recording_stats():
+    return dict(default_pipeline.stats(), storage=retention.stats(), analytics=scheduler.stats())
@@ -0,0 +1,167 @@
+import os
+import json
+import time
+import queue
+import sqlite3
+import threading
+
+DB_PATH = os.path.join(os.path.dirname(__file__), "../../data/database.db")
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_FLUSH_INTERVAL_S = 1.0
+DEFAULT_QUERY_LIMIT = 100
+MAX_QUERY_LIMIT = 1000
+
+MOTION = "motion"
+FACE = "face"
+RECORDING = "recording"
+
+_COLUMNS = ("id", "ts", "type", "person", "confidence", "box", "media_path", "details")
+
+
+def init_events_table(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ts REAL NOT NULL,
+            type TEXT NOT NULL,
+            person TEXT,
+            confidence REAL,
+            box TEXT,
+            media_path TEXT,
+            details TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_ts ON events (ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_type_ts ON events (type, ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_person_ts ON events (person, ts)")
+
+
+class EventStore:
+    # Motion, recognition and recording events in the app database. record()
+    # only enqueues; a writer thread inserts whatever has queued up in one
+    # transaction, at most every `flush_interval` seconds or `batch_size`
+    # rows, with the database in WAL mode so readers never wait on it.
+    def __init__(self, db_path=DB_PATH, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL_S):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._written = 0
+        self._batches = 0
+        self._failed = 0
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            with self._connect() as conn:
+                init_events_table(conn)
+            self._thread = threading.Thread(target=self._run, name="event-store", daemon=True)
+            self._thread.start()
+
+    def record(self, event_type, ts=None, person=None, confidence=None, box=None, media_path=None, **details):
+        self.start()
+        self._queue.put((
+            time.time() if ts is None else ts,
+            event_type,
+            person,
+            None if confidence is None else float(confidence),
+            None if box is None else json.dumps([int(v) for v in box]),
+            media_path,
+            json.dumps(details) if details else None,
+        ))
+
+    def _run(self):
+        conn = self._connect()
+        while True:
+            rows = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(rows) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    rows.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO events (ts, type, person, confidence, box, media_path, details) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                with self._lock:
+                    self._written += len(rows)
+                    self._batches += 1
+            except sqlite3.Error as e:
+                with self._lock:
+                    self._failed += len(rows)
+                print(f"[EVENTS] Failed to write {len(rows)} events: {e}")
+
+    def query(self, start=None, end=None, person=None, event_type=None, limit=DEFAULT_QUERY_LIMIT, offset=0):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        if person is not None:
+            clauses.append("person = ?")
+            params.append(person)
+        if event_type is not None:
+            clauses.append("type = ?")
+            params.append(event_type)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        params += [max(1, min(int(limit), MAX_QUERY_LIMIT)), max(0, int(offset))]
+
+        self.start()
+        with sqlite3.connect(self.db_path) as conn:
+            rows = conn.execute(f"SELECT {', '.join(_COLUMNS)} FROM events {where} "
+                                "ORDER BY ts DESC LIMIT ? OFFSET ?", params).fetchall()
+        events = []
+        for row in rows:
+            event = dict(zip(_COLUMNS, row))
+            event["box"] = json.loads(event["box"]) if event["box"] else None
+            event["details"] = json.loads(event["details"]) if event["details"] else {}
+            events.append(event)
+        return events
+
+    def summary(self, start=None, end=None):
+        clauses, params = [], []
+        if start is not None:
+            clauses.append("ts >= ?")
+            params.append(start)
+        if end is not None:
+            clauses.append("ts < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        self.start()
+        with sqlite3.connect(self.db_path) as conn:
+            by_type = conn.execute(f"SELECT type, COUNT(*), MAX(ts) FROM events {where} GROUP BY type", params).fetchall()
+            by_person = conn.execute(f"SELECT person, COUNT(*), MAX(ts) FROM events {where} "
+                                     f"{'AND' if where else 'WHERE'} person IS NOT NULL GROUP BY person", params).fetchall()
+        return {
+            "types": {t: {"count": n, "last_ts": last} for t, n, last in by_type},
+            "people": {p: {"count": n, "last_ts": last} for p, n, last in by_person},
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "written": self._written,
+                "batches": self._batches,
+                "failed": self._failed,
+            }
+
+
+event_store = EventStore()
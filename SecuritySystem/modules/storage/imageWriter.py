@@ -0,0 +1,12 @@
+import os
+import sys
+
+# The writer is shared with webControl through the repository's
+# sharedModules folder.
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
+
+from sharedModules.imageWriter import ImageWriter
+
+image_writer = ImageWriter()
@@ -0,0 +1,148 @@
+import os
+import heapq
+import shutil
+import threading
+
+DEFAULT_QUOTA_BYTES = 8 * 1024 ** 3
+DEFAULT_MIN_FREE_BYTES = 1024 ** 3
+DEFAULT_INTERVAL_S = 30.0
+EVICT_BATCH = 20
+MEDIA_EXTENSIONS = (".mp4", ".h264", ".avi", ".jpg", ".jpeg", ".png")
+
+
+class RetentionManager:
+    # Keeps recordings and photos under a byte quota and the disk above a
+    # free-space floor by deleting the oldest files first. The directories
+    # are scanned once at start; after that the index is kept up to date by
+    # add() calls from the writers, so eviction never rescans the tree.
+    # Each pass deletes at most EVICT_BATCH files.
+    def __init__(self, roots, quota_bytes=DEFAULT_QUOTA_BYTES, min_free_bytes=DEFAULT_MIN_FREE_BYTES,
+                 interval=DEFAULT_INTERVAL_S):
+        self.roots = [os.path.abspath(root) for root in roots]
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        # Heap of (mtime, path); a path re-added with a newer mtime gets a
+        # fresh entry and the old one is skipped when it is popped.
+        self._heap = []
+        self._files = {}
+        self._total = 0
+        self._evicted_files = 0
+        self._evicted_bytes = 0
+        self._last_free = None
+        self._scanned = False
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+
+    def add(self, path):
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        with self._lock:
+            self._add_locked(path, st.st_mtime, st.st_size)
+        if self._over_limit():
+            self._wake.set()
+
+    def _add_locked(self, path, mtime, size):
+        previous = self._files.get(path)
+        if previous is not None:
+            self._total -= previous[1]
+        if previous is None or previous[0] != mtime:
+            heapq.heappush(self._heap, (mtime, path))
+        self._files[path] = (mtime, size)
+        self._total += size
+
+    def _scan(self):
+        for root in self.roots:
+            os.makedirs(root, exist_ok=True)
+            for dirpath, _, files in os.walk(root):
+                for filename in files:
+                    if not filename.lower().endswith(MEDIA_EXTENSIONS):
+                        continue
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    with self._lock:
+                        self._add_locked(path, st.st_mtime, st.st_size)
+        self._scanned = True
+        print(f"[RETENTION] Indexed {len(self._files)} files, {self._total / 1024 ** 2:.1f} MB")
+
+    def _free_bytes(self):
+        try:
+            self._last_free = shutil.disk_usage(self.roots[0]).free
+        except OSError:
+            self._last_free = None
+        return self._last_free
+
+    def _over_limit(self):
+        with self._lock:
+            if self.quota_bytes is not None and self._total > self.quota_bytes:
+                return True
+        if self.min_free_bytes is not None:
+            free = self._free_bytes()
+            return free is not None and free < self.min_free_bytes
+        return False
+
+    def _run(self):
+        self._scan()
+        while True:
+            while self._over_limit():
+                if not self._evict_batch():
+                    break
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _evict_batch(self):
+        evicted = 0
+        while evicted < EVICT_BATCH:
+            with self._lock:
+                if not self._heap:
+                    return evicted > 0
+                mtime, path = heapq.heappop(self._heap)
+                entry = self._files.get(path)
+                if entry is None or entry[0] != mtime:
+                    # Stale: the file was re-added with a newer mtime.
+                    continue
+                del self._files[path]
+                size = entry[1]
+                self._total -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                print(f"[RETENTION] Could not delete {path}: {e}")
+                continue
+            with self._lock:
+                self._evicted_files += 1
+                self._evicted_bytes += size
+            evicted += 1
+            print(f"[RETENTION] Deleted {path} ({size / 1024 ** 2:.1f} MB)")
+            if not self._over_limit():
+                break
+        return evicted > 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scanned": self._scanned,
+                "files": len(self._files),
+                "bytes": self._total,
+                "quota_bytes": self.quota_bytes,
+                "min_free_bytes": self.min_free_bytes,
+                "free_bytes": self._last_free,
+                "evicted_files": self._evicted_files,
+                "evicted_bytes": self._evicted_bytes,
+            }
@@ -2,11 +2,16 @@ from flask import Flask, render_template, request, redirect, url_for, flash, ses
 import sqlite3, json, os
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-from modules.camera.streaming import generate_frames, picam2,start_motion_detection,stop_motion_detection
-from picamera2.encoders import H264Encoder
-from picamera2.outputs import FileOutput
-from modules.ai.facialRecognition import FacialRecognitionCamera, train_faces
-from modules.ai.history import get_all_photos_with_names, get_existing_people, assign_photo
+from modules.camera.streaming import generate_frames, default_pipeline, pipelines, scheduler, save_photo_from_latest, start_manual_recording, stop_manual_recording, start_motion_detection,stop_motion_detection,recording_stats
+from modules.ai.facialRecognition import FacialRecognitionCamera, train_faces, gallery_manager
+from modules.ai.adaptiveScaler import DEFAULT_TARGET_MS
+from modules.ai.faceTracker import DEFAULT_DETECT_EVERY
+from modules.ai.history import get_all_photos_with_names, get_existing_people, assign_photo, get_unknown_clusters, assign_cluster
+from modules.ai.unknownClusters import unknown_faces
+from modules.ai.recognitionService import RecognitionService
+from modules.ai.trainingJobs import TrainingJobQueue, init_training_jobs_table
+from modules.storage.eventStore import event_store, init_events_table
+from modules.monitoring.metrics import metrics
 
 
 app = Flask(__name__, template_folder='../../templates', static_folder='../../static')
@@ -16,23 +21,22 @@ DB_PATH = os.path.join(os.path.dirname(__file__), '../../data/database.db')
 JSON_PATH = os.path.join(os.path.dirname(__file__), '../../config/users.json')
 
 is_recording = False
-video_output = None
-facial_recognition_camera = None
+# Frame time the adaptive detection scale aims for, and how many frames
+# apart full detections run (tracking fills the frames in between).
+_FACE_TARGET_MS = float(os.environ.get("FACE_TARGET_MS", DEFAULT_TARGET_MS))
+_FACE_DETECT_EVERY = int(os.environ.get("FACE_DETECT_EVERY", DEFAULT_DETECT_EVERY))
+_face_options = {"target_ms": _FACE_TARGET_MS, "detect_every": _FACE_DETECT_EVERY}
+recognition_service = RecognitionService(lambda: FacialRecognitionCamera(default_pipeline.ring_camera(),
+                                                                        recognizer=default_pipeline.remote_recognizer(**_face_options),
+                                                                        **_face_options),
+                                         scheduler=scheduler)
+training_jobs = TrainingJobQueue(DB_PATH, train_faces)
+metrics.gauge("ai_clients", "Connected face recognition viewers", fn=lambda: recognition_service.subscribers)
 
 def generate_facial_recognition_frames():
-    global facial_recognition_camera
-    if facial_recognition_camera is None:
-        facial_recognition_camera = FacialRecognitionCamera(picam2)
-    
-    while True:
-        try:
-            frame = facial_recognition_camera.get_frame_with_recognition()
-            if frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n\r\n')
-        except Exception as e:
-            print(f"Error generating facial recognition frame: {e}")
-            break
+    for frame in recognition_service.frames():
+        yield (b'--frame\r\n'
+               b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n\r\n')
 
 
 
@@ -46,6 +50,8 @@ def init_db():
                 password TEXT NOT NULL
             )
         ''')
+        init_training_jobs_table(conn)
+        init_events_table(conn)
         conn.commit()
 
 def save_to_json(username, password):
@@ -123,7 +129,8 @@ def aiCamera():
     if 'username' in session:
         photos = get_all_photos_with_names()
         people = get_existing_people()
-        return render_template('aiCamera.html', username=session['username'], photos=photos, people=people)
+        clusters = get_unknown_clusters(photos)
+        return render_template('aiCamera.html', username=session['username'], photos=photos, people=people, clusters=clusters)
     return redirect(url_for('login'))
     
     
@@ -159,6 +166,36 @@ def assign_unknown():
             assign_photo(photo, new_name, create_new=True)
             flash(f"Photo assigned to new person {new_name}", "success")
 
+    training_jobs.submit(incremental=True)
+    return redirect(url_for("aiCamera"))
+
+@app.route('/assign_cluster', methods=["POST"])
+def assign_unknown_cluster():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+
+    try:
+        cluster_id = int(request.form.get("cluster_id", ""))
+    except ValueError:
+        flash("No group provided", "error")
+        return redirect(url_for("aiCamera"))
+
+    person = request.form.get("new_name", "").strip() or request.form.get("person", "").strip()
+    if not person:
+        flash("No name provided", "error")
+        return redirect(url_for("aiCamera"))
+
+    assigned = assign_cluster(cluster_id, person)
+    flash(f"{len(assigned)} photos assigned to {person}", "success")
+    training_jobs.submit(incremental=True)
+    return redirect(url_for("aiCamera"))
+
+@app.route('/recluster_unknowns', methods=["POST"])
+def recluster_unknowns():
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    count = unknown_faces.recluster()
+    flash(f"Unknown faces regrouped into {count} groups", "success")
     return redirect(url_for("aiCamera"))
 
 
@@ -178,15 +215,33 @@ def facial_recognition_feed():
 @app.route('/facialRecognition')
 def facialRecognition():
     if 'username' in session:
-        try:
-            result = train_faces()
-            flash(f'Training complete! Loaded {len(result["encodings"])} face encodings.', 'success')
-        except Exception as e:
-            flash(f'Training failed: {e}', 'error')
-        
         return render_template('facialRecognition.html', username=session['username'])
     return redirect(url_for('login'))
 
+@app.route('/retrain_faces', methods=['GET', 'POST'])
+def retrain_faces():
+    if 'username' not in session:
+        return jsonify(message="Not logged in"), 401
+    incremental = request.args.get('full') != '1'
+    job_id, created = training_jobs.submit(incremental=incremental)
+    message = f"Training job {job_id} queued" if created else f"Training job {job_id} is already queued"
+    return jsonify(message=message, job_id=job_id)
+
+@app.route('/training_jobs')
+def training_job_list():
+    return jsonify(jobs=training_jobs.recent())
+
+@app.route('/training_jobs/<int:job_id>')
+def training_job_status(job_id):
+    job = training_jobs.get(job_id)
+    if job is None:
+        return jsonify(message=f"No training job {job_id}"), 404
+    return jsonify(job)
+
+@app.route('/training_progress')
+def training_progress():
+    return jsonify(job=training_jobs.latest())
+
 
 def gen(camera):
     while True:
@@ -204,8 +259,7 @@ def video_feed():
 def capture():
     try:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = os.path.join('data', 'photos', f'photo_{timestamp}.jpg')
-        picam2.capture_file(filename)
+        filename = save_photo_from_latest(os.path.join('data', 'photos', f'photo_{timestamp}.jpg'))
         return jsonify(message=f"Photo saved: {filename}")
     except Exception as e:
         return jsonify(message=f"Error: {e}"), 500
@@ -224,9 +278,7 @@ def capture_named():
         user_photos_dir = os.path.join('data', 'photos', sanitized_name)
         os.makedirs(user_photos_dir, exist_ok=True)
         
-        filename = os.path.join(user_photos_dir, f'photo_{timestamp}.jpg')
-        
-        picam2.capture_file(filename)
+        filename = save_photo_from_latest(os.path.join(user_photos_dir, f'photo_{timestamp}.jpg'))
         
         return jsonify(message=f"Photo saved for {user_name}: {filename}")
     except Exception as e:
@@ -234,30 +286,30 @@ def capture_named():
 
 @app.route('/record')
 def record():
-    global is_recording, video_output
+    global is_recording
     try:
+        # Manual recordings go through the same segmented recorder as motion
+        # recordings, so they are split every RECORDING_SEGMENT_SECONDS and
+        # each segment is handed to retention as it closes.
         if not is_recording:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = os.path.join('data', 'videos', f'video_{timestamp}.h264')
-            encoder = H264Encoder()
-            video_output = FileOutput(filename)
-            picam2.start_recording(encoder, video_output)
+            start_manual_recording()
             is_recording = True
-            return jsonify(message=f"Recording started: {filename}")
-        else:
-            picam2.stop_recording()
-            is_recording = False
-            return jsonify(message="Recording stopped and saved.")
+            return jsonify(message="Recording started.")
+        stop_manual_recording()
+        is_recording = False
+        return jsonify(message="Recording stopped and saved.")
     except Exception as e:
         return jsonify(message=f"Error: {e}"), 500
         
-@app.route('/stop_facial_recognition')
-def stop_facial_recognition():
-    global facial_recognition_camera
-    if facial_recognition_camera is not None:
-        del facial_recognition_camera
-        facial_recognition_camera = None
-    return jsonify(message="Facial recognition camera stopped")
+@app.route('/facial_recognition_detections')
+def facial_recognition_detections():
+    seq, _, detections, published_at = recognition_service.latest()
+    return jsonify(seq=seq, timestamp=published_at, detections=detections,
+                   viewers=recognition_service.subscribers)
+
+@app.route('/gallery_status')
+def gallery_status():
+    return jsonify(gallery_manager.status())
         
 @app.route('/start_motion')
 def start_motion():
@@ -269,6 +321,108 @@ def stop_motion():
     stop_motion_detection()
     return jsonify(message="Motion detection stopped.")
 
+def _time_arg(name):
+    # Accepts epoch seconds or an ISO date/time.
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+@app.route('/events')
+def events():
+    try:
+        start, end = _time_arg('start'), _time_arg('end')
+        limit = int(request.args.get('limit', 100))
+        offset = int(request.args.get('offset', 0))
+    except ValueError as e:
+        return jsonify(message=f"Error: {e}"), 400
+    rows = event_store.query(start=start, end=end, person=request.args.get('person'),
+                             event_type=request.args.get('type'), limit=limit, offset=offset)
+    return jsonify(events=rows)
+
+@app.route('/events/summary')
+def events_summary():
+    try:
+        start, end = _time_arg('start'), _time_arg('end')
+    except ValueError as e:
+        return jsonify(message=f"Error: {e}"), 400
+    return jsonify(event_store.summary(start=start, end=end))
+
+@app.route('/recording_status')
+def recording_status():
+    return jsonify(recording_stats())
+
+def _no_camera(camera_id):
+    return jsonify(message=f"No camera {camera_id}"), 404
+
+@app.route('/cameras')
+def cameras():
+    return jsonify(cameras=[pipeline.stats()["camera"] for pipeline in pipelines.pipelines.values()],
+                   default=default_pipeline.camera_id, analytics=scheduler.stats())
+
+@app.route('/cameras/<camera_id>/video_feed')
+def camera_video_feed(camera_id):
+    pipeline = pipelines.get(camera_id)
+    if pipeline is None:
+        return _no_camera(camera_id)
+    return Response(pipeline.generate_frames(), mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/cameras/<camera_id>/capture')
+def camera_capture(camera_id):
+    pipeline = pipelines.get(camera_id)
+    if pipeline is None:
+        return _no_camera(camera_id)
+    try:
+        filename = pipeline.save_photo()
+        return jsonify(message=f"Photo saved: {filename}")
+    except Exception as e:
+        return jsonify(message=f"Error: {e}"), 500
+
+@app.route('/cameras/<camera_id>/record')
+def camera_record(camera_id):
+    pipeline = pipelines.get(camera_id)
+    if pipeline is None:
+        return _no_camera(camera_id)
+    if pipeline.stats()["recording"]["manual"]:
+        pipeline.stop_manual_recording()
+        return jsonify(message="Recording stopped and saved.")
+    pipeline.start_manual_recording()
+    return jsonify(message="Recording started.")
+
+@app.route('/cameras/<camera_id>/start_motion', methods=['GET', 'POST'])
+def camera_start_motion(camera_id):
+    pipeline = pipelines.get(camera_id)
+    if pipeline is None:
+        return _no_camera(camera_id)
+    pipeline.start_motion_detection()
+    return jsonify(message=f"Motion detection started on {camera_id}.")
+
+@app.route('/cameras/<camera_id>/stop_motion', methods=['GET', 'POST'])
+def camera_stop_motion(camera_id):
+    pipeline = pipelines.get(camera_id)
+    if pipeline is None:
+        return _no_camera(camera_id)
+    pipeline.stop_motion_detection()
+    return jsonify(message=f"Motion detection stopped on {camera_id}.")
+
+@app.route('/cameras/<camera_id>/status')
+def camera_status(camera_id):
+    pipeline = pipelines.get(camera_id)
+    if pipeline is None:
+        return _no_camera(camera_id)
+    return jsonify(pipeline.stats())
+
+@app.route('/metrics')
+def metrics_text():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics.json')
+def metrics_json():
+    return jsonify(metrics.snapshot())
+
 @app.route('/logout')
 def logout():
     session.pop('username', None)
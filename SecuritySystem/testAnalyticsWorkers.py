@@ -0,0 +1,81 @@
+import time
+import queue
+import threading
+import unittest
+from types import SimpleNamespace
+import numpy as np
+from modules.camera.sharedRing import SharedFrameRing
+from modules.camera.analyticsWorkers import _serve
+
+# Roughly what face detection takes on a Pi, against a 30 fps writer that
+# laps a four-slot ring about every 130 ms.
+ANALYSE_S = 0.3
+FRAME_S = 1 / 30
+
+
+class SlowAnalyserTest(unittest.TestCase):
+    def setUp(self):
+        self.ring = SharedFrameRing((48, 64, 3), cond=threading.Condition())
+        self.results = queue.Queue()
+        self.stop = threading.Event()
+        self.share = SimpleNamespace(value=1.0)
+        self.writing = threading.Event()
+        self.writing.set()
+        self.writer = threading.Thread(target=self._write, daemon=True)
+        self.writer.start()
+
+    def tearDown(self):
+        self.stop.set()
+        self.writing.clear()
+        self.writer.join()
+        self.ring.close()
+
+    def _write(self):
+        generation = 0
+        while self.writing.is_set():
+            generation += 1
+            frame = np.full(self.ring.shape, generation % 256, dtype=np.uint8)
+            self.ring.publish(frame, time.time(), generation)
+            time.sleep(FRAME_S)
+
+    def _run(self, analyse, seconds=2.0):
+        server = threading.Thread(target=_serve,
+                                  args=(self.ring, self.results, self.stop, self.share, analyse, 0.0))
+        server.start()
+        time.sleep(seconds)
+        self.stop.set()
+        server.join()
+        messages = []
+        while not self.results.empty():
+            messages.append(self.results.get())
+        return messages
+
+    def test_copied_frame_survives_a_slow_analysis(self):
+        def analyse(shared):
+            frame = shared.frame.copy()
+            if not shared.valid():
+                return None, True
+            time.sleep(ANALYSE_S)
+            return int(frame[0, 0, 0]), False
+
+        messages = self._run(analyse)
+        self.assertGreaterEqual(len(messages), 4)
+        for message in messages:
+            self.assertFalse(message["torn"])
+            self.assertIsNone(message["error"])
+            self.assertEqual(message["result"], message["generation"] % 256)
+
+    def test_frame_read_after_the_writer_lapped_it_is_torn(self):
+        def analyse(shared):
+            time.sleep(ANALYSE_S)
+            return int(shared.frame[0, 0, 0]), not shared.valid()
+
+        messages = self._run(analyse)
+        self.assertTrue(messages)
+        for message in messages:
+            self.assertTrue(message["torn"])
+            self.assertIsNone(message["result"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import os
+import cv2
+import time
+import threading
+from collections import deque
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+POLICIES = (DROP_OLDEST, DROP_NEWEST)
+
+
+class ImageWriter:
+    # Encodes and writes images on a background thread so capture loops never
+    # wait on cv2.imencode or the SD card. Every accepted job's
+    # on_done(path, ok) is called exactly once, with ok=False if it is
+    # dropped before being written.
+    def __init__(self, max_queue=8, policy=DROP_OLDEST, name="image-writer"):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.max_queue = max_queue
+        self.policy = policy
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._busy = False
+        self._running = True
+        self._counters = {
+            "submitted": 0,
+            "written": 0,
+            "failed": 0,
+            "dropped": 0,
+        }
+        self._write_ms_total = 0.0
+        self._write_ms_max = 0.0
+        self._latency_ms_total = 0.0
+        self._latency_ms_max = 0.0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, path, image, params=None, on_done=None):
+        # `image` must not be modified by the caller after submitting.
+        job = (path, image, params or [], on_done, time.perf_counter())
+        discarded = None
+        with self._cond:
+            if not self._running:
+                return False
+            self._counters["submitted"] += 1
+            if len(self._pending) >= self.max_queue:
+                self._counters["dropped"] += 1
+                if self.policy == DROP_NEWEST:
+                    print(f"[WRITER] Queue full, dropping {path}")
+                    return False
+                discarded = self._pending.popleft()
+                print(f"[WRITER] Queue full, dropping {discarded[0]}")
+            self._pending.append(job)
+            self._cond.notify()
+        # Outside the lock, so the callback may submit again.
+        if discarded is not None:
+            self._done(discarded[0], discarded[3], False)
+        return True
+
+    def _done(self, path, on_done, ok):
+        if on_done is not None:
+            try:
+                on_done(path, ok)
+            except Exception as e:
+                print(f"[WRITER] Error in completion callback for {path}: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                path, image, params, on_done, submitted_at = self._pending.popleft()
+                self._busy = True
+
+            started = time.perf_counter()
+            ok = False
+            try:
+                ext = os.path.splitext(path)[1] or ".jpg"
+                encoded, buf = cv2.imencode(ext, image, params)
+                if not encoded:
+                    raise RuntimeError(f"Failed to encode {path}")
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                tmp_path = path + ".part"
+                with open(tmp_path, "wb") as f:
+                    f.write(buf.tobytes())
+                os.replace(tmp_path, path)
+                ok = True
+            except Exception as e:
+                print(f"[WRITER] Error writing {path}: {e}")
+            finished = time.perf_counter()
+
+            self._done(path, on_done, ok)
+
+            with self._cond:
+                self._busy = False
+                write_ms = (finished - started) * 1000.0
+                latency_ms = (finished - submitted_at) * 1000.0
+                if ok:
+                    self._counters["written"] += 1
+                    self._write_ms_total += write_ms
+                    self._write_ms_max = max(self._write_ms_max, write_ms)
+                    self._latency_ms_total += latency_ms
+                    self._latency_ms_max = max(self._latency_ms_max, latency_ms)
+                else:
+                    self._counters["failed"] += 1
+                self._cond.notify_all()
+
+    def flush(self, timeout=None):
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._pending and not self._busy, timeout=timeout)
+
+    def stop(self, timeout=5.0):
+        self.flush(timeout)
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            written = self._counters["written"]
+            return dict(
+                self._counters,
+                queue_depth=len(self._pending),
+                max_queue=self.max_queue,
+                policy=self.policy,
+                write_ms_avg=(self._write_ms_total / written) if written else 0.0,
+                write_ms_max=self._write_ms_max,
+                latency_ms_avg=(self._latency_ms_total / written) if written else 0.0,
+                latency_ms_max=self._latency_ms_max,
+            )
+
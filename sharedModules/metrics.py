@@ -0,0 +1,254 @@
+import time
+import bisect
+import threading
+from collections import deque
+
+# Upper bounds in seconds, from sub-millisecond conversions up to
+# multi-second disk stalls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+DEFAULT_WINDOW = 512
+RATE_WINDOW_S = 10
+
+
+def _label_key(labels):
+    return tuple(sorted((labels or {}).items()))
+
+
+def _format_labels(key, extra=None):
+    items = list(key) + list(extra or [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for k, v in items)
+    return "{" + body + "}"
+
+
+def _call(fn):
+    # Callback metrics read the existing stats() of a component at scrape
+    # time, so the component does no extra work per frame. A failed read
+    # comes back as None: NaN in Prometheus text, null in JSON.
+    try:
+        value = fn()
+    except Exception:
+        return None
+    return None if value is None else float(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, fn=None):
+        self._value = 0.0
+        self._fn = fn
+        self._lock = threading.Lock()
+        self._events = deque()
+
+    def inc(self, amount=1.0):
+        # Increments are summed into one-second buckets, so the rate window
+        # costs at most RATE_WINDOW_S entries however fast the counter moves.
+        second = int(time.monotonic())
+        with self._lock:
+            self._value += amount
+            if self._events and self._events[-1][0] == second:
+                self._events[-1][1] += amount
+            else:
+                self._events.append([second, amount])
+                self._trim_locked(second)
+
+    def _trim_locked(self, second):
+        while self._events and self._events[0][0] <= second - RATE_WINDOW_S:
+            self._events.popleft()
+
+    def rate(self):
+        # Per-second rate over the last RATE_WINDOW_S, e.g. frames -> FPS.
+        # Counters read from a callback only know their total.
+        if self._fn is not None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            self._trim_locked(int(now))
+            if not self._events:
+                return 0.0
+            span = max(now - self._events[0][0], 1.0)
+            return sum(amount for _, amount in self._events) / span
+
+    @property
+    def value(self):
+        if self._fn is not None:
+            return _call(self._fn)
+        with self._lock:
+            return self._value
+
+    def samples(self):
+        return [("", None, self.value)]
+
+    def snapshot(self):
+        return {"value": self.value, "rate": self.rate()}
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, fn=None):
+        self._value = 0.0
+        self._fn = fn
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        self._value = value
+
+    def inc(self, amount=1.0):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1.0):
+        with self._lock:
+            self._value -= amount
+
+    @property
+    def value(self):
+        if self._fn is not None:
+            return _call(self._fn)
+        return self._value
+
+    def samples(self):
+        return [("", None, self.value)]
+
+    def snapshot(self):
+        return {"value": self.value}
+
+
+class Histogram:
+    # Cumulative buckets for Prometheus plus the last `window` observations
+    # for the rolling percentiles in the JSON snapshot.
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=DEFAULT_WINDOW):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += seconds
+            self._count += 1
+            self._recent.append(seconds)
+
+    def time(self):
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        samples = []
+        cumulative = 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            samples.append(("_bucket", (("le", repr(bound)),), cumulative))
+        samples.append(("_bucket", (("le", "+Inf"),), count))
+        samples.append(("_sum", None, total))
+        samples.append(("_count", None, count))
+        return samples
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            count, total = self._count, self._sum
+
+        def pct(q):
+            return recent[min(len(recent) - 1, int(q * len(recent)))] * 1000.0 if recent else None
+
+        return {
+            "count": count,
+            "mean_ms": (total / count) * 1000.0 if count else None,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": recent[-1] * 1000.0 if recent else None,
+        }
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._histogram.observe(time.perf_counter() - self._started)
+
+
+class MetricsRegistry:
+    # Metrics are created on first use and looked up by name and labels, so
+    # instrumented code can hold on to the returned object and skip the
+    # lookup on hot paths.
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._families = {}
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = _label_key(labels)
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = {"kind": cls.kind, "help": help_text, "metrics": {}}
+                self._families[name] = family
+            elif family["kind"] != cls.kind:
+                raise ValueError(f"Metric {name} is already registered as a {family['kind']}")
+            metric = family["metrics"].get(key)
+            if metric is None:
+                metric = cls(**kwargs)
+                family["metrics"][key] = metric
+            return metric
+
+    def counter(self, name, help_text="", labels=None, fn=None):
+        return self._get(Counter, name, help_text, labels, fn=fn)
+
+    def gauge(self, name, help_text="", labels=None, fn=None):
+        return self._get(Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text="", labels=None, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def stage(self, pipeline, stage, labels=None):
+        # Every pipeline reports its per-stage latency in the same family so
+        # stages can be compared side by side.
+        return self.histogram("stage_seconds", "Time spent in each pipeline stage",
+                              dict(labels or {}, pipeline=pipeline, stage=stage))
+
+    def render_prometheus(self):
+        lines = []
+        with self._lock:
+            families = [(name, dict(family, metrics=dict(family["metrics"]))) for name, family in sorted(self._families.items())]
+        for name, family in families:
+            full_name = self.prefix + name
+            if family["help"]:
+                lines.append(f"# HELP {full_name} {family['help']}")
+            lines.append(f"# TYPE {full_name} {family['kind']}")
+            for key, metric in family["metrics"].items():
+                for suffix, extra, value in metric.samples():
+                    value = "NaN" if value is None else value
+                    lines.append(f"{full_name}{suffix}{_format_labels(key, extra)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self):
+        with self._lock:
+            families = [(name, dict(family["metrics"])) for name, family in sorted(self._families.items())]
+        result = {}
+        for name, metrics in families:
+            entries = []
+            for key, metric in metrics.items():
+                entry = {"labels": dict(key)}
+                entry.update(metric.snapshot())
+                entries.append(entry)
+            result[self.prefix + name] = entries
+        return result
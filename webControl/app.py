@@ -9,7 +9,15 @@ import numpy as np
 import os
 import RPi.GPIO as GPIO
 
+# The metrics registry and image writer are shared with SecuritySystem
+# through the repository's sharedModules folder.
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sharedModules.metrics import MetricsRegistry
+from sharedModules.imageWriter import ImageWriter
+
 app = Flask(__name__)
+metrics = MetricsRegistry(prefix="webcontrol_")
+image_writer = ImageWriter()
 
 # Set up GPIO for LED and HC-SR04
 LED_PIN = 18
@@ -22,6 +30,26 @@ GPIO.setup(ECHO_PIN, GPIO.IN)
 GPIO.output(LED_PIN, GPIO.LOW)  # LED off initially
 GPIO.output(TRIG_PIN, GPIO.LOW)  # Trigger off initially
 
+# Per-stage timings for the MJPEG pipeline, exposed on /metrics
+read_time = metrics.stage("stream", "read")
+decode_time = metrics.stage("stream", "decode")
+transform_time = metrics.stage("stream", "zoom_flip")
+encode_time = metrics.stage("stream", "jpeg_encode")
+frames_streamed = metrics.counter("stream_frames_total", "Frames sent to viewers")
+frames_dropped = metrics.counter("stream_frames_dropped_total", "Frames that failed to decode or encode")
+stream_clients = metrics.gauge("stream_clients", "Connected MJPEG viewers")
+metrics.gauge("stream_fps", "Frames sent per second over the last few seconds", fn=frames_streamed.rate)
+metrics.gauge("image_writer_queue_depth", "Snapshots waiting to be written",
+              fn=lambda: image_writer.stats()["queue_depth"])
+for key, help_text in (("written", "Snapshots written to disk"),
+                       ("dropped", "Snapshots dropped because the writer queue was full"),
+                       ("failed", "Snapshots that failed to write")):
+    metrics.counter(f"image_writer_{key}_total", help_text, fn=lambda key=key: image_writer.stats()[key])
+metrics.gauge("image_writer_latency_seconds", "Average time from queueing a snapshot to it being on disk",
+              fn=lambda: image_writer.stats()["latency_ms_avg"] / 1000.0)
+metrics.gauge("image_writer_latency_max_seconds", "Longest time from queueing a snapshot to it being on disk",
+              fn=lambda: image_writer.stats()["latency_ms_max"] / 1000.0)
+
 class LibCameraStream:
     def __init__(self):
         self.process = None
@@ -134,20 +162,20 @@ class LibCameraStream:
                 # Copy the current frame
                 frame = self.current_frame.copy()
 
-            # Create photo directory if it doesn't exist
-            os.makedirs("static/photo", exist_ok=True)
-            
-            # Save the frame
+            # Encode and save the frame on the background writer
             timestamp = time.strftime("%Y%m%d_%H%M%S")
             filename = f"static/photo/snapshot_{timestamp}.jpg"
             
-            success = cv2.imwrite(filename, frame, [int(cv2.IMWRITE_JPEG_QUALITY), 95])
-            if success:
-                print(f"Snapshot saved as {filename}")
-                return True
-            else:
-                print("Failed to write image file")
-                return False
+            def saved(path, ok):
+                if ok:
+                    print(f"Snapshot saved as {path}")
+                else:
+                    print(f"Failed to write image file {path}")
+            
+            queued = image_writer.submit(filename, frame, [int(cv2.IMWRITE_JPEG_QUALITY), 95], on_done=saved)
+            if not queued:
+                print("Snapshot writer queue is full")
+            return queued
                 
         except Exception as e:
             print(f"Error saving snapshot: {e}")
@@ -187,10 +215,12 @@ class LibCameraStream:
         buffer = b''
         frame_count = 0
 
+        stream_clients.inc()
         try:
             while self.running and self.process and self.process.poll() is None:
                 try:
-                    chunk = self.process.stdout.read(8192)  # Larger buffer
+                    with read_time.time():
+                        chunk = self.process.stdout.read(8192)  # Larger buffer
                     if not chunk:
                         print("No more data from rpicam-vid")
                         break
@@ -205,15 +235,18 @@ class LibCameraStream:
                             break
                             
                         # Decode frame
-                        nparr = np.frombuffer(frame_data, np.uint8)
-                        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                        with decode_time.time():
+                            nparr = np.frombuffer(frame_data, np.uint8)
+                            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                         
                         if frame is None:
+                            frames_dropped.inc()
                             continue
 
                         # Apply digital zoom and mirror effect
-                        frame = self.apply_zoom(frame)
-                        frame = cv2.flip(frame, 1)  # Horizontal flip
+                        with transform_time.time():
+                            frame = self.apply_zoom(frame)
+                            frame = cv2.flip(frame, 1)  # Horizontal flip
                         
                         # Store current frame for snapshots
                         with self.frame_lock:
@@ -221,12 +254,15 @@ class LibCameraStream:
                             self.frame_ready.set()
                         
                         # Encode for streaming
-                        ret, encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+                        with encode_time.time():
+                            ret, encoded = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
                         if not ret:
+                            frames_dropped.inc()
                             continue
                             
                         frame_data = encoded.tobytes()
                         frame_count += 1
+                        frames_streamed.inc()
                         
                         yield (b'--frame\r\n'
                                b'Content-Type: image/jpeg\r\n\r\n' + frame_data + b'\r\n')
@@ -237,6 +273,8 @@ class LibCameraStream:
 
         except Exception as e:
             print(f"Error in frame generation: {e}")
+        finally:
+            stream_clients.dec()
         
         print(f"Generated {frame_count} frames")
 
@@ -343,6 +381,16 @@ def video_feed():
     return Response(camera_stream.generate_frames(),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/metrics')
+def metrics_text():
+    """Pipeline metrics in Prometheus text format"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/metrics.json')
+def metrics_json():
+    """Pipeline metrics as a JSON snapshot with rolling percentiles"""
+    return jsonify(metrics.snapshot())
+
 @app.route('/zoom_in')
 def zoom_in():
     """Increase zoom level"""